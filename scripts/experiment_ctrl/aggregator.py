@@ -0,0 +1,276 @@
+# Copyright (C) 2020 Freie Universität Berlin
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Long-lived connection to the IoT-LAB serial aggregator.
+
+The aggregator prefixes every line a node prints with a timestamp and the
+name of the node (`<timestamp>;<node>;<line>`) and sends every line it gets
+on its standard input prefixed with `<node>;` to that node (or to all nodes
+without a prefix). One reader thread dispatches the lines of each node to the
+requests waiting for them, so commands to different nodes can be answered
+concurrently.
+"""
+
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+
+__author__ = "Martine S. Lenders"
+__copyright__ = "Copyright 2020 Freie Universität Berlin"
+__license__ = "LGPL v2.1"
+__email__ = "m.lenders@fu-berlin.de"
+
+STARTED_PATTERN = re.compile(r"Aggregator started")
+NOT_MANAGED_PATTERN = re.compile(r"Node not managed: (\S+)")
+DEFAULT_START_TIMEOUT = 10
+DEFAULT_TIMEOUT = 3
+# seconds to wait for the aggregator to terminate before it is killed
+STOP_TIMEOUT = 1
+
+
+class AggregatorError(Exception):
+    pass
+
+
+class _Request:
+    """
+    Waits for lines of a node matching `patterns` one after another. Fails
+    when a line matches `error_pattern` after the first of `patterns` matched
+    (e.g. the echo of the command), even after all `patterns` matched. Error
+    lines before that belong to an earlier command.
+    """
+    def __init__(self, patterns, error_pattern=None):
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+        self.error_pattern = re.compile(error_pattern) \
+            if error_pattern is not None else None
+        self.matches = []
+        self.error = None
+        self.done = threading.Event()
+
+    def feed(self, msg):
+        """
+        Returns True if `msg` was consumed by this request
+        """
+        if self.matches and self.error_pattern is not None and \
+           self.error_pattern.search(msg) is not None:
+            if self.error is None:
+                self.fail(AggregatorError(msg))
+            return True
+        if len(self.matches) == len(self.patterns):
+            return False
+        match = self.patterns[len(self.matches)].search(msg)
+        if match is None:
+            return False
+        self.matches.append(match)
+        if len(self.matches) == len(self.patterns):
+            self.done.set()
+        return True
+
+    def fail(self, error):
+        self.error = error
+        self.done.set()
+
+
+class Aggregator:
+    """
+    Connection to a serial aggregator started with `command` (a list of
+    arguments, e.g. `ssh <user>@<site>.iot-lab.info serial_aggregator -i
+    <exp_id>` or a local process printing and reading the same format).
+
+    All output is written to the file set with `set_log()`.
+    """
+    def __init__(self, command):
+        self.command = command
+        self._process = None
+        self._reader = None
+        self._lock = threading.Lock()
+        # requests might be sent from several threads
+        self._send_lock = threading.Lock()
+        self._requests = {}
+        self._log = None
+        self._started = threading.Event()
+        self._terminated = False
+
+    @property
+    def running(self):
+        return self._process is not None and self._process.poll() is None
+
+    def start(self, timeout=DEFAULT_START_TIMEOUT):
+        self._started.clear()
+        self._terminated = False
+        # own process group, so the aggregator and everything it started
+        # (e.g. ssh) can be stopped at once
+        self._process = subprocess.Popen(
+            self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, start_new_session=True,
+        )
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+        if not self._started.wait(timeout) or self._terminated:
+            self.stop()
+            raise AggregatorError("Aggregator {} did not start"
+                                  .format(" ".join(self.command)))
+        return self
+
+    def stop(self):
+        if self._process is None:
+            return
+        try:
+            os.killpg(self._process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        try:
+            self._process.wait(STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            os.killpg(self._process.pid, signal.SIGKILL)
+            self._process.wait()
+        self._reader.join()
+        self._process.stdin.close()
+        self._process.stdout.close()
+        self._process = None
+        self.stop_log()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def set_log(self, logname):
+        """
+        Writes all following output of the aggregator to `logname`
+        """
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+            self._log = open(logname, "ab")
+
+    def stop_log(self):
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def _read(self):
+        for line in self._process.stdout:
+            with self._lock:
+                if self._log is not None:
+                    self._log.write(line)
+                    # others might follow the log, see RunLogWatcher
+                    self._log.flush()
+                self._dispatch(line.decode(errors="replace").rstrip("\r\n"))
+        with self._lock:
+            self._terminated = True
+            self._started.set()
+            for requests in self._requests.values():
+                for request in requests:
+                    request.fail(AggregatorError("Aggregator terminated"))
+            self._requests.clear()
+
+    def _dispatch(self, line):
+        if not self._started.is_set():
+            if STARTED_PATTERN.search(line):
+                self._started.set()
+            return
+        fields = line.split(";", 2)
+        match = NOT_MANAGED_PATTERN.search(line)
+        if match is not None:
+            for request in self._requests.pop(match.group(1), []):
+                request.fail(AggregatorError(
+                    "Network contains node not within the experiment: {}"
+                    .format(match.group(1))
+                ))
+            return
+        if len(fields) < 3:
+            return
+        node, msg = fields[1], fields[2]
+        requests = self._requests.get(node, [])
+        # the oldest request for the node gets the line first
+        for request in requests:
+            if request.feed(msg):
+                # requests with an error pattern watch for errors until they
+                # are removed by their sender
+                if request.done.is_set() and request.error_pattern is None:
+                    requests.remove(request)
+                break
+
+    def send(self, node, command):
+        """
+        Sends `command` to `node` or to all nodes if `node` is `None`
+        """
+        if node is not None:
+            command = "{};{}".format(node, command)
+        with self._send_lock:
+            if not self.running:
+                raise AggregatorError("Aggregator not running")
+            self._process.stdin.write("{}\n".format(command).encode())
+            self._process.stdin.flush()
+
+    def send_all(self, command):
+        self.send(None, command)
+
+    def try_request_all(self, commands, patterns, timeout=DEFAULT_TIMEOUT,
+                        error_pattern=None, settle_time=0):
+        """
+        Sends the command of each node in the dictionary `commands` and waits
+        for the output of each node to match `patterns` (a list or a list by
+        node) one after another. All commands are sent before waiting for the
+        output. A node fails if one of its lines matches `error_pattern`
+        after the first of its `patterns` matched, but before it answered or
+        within `settle_time` seconds after all nodes answered.
+
+        Returns the list of matches by node and the AggregatorError by node
+        that failed or did not answer within `timeout` seconds.
+        """
+        requests = {}
+        with self._lock:
+            for node in commands:
+                requests[node] = _Request(
+                    patterns[node] if isinstance(patterns, dict)
+                    else patterns, error_pattern
+                )
+                self._requests.setdefault(node, []).append(requests[node])
+        for node, command in commands.items():
+            self.send(node, command)
+        end = time.monotonic() + timeout
+        try:
+            for node, request in requests.items():
+                request.done.wait(max(0, end - time.monotonic()))
+            if settle_time:
+                time.sleep(settle_time)
+        finally:
+            with self._lock:
+                for node, request in requests.items():
+                    if request in self._requests.get(node, []):
+                        self._requests[node].remove(request)
+        matches = {}
+        errors = {}
+        for node, request in requests.items():
+            if request.error is not None:
+                errors[node] = request.error
+            elif not request.done.is_set():
+                errors[node] = AggregatorError("{} did not answer {}"
+                                               .format(node, commands[node]))
+            else:
+                matches[node] = request.matches
+        return matches, errors
+
+    def request_all(self, commands, patterns, timeout=DEFAULT_TIMEOUT):
+        """
+        Like `try_request_all()` but returns only the matches by node. Raises
+        the AggregatorError of the first node that failed.
+        """
+        matches, errors = self.try_request_all(commands, patterns, timeout)
+        for error in errors.values():
+            raise error
+        return matches
+
+    def request(self, node, command, patterns, timeout=DEFAULT_TIMEOUT):
+        return self.request_all({node: command}, patterns, timeout)[node]
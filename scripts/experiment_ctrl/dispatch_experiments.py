@@ -9,20 +9,35 @@
 # directory for more details.
 
 import argparse
+import calendar
+import concurrent.futures
 import csv
+import gzip
+import hashlib
+import inspect
+import json
+import lzma
+import math
 import os
 import logging
 import multiprocessing
-import pexpect
 import re
-import signal
+import shlex
+import shutil
 import subprocess
-import sys
+import threading
 import time
+import urllib.error
 import yaml
 
+from iotlabcli.experiment import get_experiment
 from iotlabcli.profile import ProfileM3
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 from iotlab_controller.common import get_default_api, get_uri
 from iotlab_controller.constants import IOTLAB_DOMAIN
 from iotlab_controller.experiment.base import ExperimentError
@@ -30,6 +45,8 @@ from iotlab_controller.riot import RIOTFirmware
 from iotlab_controller.experiment.tmux import TmuxExperiment
 from iotlab_controller.nodes import BaseNodes
 
+from aggregator import Aggregator, AggregatorError
+
 
 __author__ = "Martine S. Lenders"
 __copyright__ = "Copyright 2020 Freie Universität Berlin"
@@ -62,9 +79,164 @@ DEFAULT_SFR_PARAMS = {
     "frag": 4,      # fragment retries
     "dg": 0,        # datagram retries
 }
+SFR_ENV_MAPPING = {
+    "WIN_SIZE": "win",
+    "INTER_FRAME_GAP": "ifg",
+    "RETRY_TIMEOUT": "arq",
+    "RETRIES": "frag",
+    "DATAGRAM_RETRIES": "dg",
+}
+# can be replaced with a local process for testing
+AGGREGATOR_COMMAND = os.environ.get(
+    "AGGREGATOR_COMMAND",
+    "ssh {user}@{site}.{domain} serial_aggregator -i {exp_id}"
+)
 DEFAULT_DELAY = 1000
 DEFAULT_COUNT = 300
+LOG_COMPRESSIONS = {
+    "gz": gzip.open,
+    "xz": lzma.open,
+}
+if zstandard is not None:
+    LOG_COMPRESSIONS["zst"] = zstandard.open
+# seconds the size of a log has to stay the same before it is compressed
+LOG_SETTLE_TIME = 2
+# the consumer sends `count` interests for each of its names, see
+# app/consumer.c
+CONSUMER_MAX_NAMES = 2
+# seconds to wait for the response to the final interest of a run while the
+# log does not grow
+RUN_IDLE_TIMEOUT = 10
+# seconds the log has to be quiet after all nodes answered a stat command
+STAT_SETTLE_TIME = .2
+# maximum seconds to wait for the answers to a stat command
+STAT_TIMEOUT = 1
+# stat commands queried after each run with the first line of their listing
+# (see STATS_COMPILES in ../plots/parse_results.py); `ccnl_cs` lists only the
+# content store, which might be empty
+STAT_COMMANDS = {
+    "pktbuf": r"^packet buffer: first byte: ",
+    "6lo_frag": r"^frag full: ",
+    "ccnl_cs": None,
+}
+LOG_POLL_INTERVAL = .1
+# maximum seconds to wait for the nodes to acknowledge a configuration command
+CONFIG_TIMEOUT = 2
+# seconds to watch for error messages after all nodes acknowledged
+CONFIG_SETTLE_TIME = .2
+# number of times a configuration command is resent to a node
+CONFIG_RETRIES = 3
+# error messages of the produce and route commands, see app/producer.c and
+# app/routes.c, only counted after the node echoed the command
+CONFIG_ERROR_PATTERN = r"^(usage: |Unable to parse|Cannot convert|" \
+                       r"Prefix component|Too many components|" \
+                       r"shell: command not found)"
+# number of firmware variants built in parallel
+FIRMWARE_BUILDERS = multiprocessing.cpu_count()
+# estimated seconds to flash all nodes
+FLASH_DURATION = 60
+# estimated seconds to reset and configure the nodes and query their stats
+RUN_SETUP_DURATION = 15
+# minutes to add to the duration of an experiment for runs pushed to it
+EXP_SETUP_DURATION = 10
+# seconds to collect changes to the experiment descriptions before they are
+# written to their file
+DESCS_UPDATE_DELAY = 1
 logger = logging.getLogger("dispatch")
+# compresses the logs of finished runs while the next run is already going
+log_compressor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+
+def _build_threads():
+    if _cmake_version() <= (3, 13):
+        return multiprocessing.cpu_count()
+    else:
+        # see https://github.com/RIOT-OS/RIOT/issues/14288
+        return 1
+
+
+def _sfr_env(sfr_params):
+    return {
+        key: str(int(sfr_params.get(value, DEFAULT_SFR_PARAMS[value])))
+        for key, value in SFR_ENV_MAPPING.items()
+    }
+
+
+def firmware_env(mode, vrep, sfr_params, channel):
+    env = {"MODE": mode, "VREP": "1" if vrep else "0",
+           "DEFAULT_CHANNEL": str(channel)}
+    if mode == "sfr":
+        env.update(_sfr_env(sfr_params))
+    return env
+
+
+class FirmwareVariants:
+    """
+    Builds the firmware variants needed by the runs of an experiment in the
+    background while other runs are going. Every variant is built into its
+    own BINDIR, named by the hash of its environment, so switching between
+    variants only requires flashing and rebuilding a variant only rebuilds
+    what changed.
+    """
+    # the first build fetches and patches the packages shared by all builds
+    # in the application directory, so the other builds, also of concurrent
+    # experiments, wait until one build succeeded. If it fails, the next
+    # build becomes the first one.
+    _prepared = threading.Event()
+    _prepare_lock = threading.Lock()
+
+    def __init__(self, firmware, max_workers=FIRMWARE_BUILDERS):
+        self.firmware = firmware
+        self._builds = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+
+    @staticmethod
+    def key(env):
+        return hashlib.sha1(json.dumps(env, sort_keys=True).encode()) \
+            .hexdigest()[:12]
+
+    def _build(self, variant):
+        cls = type(self)
+        if not cls._prepared.is_set():
+            with cls._prepare_lock:
+                if not cls._prepared.is_set():
+                    logger.info("Building {}".format(variant.flashfile))
+                    variant.build(threads=_build_threads())
+                    cls._prepared.set()
+                    return variant
+        logger.info("Building {}".format(variant.flashfile))
+        variant.build(threads=_build_threads())
+        return variant
+
+    def get(self, env):
+        """
+        Returns a future for the firmware built with `env`, starting its
+        build if it is not already built or building or if its build failed
+        """
+        key = self.key(env)
+        future = self._builds.get(key)
+        if future is not None and future.done() and \
+           (future.cancelled() or future.exception() is not None):
+            del self._builds[key]
+        if key not in self._builds:
+            bindir = os.path.join(self.firmware.application_path, "bin",
+                                  "variants", key)
+            variant_env = dict(env, BINDIR=bindir)
+            variant = RIOTFirmware(
+                self.firmware.application_path, self.firmware.board,
+                self.firmware.application_name,
+                flashfile=os.path.join(bindir, "{}.elf".format(
+                    self.firmware.application_name
+                )),
+                env=variant_env,
+            )
+            self._builds[key] = self._executor.submit(self._build, variant)
+        return self._builds[key]
+
+    def shutdown(self):
+        for future in self._builds.values():
+            future.cancel()
+        self._executor.shutdown()
 
 
 def _cmake_version():
@@ -78,17 +250,213 @@ def _cmake_version():
     return int(m.group(1)), int(m.group(2))
 
 
+def compress_log(logname, compression):
+    """
+    Compresses `logname` to `<logname>.<compression>` and removes `logname`
+    once it did not grow for LOG_SETTLE_TIME seconds
+    """
+    size = -1
+    while size != os.stat(logname).st_size:
+        size = os.stat(logname).st_size
+        time.sleep(LOG_SETTLE_TIME)
+    compressed = "{}.{}".format(logname, compression)
+    with open(logname, "rb") as log, \
+            LOG_COMPRESSIONS[compression](compressed + ".tmp", "wb") as out:
+        shutil.copyfileobj(log, out, 1 << 20)
+    # only replace the log when it is completely compressed
+    os.replace(compressed + ".tmp", compressed)
+    os.remove(logname)
+    logger.info("Compressed {} to {}".format(logname, compressed))
+    return compressed
+
+
+def _compress_log_in_background(logname, compression):
+    def log_error(future):
+        if future.exception() is not None:
+            logger.error("Could not compress {}: {}"
+                         .format(logname, future.exception()))
+
+    if compression is None:
+        return
+    if compression not in LOG_COMPRESSIONS:
+        logger.error("Unsupported log compression {}, keeping {}"
+                     .format(compression, logname))
+        return
+    log_compressor.submit(compress_log, logname, compression) \
+        .add_done_callback(log_error)
+
+
+class RunLogWatcher:
+    """
+    Follows the log of a run as it is written by the serial aggregator to
+    react on the output of the nodes instead of sleeping for fixed times
+    """
+    def __init__(self, logname):
+        self.logname = logname
+        self.last_activity = time.monotonic()
+        self._logfile = None
+        self._rest = b""
+
+    def close(self):
+        if self._logfile is not None:
+            self._logfile.close()
+            self._logfile = None
+
+    def _lines(self):
+        """
+        Returns the complete lines written since the last call, split into
+        their fields
+        """
+        if self._logfile is None:
+            try:
+                self._logfile = open(self.logname, "rb")
+            except FileNotFoundError:
+                return []
+        chunk = self._logfile.read()
+        if not chunk:
+            return []
+        self.last_activity = time.monotonic()
+        block = self._rest + chunk
+        end = block.rfind(b"\n") + 1
+        self._rest = block[end:]
+        return [line.split(b";") for line in block[:end].splitlines()]
+
+    def _idle(self, timeout):
+        return (time.monotonic() - self.last_activity) >= timeout
+
+    def wait_for_consumer(self, last_name, deadline,
+                          idle_timeout=RUN_IDLE_TIMEOUT):
+        """
+        Waits until the consumer received the response to its final interest
+        for `last_name` or, if that interest was sent, until the log did not
+        grow for `idle_timeout` seconds. Returns False if neither happened
+        before `deadline` (in seconds since the epoch).
+        """
+        last_name = last_name.encode()
+        last_sent = False
+        while time.time() < deadline:
+            for fields in self._lines():
+                if len(fields) > 4 and fields[4] == last_name:
+                    if fields[2] == b"pr":
+                        return True
+                    last_sent = last_sent or fields[2] == b"qt"
+            if last_sent and self._idle(idle_timeout):
+                return True
+            time.sleep(LOG_POLL_INTERVAL)
+        return False
+
+    def wait_for_output(self, nodes, command, listing=None,
+                        timeout=STAT_TIMEOUT, settle_time=STAT_SETTLE_TIME):
+        """
+        Waits until all `nodes` echoed `command` and then printed a line
+        matching `listing` (if given), and the log was quiet for
+        `settle_time` seconds afterwards, but at most `timeout` seconds.
+        Other output, e.g. of earlier commands, is ignored.
+        """
+        patterns = [re.compile(r"^{}\s*$".format(re.escape(command)).encode())]
+        if listing is not None:
+            patterns.append(re.compile(listing.encode()))
+        # number of patterns already matched by node
+        pending = {node.encode(): 0 for node in nodes}
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            for fields in self._lines():
+                if len(fields) < 3 or fields[1] not in pending:
+                    continue
+                matched = pending[fields[1]]
+                if patterns[matched].search(b";".join(fields[2:])):
+                    if matched + 1 < len(patterns):
+                        pending[fields[1]] = matched + 1
+                    else:
+                        del pending[fields[1]]
+            if not pending and self._idle(settle_time):
+                return True
+            time.sleep(LOG_POLL_INTERVAL)
+        return False
+
+
+def _run_duration(run):
+    """
+    Returns the expected duration of `run` in seconds
+    """
+    delay = run.get("delay", DEFAULT_DELAY)
+    count = run.get("count", DEFAULT_COUNT)
+    default_run_duration = (((delay / 1000) * count) / 60) + 0.5
+    return run.get("duration", default_run_duration) * 60
+
+
+def _estimate_run(run, reflash):
+    """
+    Returns the maximum time `run` takes in seconds including the
+    setup of the nodes
+    """
+    # see `RunLogWatcher.wait_for_consumer()` call in `run_experiment()` for
+    # the additional minute
+    res = _run_duration(run) + 60 + RUN_SETUP_DURATION
+    if reflash:
+        res += FLASH_DURATION
+    return res
+
+
+def order_runs(runs, run_key, first_key=None):
+    """
+    Sorts `runs` in place so that runs with the same `run_key()` (e.g. the
+    firmware they need) follow each other, starting with the runs with
+    `first_key`. Otherwise, the order of the runs is kept.
+    """
+    order = {first_key: 0}
+    for run in runs:
+        order.setdefault(run_key(run), len(order))
+    runs.sort(key=lambda run: order[run_key(run)])
+
+
+def _experiment_end(exp, iotlab_api):
+    """
+    Returns the end of the reservation of `exp` in seconds since the epoch or
+    `None` if it is unknown
+    """
+    try:
+        info = get_experiment(iotlab_api, exp.exp_id)
+        start = calendar.timegm(time.strptime(info["start_date"],
+                                              "%Y-%m-%dT%H:%M:%SZ"))
+        return start + info["submitted_duration"] * 60
+    except (KeyError, TypeError, ValueError, urllib.error.HTTPError) as e:
+        logger.warning("Unable to get end of experiment {}: {}"
+                       .format(exp.exp_id, e))
+        return None
+
+
+def _push_run(exp, descs, run, estimate, pushed=None):
+    """
+    Moves `run` from the description of `exp` to the description `pushed` of
+    an unscheduled experiment. If `pushed` is `None`, a new one is created from
+    the description of `exp`. Returns `pushed`.
+    """
+    with descs.lock:
+        descs[exp.exp_id].get("runs").remove(run)
+        if pushed is None:
+            sched_params = inspect.signature(sched_experiment).parameters
+            pushed = {key: value for key, value in descs[exp.exp_id].items()
+                      if key in sched_params}
+            pushed["runs"] = []
+            pushed["duration"] = EXP_SETUP_DURATION
+            descs["unscheduled"] = descs.get("unscheduled", []) + [pushed]
+        pushed["runs"].append(run)
+        pushed["duration"] += int(math.ceil(estimate / 60))
+        descs.update_file()
+    return pushed
+
+
 def run_experiment(exp, mode, consumer, producers, forwarders,
                    sfr_params=None, sniff=False, runs=None, vrep=True,
-                   prefix=None, data_len=None, descs=None, inject_yaml=None):
+                   prefix=None, data_len=None, descs=None, inject_yaml=None,
+                   compress_logs=None):
     if runs is None:
         runs = []
     if sfr_params is None:
         sfr_params = DEFAULT_SFR_PARAMS
     if descs is None:
         descs = ExperimentDescriptions()
-    last_mode = mode
-    last_vrep = vrep
     consumer = exp.nodes[get_uri(exp.nodes.site, consumer)]
     producers = [exp.nodes[get_uri(exp.nodes.site, p)] for p in producers]
     forwarders = [exp.nodes[get_uri(exp.nodes.site, f)] for f in forwarders]
@@ -99,8 +467,9 @@ def run_experiment(exp, mode, consumer, producers, forwarders,
             # update runs
             runs = additional_runs + runs
             # and also update experiment description
-            descs[exp.exp_id] = additional_runs + descs[exp.exp_id]
-            descs.update_file()
+            with descs.lock:
+                descs[exp.exp_id] = additional_runs + descs[exp.exp_id]
+                descs.update_file()
             return True
         return False
 
@@ -108,115 +477,236 @@ def run_experiment(exp, mode, consumer, producers, forwarders,
     if not runs:
         logger.warning("No runs in experiment {}".format(exp.exp_id))
         return
-    if ("SSH_AUTH_SOCK" in os.environ) and ("SSH_AGENT_PID" in os.environ):
-        exp.cmd("export SSH_AUTH_SOCK='{}'"
-                .format(os.environ["SSH_AUTH_SOCK"]))
-        exp.cmd("export SSH_AGENT_PID='{}'"
-                .format(os.environ["SSH_AGENT_PID"]))
-    while len(runs):
-        for run in list(runs):
-            # TODO reschedule experiment when not enough time for run
-            if update_runs():
-                # restart loop with runs
-                break
-            run_mode = run.get("mode", mode)
-            if run_mode == "sfr":
-                run_mode += "-win{win:d}ifg{ifg:d}arq{arq}r{frag}dg{dg}{vrep}" \
-                    .format(vrep="-vrep" if run.get("vrep", vrep) else "",
-                            **run.get("sfr_params", sfr_params))
-            delay = run.get("delay", DEFAULT_DELAY)
-            count = run.get("count", DEFAULT_COUNT)
-            prefix = run.get("prefix", prefix)
-            data_len = run.get("data_len", data_len)
-            assert(prefix is not None and data_len is not None)
-            run_name = os.path.join(
-                DATA_PATH,
-                "{exp.name}_m{mode}-{count}x{delay}ms{data_len}B_{timestamp}"
-                .format(exp=exp, timestamp=int(time.time()), count=count,
-                        delay=delay, mode=run_mode, data_len=data_len)
-            )
-            if (last_vrep != run.get("vrep", vrep)) or \
-               (last_mode != run.get("mode", mode)) or \
-               (run.get("reflash")):
-                # reflash nodes
-                assert len(exp.firmwares) == 1
-                for firmware in exp.firmwares:
-                    firmware.env["MODE"] = run["mode"]
-                    firmware.env["VREP"] = "1" if run.get("vrep", 1) else "0"
-                    if _cmake_version() <= (3, 13):
-                        threads = multiprocessing.cpu_count()
-                    else:
-                        # see https://github.com/RIOT-OS/RIOT/issues/14288
-                        threads = 1
-                    firmware.build(threads=threads)
-                logger.info("Reflash {}".format(exp.firmwares[0]))
-                exp.nodes.flash(exp.exp_id, exp.firmwares[0])
-                last_mode = run["mode"]
-                descs[exp.exp_id]["mode"] = last_mode
-            else:
-                exp.nodes.reset(exp.exp_id)
-            default_run_duration = (((delay / 1000) * count) / 60) + 0.5
-            run_duration = run.get("duration", default_run_duration) * 60
-            if sniff:
-                sniffer = _start_sniffer(exp, "{}.pcap".format(run_name))
-            else:
-                sniffer = None
-            _load_l2addr_ifaces(exp)
-            exp.start_serial_aggregator(exp.nodes.site,
-                                        logname="{}.log".format(run_name))
-            exp.cmd("version")
-            for producer in producers:
-                logger.info("Configuring producer {}".format(producer))
-                exp.cmd("{};produce {}/{} {}".format(
-                    producer.uri.split(".")[0], prefix, producer.l2addr[:5],
-                    data_len
-                ))
-            logger.info("Constructing routes")
-            exp.cmd("{};route {} {}".format(
-                consumer.uri.split(".")[0], prefix, forwarders[0].l2addr
-            ))
-            for i, forwarder in enumerate(forwarders[:-1]):
-                exp.cmd("{};route {} {}".format(
-                    forwarder.uri.split(".")[0], prefix,
-                    forwarders[i + 1].l2addr
+    assert len(exp.firmwares) == 1
+    channel = exp.firmwares[0].env["DEFAULT_CHANNEL"]
+
+    def run_env(run):
+        return firmware_env(run.get("mode", mode), run.get("vrep", vrep),
+                            run.get("sfr_params", sfr_params), channel)
+
+    # the nodes were flashed with the firmware of the experiment
+    flashed = FirmwareVariants.key(firmware_env(mode, vrep, sfr_params,
+                                                channel))
+    variants = FirmwareVariants(exp.firmwares[0])
+    end = _experiment_end(exp, descs.iotlab_api)
+    pushed = None
+    for run in runs:
+        if FirmwareVariants.key(run_env(run)) != flashed:
+            variants.get(run_env(run))
+    # used for all runs, only restarted if it terminates
+    aggregator = Aggregator(_aggregator_command(exp))
+    try:
+        while len(runs):
+            # keep the runs needing the same firmware together to flash as
+            # rarely as possible; `runs` is part of the descriptions, which
+            # must not be written while it is sorted
+            with descs.lock:
+                order_runs(runs,
+                           lambda run: FirmwareVariants.key(run_env(run)),
+                           flashed)
+            for run in list(runs):
+                if update_runs():
+                    # restart loop with runs
+                    break
+                env = run_env(run)
+                reflash = (FirmwareVariants.key(env) != flashed) or \
+                    run.get("reflash")
+                estimate = _estimate_run(run, reflash)
+                if (end is not None) and (time.time() + estimate > end):
+                    logger.info("Run {} does not fit into experiment {} "
+                                "anymore, pushing it to a later experiment"
+                                .format(run, exp.exp_id))
+                    pushed = _push_run(exp, descs, run, estimate, pushed)
+                    continue
+                run_mode = run.get("mode", mode)
+                if run_mode == "sfr":
+                    run_mode += "-win{win:d}ifg{ifg:d}arq{arq}r{frag}" \
+                                "dg{dg}{vrep}".format(
+                                    vrep="-vrep" if run.get("vrep", vrep)
+                                    else "",
+                                    **run.get("sfr_params", sfr_params)
+                                )
+                delay = run.get("delay", DEFAULT_DELAY)
+                count = run.get("count", DEFAULT_COUNT)
+                prefix = run.get("prefix", prefix)
+                data_len = run.get("data_len", data_len)
+                assert(prefix is not None and data_len is not None)
+                run_name = os.path.join(
+                    DATA_PATH,
+                    "{exp.name}_m{mode}-{count}x{delay}ms{data_len}B_"
+                    "{timestamp}".format(
+                        exp=exp, timestamp=int(time.time()), count=count,
+                        delay=delay, mode=run_mode, data_len=data_len
+                    )
+                )
+                if reflash:
+                    # reflash nodes, waiting for the build if it is not done
+                    # yet
+                    firmware = variants.get(env).result()
+                    logger.info("Reflash {}".format(firmware.flashfile))
+                    exp.nodes.flash(exp.exp_id, firmware)
+                    flashed = FirmwareVariants.key(env)
+                    with descs.lock:
+                        descs[exp.exp_id]["mode"] = env["MODE"]
+                else:
+                    exp.nodes.reset(exp.exp_id)
+                run_duration = _run_duration(run)
+                if sniff:
+                    sniffer = _start_sniffer(exp, "{}.pcap".format(run_name))
+                else:
+                    sniffer = None
+                if not aggregator.running:
+                    aggregator.start()
+                _load_l2addr_ifaces(exp, aggregator)
+                log = RunLogWatcher("{}.log".format(run_name))
+                aggregator.set_log("{}.log".format(run_name))
+                nodes = [node.uri.split(".")[0]
+                         for node in [consumer] + forwarders + producers]
+                aggregator.send_all("version")
+                # the answer to `version` must not be taken as an answer to the
+                # configuration commands
+                log.wait_for_output(nodes, "version")
+                logger.info("Configuring nodes")
+                setup_start = time.monotonic()
+                configure_nodes(aggregator, config_commands(
+                    prefix, data_len, consumer, forwarders, producers
                 ))
-            for producer in producers:
-                exp.cmd("{};route {}/{} {}".format(
-                    forwarders[-1].uri.split(".")[0], prefix,
-                    producer.l2addr[:5], producer.l2addr
+                logger.info("Configured nodes of {} in {:.2f}s".format(
+                    run_name, time.monotonic() - setup_start
                 ))
-            logger.info("Starting experiment")
-            exp.cmd("{};consume {} {} {}".format(
-                consumer.uri.split(".")[0], delay, count,
-                ' '.join([
-                    "{}/{}".format(prefix, producer.l2addr[:5])
-                    for producer in producers
-                ])
-            ))
-            logger.info(
-                "Waiting for {}s for experiment {} (until {}) to finish"
-                .format(run_duration, run_name,
-                        time.asctime(time.localtime(time.time() +
-                                                    run_duration))))
-
-            time.sleep(run_duration + 60)
-            exp.hit_enter()
-            exp.cmd("pktbuf")
-            time.sleep(1)
-            exp.cmd("6lo_frag")
-            time.sleep(1)
-            exp.cmd("ccnl_cs")
-            time.sleep(1)
-            exp.stop_serial_aggregator()
-            _stop_sniffer(sniffer)
-            descs[exp.exp_id].get("runs").remove(run)
-            descs.update_file()
+                logger.info("Starting experiment")
+                aggregator.send(consumer.uri.split(".")[0],
+                                "consume {} {} {}".format(
+                                    delay, count,
+                                    ' '.join([
+                                        "{}/{}".format(prefix,
+                                                       producer.l2addr[:5])
+                                        for producer in producers
+                                    ])
+                                ))
+                logger.info(
+                    "Waiting up to {}s for experiment {} (until {}) to finish"
+                    .format(run_duration, run_name,
+                            time.asctime(time.localtime(time.time() +
+                                                        run_duration))))
+                # the interests are numbered from 0, see app/consumer.c
+                if log.wait_for_consumer(
+                    "{:05d}".format(count * CONSUMER_MAX_NAMES - 1),
+                    time.time() + run_duration + 60
+                ):
+                    logger.info("Consumer finished {}".format(run_name))
+                else:
+                    logger.warning("Consumer did not finish {} in time"
+                                   .format(run_name))
+                aggregator.send_all("")
+                for stat_cmd, listing in STAT_COMMANDS.items():
+                    aggregator.send_all(stat_cmd)
+                    if not log.wait_for_output(nodes, stat_cmd, listing):
+                        logger.warning("Not all nodes answered {} in {}"
+                                       .format(stat_cmd, run_name))
+                log.close()
+                aggregator.stop_log()
+                _compress_log_in_background("{}.log".format(run_name),
+                                            compress_logs)
+                _stop_sniffer(sniffer)
+                with descs.lock:
+                    descs[exp.exp_id].get("runs").remove(run)
+                    descs.update_file()
+                    descs.log_run(exp.exp_id, run, "{}.log".format(run_name))
+    finally:
+        variants.shutdown()
+        aggregator.stop()
+
+
+def config_commands(prefix, data_len, consumer, forwarders, producers):
+    """
+    Returns the commands configuring the producers and the routes from the
+    consumer along the forwarders to the producers as lists by node name
+    """
+    res = {}
+
+    def add(node, command):
+        res.setdefault(node.uri.split(".")[0], []).append(command)
+
+    for producer in producers:
+        add(producer, "produce {}/{} {}".format(prefix, producer.l2addr[:5],
+                                                data_len))
+    add(consumer, "route {} {}".format(prefix, forwarders[0].l2addr))
+    for i, forwarder in enumerate(forwarders[:-1]):
+        add(forwarder, "route {} {}".format(prefix, forwarders[i + 1].l2addr))
+    for producer in producers:
+        add(forwarders[-1], "route {}/{} {}".format(
+            prefix, producer.l2addr[:5], producer.l2addr
+        ))
+    return res
+
+
+def _config_ack_patterns(command):
+    # the shell echoes every command, see SHELL_NO_PROMPT in app/Makefile
+    res = [r"{}\s*$".format(re.escape(command))]
+    if command.startswith("produce "):
+        # a retried produce command finds the producer already started
+        res.append(r"^(Started producer|Producer already started)")
+    return res
+
+
+def _configure_node(aggregator, node, commands, retries, timeout, abort):
+    for command in commands:
+        tries = 0
+        while not abort.is_set():
+            _, errors = aggregator.try_request_all(
+                {node: command}, {node: _config_ack_patterns(command)},
+                timeout=timeout, error_pattern=CONFIG_ERROR_PATTERN,
+                settle_time=CONFIG_SETTLE_TIME,
+            )
+            if node not in errors:
+                break
+            tries += 1
+            if tries > retries:
+                raise ExperimentError(
+                    "{} did not acknowledge '{}': {}"
+                    .format(node, command, errors[node])
+                )
+            logger.warning("Resending '{}' to {} ({})"
+                           .format(command, node, errors[node]))
+
+
+def configure_nodes(aggregator, commands, retries=CONFIG_RETRIES,
+                    timeout=CONFIG_TIMEOUT):
+    """
+    Sends the configuration `commands` (lists by node name) to the nodes.
+    The nodes are configured in parallel, each node gets its next command
+    as soon as it acknowledged the previous one, independent of the other
+    nodes. Commands a node did not acknowledge are resent up to `retries`
+    times before an ExperimentError is raised.
+    """
+    commands = {node: node_commands
+                for node, node_commands in commands.items() if node_commands}
+    if not commands:
+        return
+    # stops the other nodes once one of them failed
+    abort = threading.Event()
+    with concurrent.futures.ThreadPoolExecutor(len(commands)) as executor:
+        futures = [
+            executor.submit(_configure_node, aggregator, node, node_commands,
+                            retries, timeout, abort)
+            for node, node_commands in commands.items()
+        ]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+        finally:
+            abort.set()
 
 
 def _start_sniffer(exp, pcap_file):
-    sniffer = exp.tmux_session.session.find_where({"window_name": "sniffer"})
+    # experiments might share a TMUX session, see `start_experiments()`
+    window_name = "sniffer-{}".format(exp.name)
+    sniffer = exp.tmux_session.session.find_where(
+        {"window_name": window_name}
+    )
     if sniffer is None:
-        sniffer = exp.tmux_session.session.new_window("sniffer", DATA_PATH,
+        sniffer = exp.tmux_session.session.new_window(window_name, DATA_PATH,
                                                       attach=False)
     sniffer = sniffer.select_pane(0)
     if ("SSH_AUTH_SOCK" in os.environ) and ("SSH_AGENT_PID" in os.environ):
@@ -266,49 +756,41 @@ def _load_l2addr_ifaces_file(exp, l2addr_filename):
     return loaded
 
 
-def _load_l2addr_ifaces(exp):
+def _aggregator_command(exp):
+    return shlex.split(AGGREGATOR_COMMAND.format(
+        user=exp.username, site=exp.nodes.site, domain=IOTLAB_DOMAIN,
+        exp_id=exp.exp_id
+    ))
+
+
+def _load_l2addr_ifaces(exp, aggregator):
     logger.info("Loading interfaces and L2 addresses of nodes")
     l2addr_filename = _node_l2addr_file(exp)
     if _load_l2addr_ifaces_file(exp, l2addr_filename) == len(exp.nodes):
         return
-    child = pexpect.spawnu(
-            "ssh {}@{}.{} serial_aggregator -i {}".format(
-                    exp.username, exp.nodes.site, IOTLAB_DOMAIN, exp.exp_id
-                ),
-            timeout=3
+    nodes = {node.uri.split(".")[0]: node for node in exp.nodes}
+    try:
+        # ask all nodes at once
+        res = aggregator.request_all(
+            {nodename: "ifconfig" for nodename in nodes},
+            [r"Iface\s+(\d+)", r"Long HWaddr: ([0-9A-F:]+)"],
+            timeout=10,
         )
-    child.expect("Aggregator started", timeout=10)
-    child.logfile = sys.stdout
+    except AggregatorError as e:
+        raise ExperimentError(str(e))
     with open(l2addr_filename, "w") as l2addr_file:
         l2addr_csv = csv.DictWriter(l2addr_file,
                                     ["name", "iface", "l2addr"])
         l2addr_csv.writeheader()
-        for node in exp.nodes:
-            nodename = node.uri.split(".")[0]
-            child.sendline("{};ifconfig".format(nodename))
-            res = child.expect([r"{};Iface\s+(\d+)".format(nodename),
-                                r"Node not managed: m3-(\d+)"])
-            if res > 0:
-                raise ExperimentError("Network contains node not within "
-                                      "the experiment: m3-{}"
-                                      .format(child.match.group(1)))
-            node.iface = int(child.match.group(1))
-            child.expect(r"{};\s+Long HWaddr: ([0-9A-F:]+)\s"
-                         .format(nodename))
-            node.l2addr = child.match.group(1)
+        for nodename, node in nodes.items():
+            iface_match, l2addr_match = res[nodename]
+            node.iface = int(iface_match.group(1))
+            node.l2addr = l2addr_match.group(1)
             l2addr_csv.writerow({
                 "name": nodename,
                 "iface": node.iface,
                 "l2addr": node.l2addr,
             })
-    while not child.terminated:
-        try:
-            os.killpg(os.getpgid(child.pid), signal.SIGKILL)
-        except ProcessLookupError:
-            break
-        else:
-            child.close()
-            time.sleep(5)
 
 
 def load_additional_runs(inject_yaml=None):
@@ -324,31 +806,157 @@ class ExperimentDescriptions(dict):
     class Error(Exception):
         pass
 
-    def __init__(self, filename=None, iotlab_api=None, *args, **kwargs):
+    def __init__(self, filename=None, iotlab_api=None, *args, journal=None,
+                 **kwargs):
         super().__init__(*args, **kwargs)
         self.filename = filename
+        self.journal = journal
+        # experiments run concurrently, so hold this lock when changing the
+        # descriptions
+        self.lock = threading.RLock()
+        self._update_timer = None
         if iotlab_api is None:
             self.iotlab_api = get_default_api()
         else:
             self.iotlab_api = iotlab_api
 
+    # experiments are added or removed when they are (un)scheduled, which
+    # must not be lost in a crash, so these changes are written immediately
+
     def __setitem__(self, key, value):
-        super().__setitem__(key, value)
-        self.update_file()
+        with self.lock:
+            super().__setitem__(key, value)
+            self.flush()
         return value
 
     def __delitem__(self, key):
-        super().__delitem__(key)
-        self.update_file()
+        with self.lock:
+            super().__delitem__(key)
+            self.flush()
 
     def update_file(self):
+        """
+        Writes the descriptions to their file within DESCS_UPDATE_DELAY
+        seconds, together with all other changes until then
+        """
+        with self.lock:
+            if self._update_timer is None:
+                self._update_timer = threading.Timer(DESCS_UPDATE_DELAY,
+                                                     self.flush)
+                self._update_timer.start()
+
+    def flush(self):
+        """
+        Writes the descriptions to their file immediately
+        """
+        with self.lock:
+            if self._update_timer is not None:
+                self._update_timer.cancel()
+                self._update_timer = None
+            self._update_file()
+
+    def _update_file(self):
         if len(self) and self.filename:
-            with open(self.filename, "w") as yamlf:
+            # write to a temporary file first, so the file is never left
+            # partially written
+            with open(self.filename + ".tmp", "w") as yamlf:
                 yamlf.write(yaml.dump(dict(self.items())))
-        elif self.filename:
+                yamlf.flush()
+                os.fsync(yamlf.fileno())
+            os.replace(self.filename + ".tmp", self.filename)
+            # all runs logged to the journal up to here are in the file
+            self._truncate_journal()
+        elif self.filename and os.path.exists(self.filename):
             os.rename(self.filename,
                       self.filename + "." + str(int(time.time())) + ".bkp")
 
+    def _truncate_journal(self):
+        if self.journal is None or not os.path.exists(self.journal):
+            return
+        with open(self.journal, "w") as journal:
+            os.fsync(journal.fileno())
+
+    def _append_journal(self, entry):
+        if self.journal is None:
+            return
+        with open(self.journal, "a") as journal:
+            journal.write(json.dumps(entry) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def log_run(self, exp_id, run, logname):
+        """
+        Appends a completed `run` of experiment `exp_id` to the journal
+        """
+        with self.lock:
+            self._append_journal({"time": time.time(), "exp_id": exp_id,
+                                  "run": run, "log": logname})
+
+    def _journal_entries(self):
+        """
+        Returns the entries of the journal. An incomplete last entry, e.g.
+        from a crash while it was appended, is removed from the journal.
+        """
+        with open(self.journal, "rb") as journal:
+            data = journal.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            logger.warning("Removing incomplete last entry {!r} from {}"
+                           .format(data[end:], self.journal))
+            with open(self.journal, "r+b") as journal:
+                journal.truncate(end)
+        entries = []
+        for line in data[:end].splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                logger.warning("Ignoring invalid entry {!r} in {}"
+                               .format(line, self.journal))
+        return entries
+
+    def mark_failed(self, exp_id, error):
+        """
+        Marks experiment `exp_id` as failed with `error`, so it is kept in the
+        file, but not conducted again
+        """
+        with self.lock:
+            if isinstance(self.get(exp_id), dict):
+                self[exp_id]["failed"] = str(error)
+                self.flush()
+
+    def failed(self, exp_id):
+        return isinstance(self.get(exp_id), dict) and "failed" in self[exp_id]
+
+    def pending(self):
+        """
+        Returns the IDs of the experiments (and `unscheduled`) that did not
+        fail
+        """
+        with self.lock:
+            return [exp_id for exp_id in self if not self.failed(exp_id)]
+
+    def replay_journal(self):
+        """
+        Removes the runs that were logged to the journal as completed but were
+        not written to the file anymore before the last crash. The journal is
+        truncated whenever the file was written, so all its entries are
+        replayed.
+        """
+        if self.journal is None or not os.path.exists(self.journal):
+            return
+        replayed = False
+        with self.lock:
+            for entry in self._journal_entries():
+                runs = self.get(entry.get("exp_id"), {}).get("runs", [])
+                if "run" in entry and entry["run"] in runs:
+                    logger.info("Removing completed run {} of {} from {}"
+                                .format(entry["run"], entry["exp_id"],
+                                        self.filename))
+                    runs.remove(entry["run"])
+                    replayed = True
+            if replayed:
+                self.flush()
+
     def _schedule_unscheduled(self, unscheduled):
         exps = []
         if not isinstance(unscheduled, list):
@@ -361,7 +969,8 @@ class ExperimentDescriptions(dict):
             exp = sched_experiment(descs=self, iotlab_api=self.iotlab_api,
                                    **desc)
             self["unscheduled"].remove(desc)
-            self.update_file()
+            # do not schedule it again after a crash
+            self.flush()
             exps.append(exp)
         del self["unscheduled"]
         return exps
@@ -373,6 +982,10 @@ class ExperimentDescriptions(dict):
             if exp_id == "unscheduled":
                 exps.extend(self._schedule_unscheduled(desc))
                 continue
+            if self.failed(exp_id):
+                logger.warning("Skipping experiment {} as it failed: {}"
+                               .format(exp_id, desc["failed"]))
+                continue
             # else requeue existing experiments
             try:
                 if not isinstance(exp_id, int):
@@ -406,6 +1019,7 @@ def desc_to_exp_params(desc, iotlab_api=None, descs=None):
         "sniff": desc["sniff"],
         "prefix": desc["prefix"],
         "data_len": desc["data_len"],
+        "compress_logs": desc.get("compress_logs"),
     }
     assert(isinstance(desc["forwarders"], list))
     if iotlab_api is None:
@@ -416,23 +1030,9 @@ def desc_to_exp_params(desc, iotlab_api=None, descs=None):
     if descs is not None:
         params["descs"] = descs
 
-    env = {"MODE": desc["mode"], "VREP": "1" if desc.get("vrep", 1) else "0",
-           "DEFAULT_CHANNEL": str(desc["channel"])}
-    if desc["mode"] == "sfr":
-        env_mapping = {
-            "WIN_SIZE": "win",
-            "INTER_FRAME_GAP": "ifg",
-            "RETRY_TIMEOUT": "arq",
-            "RETRIES": "frag",
-            "DATAGRAM_RETRIES": "dg",
-        }
-
-        for key, value in env_mapping.items():
-            env[key] = str(int(
-                desc.get("sfr_params", DEFAULT_SFR_PARAMS).get(
-                    value, DEFAULT_SFR_PARAMS[value]
-                )
-            ))
+    env = firmware_env(desc["mode"], desc.get("vrep", True),
+                       desc.get("sfr_params", DEFAULT_SFR_PARAMS),
+                       desc["channel"])
     params["firmwares"] = [RIOTFirmware(desc["firmware_path"],
                                         desc.get("board", BOARD),
                                         FIRMWARE_NAME, env=env)]
@@ -456,19 +1056,15 @@ def sched_experiment(consumer, forwarders, producers,
                      firmware_path=DEFAULT_FIRMWARE_PATH, vrep=True,
                      mode=DEFAULT_MODE, sfr_params=DEFAULT_SFR_PARAMS,
                      channel=DEFAULT_CHANNEL, prefix=None, data_len=None,
-                     sniff=False, runs=None, descs=None, iotlab_api=None):
+                     sniff=False, runs=None, compress_logs=None, descs=None,
+                     iotlab_api=None):
     desc = locals()
     del desc["iotlab_api"]
     del desc["descs"]
     params = desc_to_exp_params(desc, iotlab_api, descs)
     logger.info("Building firmwares")
     for firmware in params["firmwares"]:
-        if _cmake_version() <= (3, 13):
-            threads = multiprocessing.cpu_count()
-        else:
-            # see https://github.com/RIOT-OS/RIOT/issues/14288
-            threads = 1
-        firmware.build(threads=threads)
+        firmware.build(threads=_build_threads())
     # create and prepare IoT-LAB experiment
     exp = TmuxExperiment(**params)
     logger.info("Scheduling experiment {exp.name} with duration {duration}"
@@ -484,10 +1080,13 @@ def load_descs(args, iotlab_api=None):
         with open(args.descs_yaml) as yamlf:
             descs = ExperimentDescriptions(
                 args.descs_yaml, iotlab_api,
-                yaml.load(yamlf, Loader=yaml.FullLoader)
+                yaml.load(yamlf, Loader=yaml.FullLoader),
+                journal=args.journal,
             )
     except FileNotFoundError:
-        descs = ExperimentDescriptions(args.descs_yaml, iotlab_api)
+        descs = ExperimentDescriptions(args.descs_yaml, iotlab_api,
+                                       journal=args.journal)
+    descs.replay_journal()
     exps = descs.schedule()
     exps.sort(key=lambda exp: exp.exp_id)
     return descs, exps
@@ -520,27 +1119,60 @@ def _parse_tmux_target(tmux_target, name):
     return res
 
 
+def start_experiment(exp, descs, tmux_target):
+    logger.info("Waiting for experiment {} to start".format(exp.exp_id))
+    try:
+        exp.wait()
+    except (ExperimentError, RuntimeError) as e:
+        logger.error("Could not wait for experiment {}: {}"
+                     .format(exp.exp_id, e))
+        del descs[exp.exp_id]
+        return
+    logger.info("Starting TMUX session in {}".format(tmux_target))
+    tmux_session = exp.initialize_tmux_session(**tmux_target)
+    assert tmux_session
+    exp.hit_ctrl_c()    # Kill potentially still running experiment
+    exp.hit_ctrl_c()    # Kill potentially still running experiment
+    time.sleep(.1)
+    exp.run()
+    del descs[exp.exp_id]
+
+
+def _start_experiment_safe(exp, descs, tmux_target):
+    try:
+        start_experiment(exp, descs, tmux_target)
+    except Exception as e:
+        # keep the other experiments going, but do not requeue this one
+        logger.exception("Experiment {} failed".format(exp.exp_id))
+        descs.mark_failed(exp.exp_id, e)
+
+
 def start_experiments(exps, descs, args):
     if not exps:
         logger.warning("No experiments to run")
-        descs.clear()
-    for exp in exps:
-        logger.info("Waiting for experiment {} to start".format(exp.exp_id))
-        try:
-            exp.wait()
-        except (ExperimentError, RuntimeError) as e:
-            logger.error("Could not wait for experiment: {}".format(e))
-            del descs[exp.exp_id]
-            return
-        tmux_target = _parse_tmux_target(args.tmux_target, exp.name)
-        logger.info("Starting TMUX session in {}".format(tmux_target))
-        tmux_session = exp.initialize_tmux_session(**tmux_target)
-        assert tmux_session
-        exp.hit_ctrl_c()    # Kill potentially still running experiment
-        exp.hit_ctrl_c()    # Kill potentially still running experiment
-        time.sleep(.1)
-        exp.run()
-        del descs[exp.exp_id]
+        # keep the failed experiments for inspection
+        for exp_id in descs.pending():
+            del descs[exp_id]
+        return
+    jobs = args.jobs or len(exps)
+    if jobs == 1:
+        for exp in exps:
+            _start_experiment_safe(
+                exp, descs, _parse_tmux_target(args.tmux_target, exp.name)
+            )
+        return
+    # the experiments use disjoint nodes, so they can be conducted
+    # concurrently, each in its own TMUX session (or window of the TMUX
+    # target's session), named by experiment name and ID as names might be
+    # shared
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        for exp in exps:
+            name = "{}-{}".format(exp.name, exp.exp_id)
+            tmux_target = _parse_tmux_target(args.tmux_target, name)
+            if args.tmux_target is not None:
+                tmux_target = {"session_name": tmux_target["session_name"],
+                               "window_name": name}
+            executor.submit(_start_experiment_safe, exp, descs, tmux_target)
 
 
 def main():
@@ -548,6 +1180,14 @@ def main():
     parser.add_argument("-t", "--tmux-target", default=None,
                         help="TMUX target for experiment control "
                              "(default: the IoT-LAB experiment name)")
+    parser.add_argument("-j", "--jobs", default=1, type=int,
+                        help="Number of experiments to conduct concurrently "
+                             "(0: all, default: 1)")
+    parser.add_argument("--journal", default=None,
+                        help="File to log completed runs to. Runs logged "
+                             "there are removed from the experiment "
+                             "descriptions on start if their removal did not "
+                             "make it into descs_yaml anymore")
     parser.add_argument("descs_yaml", nargs="?",
                         default=os.path.join(SCRIPT_PATH, "descs.yaml"))
     parser.add_argument("inject_yaml", nargs="?",
@@ -556,8 +1196,16 @@ def main():
     logger.setLevel(logging.INFO)
     api = get_default_api()
     descs, exps = load_descs(args, api)
-    while (len(descs)):     # check if there are still experiments to run
+    # check if there are still experiments to run
+    while (len(descs.pending())):
         start_experiments(exps, descs, args)
+        # schedule experiments for runs that did not fit into their
+        # experiment
+        exps = descs.schedule()
+        exps.sort(key=lambda exp: exp.exp_id)
+    descs.flush()
+    # wait for the logs of the last runs to be compressed
+    log_compressor.shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,185 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright (C) 2020 Freie Universität Berlin
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Emulates the IoT-LAB serial aggregator and the shell of nodes running the
+application in ../../app, so dispatch_experiments.py and aggregator.py can be
+tested without the IoT-LAB, e.g. with
+
+    AGGREGATOR_COMMAND="./fake_aggregator.py m3-1 m3-2 m3-3 m3-4" \\
+        ./dispatch_experiments.py
+
+Each node handles its commands one after another like the shell of a node
+does, so its output keeps the order of the commands.
+"""
+
+import argparse
+import queue
+import random
+import re
+import sys
+import threading
+import time
+
+__author__ = "Martine S. Lenders"
+__copyright__ = "Copyright 2020 Freie Universität Berlin"
+__license__ = "LGPL v2.1"
+__email__ = "m.lenders@fu-berlin.de"
+
+# the consumer requests `count` chunks for each of its names, see
+# app/consumer.c
+MAX_NAMES = 2
+# seconds a node takes to answer a command
+ANSWER_DELAY = .01
+# seconds from an interest to its content
+TTC = .005
+L2ADDR_PATTERN = re.compile(r"^[0-9A-Fa-f]{2}(:[0-9A-Fa-f]{2})*$")
+
+
+class FakeNode:
+    def __init__(self, aggregator, name, drop=0):
+        self.aggregator = aggregator
+        self.name = name
+        self.drop = drop
+        # e.g. 12 for m3-12
+        number = name.rsplit("-", 1)[-1]
+        number = int(number) if number.isdigit() else 0
+        self.iface = 5 + number % 2
+        self.l2addr = "15:11:6B:10:65:F8:{:02X}:{:02X}".format(
+            (number >> 8) & 0xff, number & 0xff
+        )
+        self.producer_started = False
+        self._commands = queue.Queue()
+        threading.Thread(target=self._shell, daemon=True).start()
+
+    def out(self, line):
+        self.aggregator.out(self.name, line)
+
+    def send(self, command):
+        self._commands.put(command)
+
+    def _shell(self):
+        while True:
+            command = self._commands.get()
+            if self.aggregator.rand.random() < self.drop:
+                # lost on the serial line
+                continue
+            time.sleep(ANSWER_DELAY)
+            self.handle(command)
+
+    def handle(self, command):
+        args = command.split()
+        if not args:
+            return
+        # the shell echoes every command, see SHELL_NO_PROMPT in app/Makefile
+        self.out(command)
+        handler = getattr(self, "cmd_{}".format(args[0]), None)
+        if handler is None:
+            self.out("shell: command not found: {}".format(args[0]))
+        else:
+            handler(args)
+
+    def cmd_ifconfig(self, args):
+        self.out("Iface  {}  HWaddr: {}  Channel: 26  Page: 0  NID: 0x23"
+                 .format(self.iface, self.l2addr[-5:]))
+        self.out("        Long HWaddr: {} ".format(self.l2addr))
+
+    def cmd_produce(self, args):
+        if self.producer_started:
+            self.out("Producer already started")
+            return
+        if len(args) < 3 or not args[2].isdigit():
+            self.out("usage: {} <prefix> <data_len>".format(args[0]))
+            return
+        for i, comp in enumerate(args[1].strip("/").split("/")):
+            self.out("prefix comp [i={}]={}".format(i, comp))
+        self.producer_started = True
+        self.out("Started producer")
+
+    def cmd_route(self, args):
+        if len(args) < 3:
+            self.out("usage: {} <prefix> <next hop l2>".format(args[0]))
+        elif not L2ADDR_PATTERN.match(args[2]):
+            self.out("Unable to parse next hop address")
+
+    def cmd_consume(self, args):
+        if len(args) < 4:
+            self.out("usage: {} <delay> <count> <name> [<name> [...]]"
+                     .format(args[0]))
+            return
+        delay, count = int(args[1]), int(args[2])
+        start = time.time()
+        for i in range(count * MAX_NAMES):
+            xtimer = int((time.time() - start) * 1000000)
+            self.out("qt;{};{:05d}".format(xtimer, i))
+            time.sleep(TTC)
+            xtimer = int((time.time() - start) * 1000000)
+            self.out("pr;{};{:05d}".format(xtimer, i))
+            time.sleep(max(0, delay / 1000 / MAX_NAMES - TTC))
+
+    def cmd_pktbuf(self, args):
+        self.out("packet buffer: first byte: 0x20000d10, last byte: "
+                 "0x20002510 (size: 6144)")
+        self.out("  position of last byte used: 1024")
+
+    def cmd_6lo_frag(self, args):
+        self.out("frag full: 0")
+        self.out("rbuf full: 0")
+
+    def cmd_ccnl_cs(self, args):
+        pass
+
+
+class FakeAggregator:
+    def __init__(self, nodes, drop=0, seed=None):
+        self.rand = random.Random(seed)
+        self._lock = threading.Lock()
+        self.nodes = {name: FakeNode(self, name, drop) for name in nodes}
+
+    def out(self, node, line):
+        with self._lock:
+            sys.stdout.write("{:.6f};{};{}\n".format(time.time(), node, line))
+            sys.stdout.flush()
+
+    def run(self, infile=sys.stdin):
+        with self._lock:
+            print("{:.6f};Aggregator started".format(time.time()), flush=True)
+        for line in infile:
+            line = line.rstrip("\r\n")
+            node, sep, command = line.partition(";")
+            if not sep:
+                for fake_node in self.nodes.values():
+                    fake_node.send(line)
+            elif node in self.nodes:
+                self.nodes[node].send(command)
+            else:
+                self.out("Aggregator", "Node not managed: {}".format(node))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Emulates the serial aggregator of an IoT-LAB experiment "
+                    "with nodes running the application"
+    )
+    parser.add_argument("-d", "--drop", default=0, type=float,
+                        help="Probability a command is lost on the serial "
+                             "line (default: 0)")
+    parser.add_argument("-s", "--seed", default=None, type=int,
+                        help="Seed of the random number generator")
+    parser.add_argument("nodes", nargs="+", help="Names of the nodes")
+    args = parser.parse_args()
+    try:
+        FakeAggregator(args.nodes, args.drop, args.seed).run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# Copyright (C) 2020 Freie Universität Berlin
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests aggregator.py against fake_aggregator.py. Run with
+
+    python3 -m pytest test_aggregator.py
+"""
+
+import os
+import sys
+
+import pytest
+
+from aggregator import Aggregator, AggregatorError
+
+SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
+NODES = ["m3-1", "m3-2", "m3-3", "m3-4"]
+
+
+def fake_aggregator(*args):
+    return Aggregator([sys.executable,
+                       os.path.join(SCRIPT_PATH, "fake_aggregator.py")] +
+                      list(args) + NODES)
+
+
+@pytest.fixture
+def aggregator():
+    with fake_aggregator() as aggregator:
+        yield aggregator
+
+
+def test_request_all(aggregator):
+    res = aggregator.request_all(
+        {node: "ifconfig" for node in NODES},
+        [r"Iface\s+(\d+)", r"Long HWaddr: ([0-9A-F:]+)"],
+    )
+    assert sorted(res) == NODES
+    for node, (iface, l2addr) in res.items():
+        assert int(iface.group(1)) in (5, 6)
+        assert l2addr.group(1).endswith("{:02X}".format(int(node[3:])))
+
+
+def test_request_node_not_managed(aggregator):
+    with pytest.raises(AggregatorError, match="not within the experiment"):
+        aggregator.request("m3-100", "ifconfig", [r"Iface"])
+
+
+def test_request_timeout(aggregator):
+    matches, errors = aggregator.try_request_all(
+        {"m3-1": "ifconfig"}, [r"does not appear"], timeout=.2
+    )
+    assert not matches
+    assert "did not answer" in str(errors["m3-1"])
+
+
+def test_request_error_after_echo(aggregator):
+    matches, errors = aggregator.try_request_all(
+        {"m3-1": "route /i3 foobar", "m3-2": "route /i3 15:11"},
+        {"m3-1": [r"route /i3 foobar\s*$"], "m3-2": [r"route /i3 15:11\s*$"]},
+        error_pattern=r"^Unable to parse", settle_time=.2,
+    )
+    assert list(matches) == ["m3-2"]
+    assert "Unable to parse" in str(errors["m3-1"])
+
+
+def test_request_ignores_earlier_errors(aggregator):
+    # the error of `version` arrives before the echo of `route`
+    aggregator.send_all("version")
+    matches, errors = aggregator.try_request_all(
+        {node: "route /i3 15:11" for node in NODES}, [r"route /i3 15:11\s*$"],
+        error_pattern=r"^shell: command not found", settle_time=.2,
+    )
+    assert not errors
+    assert sorted(matches) == NODES
+
+
+def test_log(aggregator, tmp_path):
+    logname = str(tmp_path / "run.log")
+    aggregator.set_log(logname)
+    aggregator.request("m3-1", "consume 10 2 /i3/a /i3/b", [r"pr;\d+;00003"])
+    aggregator.stop_log()
+    with open(logname) as log:
+        lines = [line.strip().split(";") for line in log]
+    assert [fields[2] for fields in lines if fields[1] == "m3-1"] == \
+        ["consume 10 2 /i3/a /i3/b"] + ["qt", "pr"] * 4
+
+
+def test_stop():
+    aggregator = fake_aggregator().start()
+    assert aggregator.running
+    aggregator.stop()
+    assert not aggregator.running
+    with pytest.raises(AggregatorError, match="not running"):
+        aggregator.send_all("version")
+
+
+def test_configure_nodes():
+    dispatch = pytest.importorskip("dispatch_experiments")
+
+    class Node:
+        def __init__(self, name, l2addr):
+            self.uri = "{}.grenoble.iot-lab.info".format(name)
+            self.l2addr = l2addr
+
+    consumer, forwarder, *producers = [
+        Node(node, "15:11:6B:10:65:F8:00:{:02X}".format(i))
+        for i, node in enumerate(NODES)
+    ]
+    commands = dispatch.config_commands("/i3", 10, consumer, [forwarder],
+                                        producers)
+    # every third command is lost on the serial line and needs to be resent
+    with fake_aggregator("-d", ".3", "-s", "1") as aggregator:
+        dispatch.configure_nodes(aggregator, commands, retries=10,
+                                 timeout=.5)
+    with fake_aggregator() as aggregator:
+        commands["m3-1"] = ["route /i3 foobar"]
+        with pytest.raises(dispatch.ExperimentError,
+                           match="Unable to parse next hop address"):
+            dispatch.configure_nodes(aggregator, commands, retries=1,
+                                     timeout=.5)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020 Freie Universität Berlin
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+import argparse
+import collections
+import csv
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import gen_logs
+
+from parse_results import BACKENDS, LOG_FIELDS, ROLES_COMPILES, \
+                          STATS_COMPILES, STATS_LISTINGS, dispatch_msg, \
+                          log_to_results
+
+# about 10 million lines with the stats printed every 10 interests, so the
+# log contains enough messages to dispatch
+DEFAULT_COUNT = 250000
+DEFAULT_STAT_DUMPS = DEFAULT_COUNT * gen_logs.MAX_NAMES // 10
+
+
+def generate_log(filename, count=DEFAULT_COUNT,
+                 stat_dumps=DEFAULT_STAT_DUMPS, seed=1):
+    """
+    Writes the log of one synthetic run (see gen_logs.py) to `filename`
+    """
+    with open(filename, "w") as logfile:
+        gen_logs.generate_run(logfile, random.Random(seed),
+                              gen_logs.START_TIME, count=count,
+                              stat_dumps=stat_dumps)
+
+
+def linear_dispatch(msg):
+    """
+    Message classification as done before `parse_results.dispatch_msg()`:
+    try every role and then every stat pattern in turn.
+    """
+    for role in ROLES_COMPILES:
+        match = ROLES_COMPILES[role].match(msg)
+        if match:
+            return "role", role, match
+    for stat in STATS_COMPILES:
+        match = STATS_COMPILES[stat].match(msg)
+        if match:
+            return "stat", stat, match
+    return None, None, None
+
+
+DISPATCHERS = collections.OrderedDict((
+    ("linear", linear_dispatch),
+    ("indexed", dispatch_msg),
+))
+
+
+def _dispatch_chunk(msgs, dispatch, matches):
+    start = time.perf_counter()
+    for msg in msgs:
+        _, name, _ = dispatch(msg)
+        matches[name] += 1
+    return time.perf_counter() - start
+
+
+def bench_dispatch(logname, dispatch, chunk_size=100000):
+    """
+    Returns the number of lines in `logname`, the total time to read and
+    dispatch them, the time spent in `dispatch` alone, and the number of
+    matches per role or stat.
+    """
+    matches = collections.Counter()
+    lines = 0
+    dispatch_duration = 0
+    msgs = []
+    start = time.perf_counter()
+    with open(logname) as logfile:
+        for row in csv.DictReader(logfile, fieldnames=LOG_FIELDS,
+                                  delimiter=";"):
+            lines += 1
+            msg = row["msg"]
+            if msg in STATS_LISTINGS or msg in {"qt", "pr"}:
+                continue
+            msgs.append(msg)
+            if len(msgs) >= chunk_size:
+                dispatch_duration += _dispatch_chunk(msgs, dispatch, matches)
+                msgs = []
+    dispatch_duration += _dispatch_chunk(msgs, dispatch, matches)
+    return lines, time.perf_counter() - start, dispatch_duration, matches
+
+
+def bench_backend(logname, backend, memory=True):
+    """
+    Returns the time `parse_results.log_to_results()` takes to parse
+    `logname` with `backend`, its result, and, if `memory` is true, the peak
+    of the memory allocated by Python during a second, traced run.
+    """
+    args = (logname, gen_logs.DEFAULT_MODE, DEFAULT_COUNT,
+            gen_logs.DEFAULT_DELAY, gen_logs.DEFAULT_DATA_LEN,
+            gen_logs.START_TIME)
+    start = time.perf_counter()
+    res = log_to_results(*args, backend=backend)
+    duration = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            log_to_results(*args, backend=backend)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return duration, res, peak
+
+
+def compare_backends(logname, lines, memory=True):
+    results = {}
+    for backend in BACKENDS:
+        duration, res, peak = bench_backend(logname, backend, memory)
+        results[backend] = res
+        print("{:>8}: {:10d} lines in {:7.2f}s ({:10.0f} lines/s){}"
+              .format(backend, lines, duration, lines / duration,
+                      "" if peak is None else
+                      ", peak memory: {:8.1f} MiB".format(peak / (1 << 20))))
+    # all backends must produce the same results
+    assert all(results[backend] == results[BACKENDS[0]]
+               for backend in BACKENDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compares the message dispatch of parse_results.py "
+                    "against trying all patterns in turn and the backends of "
+                    "parse_results.py to read logs"
+    )
+    parser.add_argument("-c", "--count", default=DEFAULT_COUNT, type=int,
+                        help="Number of chunks requested per name in the "
+                             "synthetic log (default: {})"
+                             .format(DEFAULT_COUNT))
+    parser.add_argument("-S", "--stat-dumps", default=None, type=int,
+                        help="Number of times the nodes print their stats "
+                             "in the synthetic log (default: every 10 "
+                             "interests)")
+    parser.add_argument("-l", "--log", default=None,
+                        help="Use (and keep) this log instead of a "
+                             "temporary one. It is generated if it does not "
+                             "exist")
+    parser.add_argument("-M", "--no-memory", action="store_false",
+                        dest="memory",
+                        help="Do not trace the memory used by the backends "
+                             "(tracing slows the benchmark down)")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        logname = args.log or os.path.join(tmpdir, "synthetic.log")
+        if not os.path.exists(logname):
+            if args.stat_dumps is None:
+                args.stat_dumps = args.count * gen_logs.MAX_NAMES // 10
+            print("Generating a run with {} chunks per name into {}"
+                  .format(args.count, logname))
+            generate_log(logname, args.count, args.stat_dumps)
+        results = {}
+        for name, dispatch in DISPATCHERS.items():
+            lines, duration, dispatch_duration, matches = bench_dispatch(
+                logname, dispatch
+            )
+            results[name] = duration, dispatch_duration, matches
+            print("{:>8}: {:10d} lines in {:7.2f}s ({:10.0f} lines/s), "
+                  "dispatch only: {:7.2f}s ({:10.0f} lines/s)"
+                  .format(name, lines, duration, lines / duration,
+                          dispatch_duration, lines / dispatch_duration))
+        # both dispatchers must classify all messages the same
+        assert results["linear"][2] == results["indexed"][2]
+        print("speedup: {:.2f}x (dispatch only: {:.2f}x)".format(
+            results["linear"][0] / results["indexed"][0],
+            results["linear"][1] / results["indexed"][1],
+        ))
+        compare_backends(logname, lines, args.memory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020 Freie Universität Berlin
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import tempfile
+import time
+
+import gen_logs
+import parse_results
+import plot_cdf
+
+from parse_results import BACKENDS, DEFAULT_BACKEND, jobs_type
+
+DEFAULT_RUNS = 20
+DEFAULT_COUNT = 3000
+# relative slowdown of a stage against the baseline counted as regression
+DEFAULT_THRESHOLD = 0.1
+STAGES = ["logs_to_csvs", "collect_dataframes"]
+
+
+def count_lines(filenames, header=False):
+    res = 0
+    for filename in filenames:
+        with parse_results.open_compressed(filename, "rb") as f:
+            res += sum(1 for _ in f) - bool(header)
+    return res
+
+
+def _peak_rss():
+    # ru_maxrss is in KiB on Linux, the children are the workers of -j
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * 1024
+
+
+def _run_stage(stage, kwargs, conn):
+    # the stages print the files they read
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        if stage == "logs_to_csvs":
+            parse_results.logs_to_csvs(force=True, **kwargs)
+        else:
+            plot_cdf.collect_dataframes(kwargs["filenames"], use_cache=False)
+        duration = time.perf_counter() - start
+    conn.send((duration, _peak_rss()))
+
+
+def bench_stage(stage, **kwargs):
+    """
+    Runs `stage` in a fresh process, so its peak resident set size is not
+    influenced by the other stages. Returns the wall time of the stage and
+    the peak RSS of the process in bytes.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    recv_conn, send_conn = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_run_stage, args=(stage, kwargs, send_conn))
+    proc.start()
+    # so receiving fails when the process dies without sending
+    send_conn.close()
+    try:
+        return recv_conn.recv()
+    except EOFError:
+        raise RuntimeError("{} failed".format(stage))
+    finally:
+        proc.join()
+
+
+def bench(data_path, jobs=1, backend=DEFAULT_BACKEND):
+    """
+    Parses the logs in `data_path` into CSV files and reads those again.
+    Returns the number of lines read, the wall time, and the peak RSS by
+    stage.
+    """
+    res = {}
+    comp = re.compile(parse_results.LOG_NAME_PATTERN)
+    lognames = [os.path.join(data_path, logname)
+                for logname in os.listdir(data_path) if comp.search(logname)]
+    duration, rss = bench_stage("logs_to_csvs", data_path=data_path,
+                                jobs=jobs, backend=backend)
+    res["logs_to_csvs"] = {"lines": count_lines(lognames),
+                           "duration": duration, "peak_rss": rss}
+    filenames = sorted(glob.glob(os.path.join(data_path, "*-times.csv")) +
+                       glob.glob(os.path.join(data_path, "*-stats.csv")))
+    duration, rss = bench_stage("collect_dataframes", filenames=filenames)
+    res["collect_dataframes"] = {"lines": count_lines(filenames, True),
+                                 "duration": duration, "peak_rss": rss}
+    return res
+
+
+def print_results(results, baseline=None):
+    for stage in STAGES:
+        res = results[stage]
+        line = "{:>18}: {:10d} lines in {:7.2f}s ({:10.0f} lines/s), " \
+               "peak RSS: {:8.1f} MiB".format(
+                   stage, res["lines"], res["duration"],
+                   res["lines"] / res["duration"],
+                   res["peak_rss"] / (1 << 20)
+               )
+        if baseline is not None and stage in baseline:
+            line += " ({:+.1%} time, {:+.1%} RSS)".format(
+                res["duration"] / baseline[stage]["duration"] - 1,
+                res["peak_rss"] / baseline[stage]["peak_rss"] - 1,
+            )
+        print(line)
+    print("{:>18}: {:7.2f}s".format(
+        "total", sum(results[stage]["duration"] for stage in STAGES)
+    ))
+
+
+def regressions(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Returns the stages that got slower than in `baseline` by more than
+    `threshold` (relative to the lines per second)
+    """
+    res = []
+    for stage in STAGES:
+        if stage not in baseline:
+            continue
+        rate = results[stage]["lines"] / results[stage]["duration"]
+        base_rate = baseline[stage]["lines"] / baseline[stage]["duration"]
+        if rate < (base_rate * (1 - threshold)):
+            res.append(stage)
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks parsing synthetic logs into CSV files with "
+                    "parse_results.py and reading the CSV files with "
+                    "plot_cdf.py"
+    )
+    parser.add_argument("-d", "--data-path", default=None,
+                        help="Use (and keep) the logs in this directory "
+                             "instead of temporary ones. They are generated "
+                             "if there are none")
+    parser.add_argument("-r", "--runs", default=DEFAULT_RUNS, type=int,
+                        help="Number of runs to generate logs for "
+                             "(default: {})".format(DEFAULT_RUNS))
+    parser.add_argument("-c", "--count", default=DEFAULT_COUNT, type=int,
+                        help="Number of chunks requested per name and run "
+                             "(default: {})".format(DEFAULT_COUNT))
+    parser.add_argument("-N", "--nodes", default=gen_logs.DEFAULT_NODES,
+                        type=int,
+                        help="Number of nodes per run (default: {})"
+                             .format(gen_logs.DEFAULT_NODES))
+    parser.add_argument("-L", "--loss", default=gen_logs.DEFAULT_LOSS,
+                        type=float,
+                        help="Probability a fragment is lost on a hop "
+                             "(default: {})".format(gen_logs.DEFAULT_LOSS))
+    parser.add_argument("-S", "--stat-dumps",
+                        default=gen_logs.DEFAULT_STAT_DUMPS, type=int,
+                        help="Number of times the nodes print their stats "
+                             "during a run (default: {})"
+                             .format(gen_logs.DEFAULT_STAT_DUMPS))
+    parser.add_argument("-g", "--garble", default=gen_logs.DEFAULT_GARBLE,
+                        type=float,
+                        help="Probability a line is cut off (default: {})"
+                             .format(gen_logs.DEFAULT_GARBLE))
+    parser.add_argument("-j", "--jobs", default=1, type=jobs_type,
+                        help="Number of processes to parse logs with "
+                             "(0: number of CPUs, default: 1)")
+    parser.add_argument("-b", "--backend", default=DEFAULT_BACKEND,
+                        choices=BACKENDS,
+                        help="How parse_results.py reads the logs "
+                             "(default: {})".format(DEFAULT_BACKEND))
+    parser.add_argument("-o", "--output", default=None,
+                        help="JSON file to write the results to")
+    parser.add_argument("-B", "--baseline", default=None,
+                        help="JSON file with the results of a previous "
+                             "benchmark to compare against. Exits with 1 if "
+                             "a stage got slower by more than THRESHOLD")
+    parser.add_argument("-t", "--threshold", default=DEFAULT_THRESHOLD,
+                        type=float,
+                        help="Relative slowdown counted as regression "
+                             "(default: {})".format(DEFAULT_THRESHOLD))
+    args = parser.parse_args()
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data_path = args.data_path or tmpdir
+        if not glob.glob(os.path.join(data_path, "*.log*")):
+            print("Generating {} runs into {}".format(args.runs, data_path))
+            gen_logs.generate_logs(data_path, args.runs, count=args.count,
+                                   nodes=args.nodes, loss=args.loss,
+                                   stat_dumps=args.stat_dumps,
+                                   garble=args.garble)
+        results = bench(data_path, args.jobs, args.backend)
+    print_results(results, baseline)
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    if baseline is not None:
+        slower = regressions(results, baseline, args.threshold)
+        if slower:
+            print("Regression in {}".format(", ".join(slower)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# Copyright (C) 2020 Freie Universität Berlin
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Bootstrap confidence intervals over experiment runs.
+
+The runs (`exp_time`) are the unit of resampling, so the rows of all inputs
+are per-run aggregates. All resamples are drawn at once as a matrix of
+weights (how often each run is drawn in each resample), so the statistics of
+all resamples boil down to a matrix product.
+"""
+
+import argparse
+import warnings
+
+import numpy as np
+
+DEFAULT_CONFIDENCE = .95
+DEFAULT_RESAMPLES = 2000
+# fixed, so the intervals (and thus the figures) are reproducible
+DEFAULT_SEED = 0
+
+
+def resample_weights(runs, resamples=DEFAULT_RESAMPLES, seed=DEFAULT_SEED):
+    """
+    Returns a `resamples` x `runs` matrix holding how often each run is drawn
+    (with replacement) in each resample
+    """
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, runs, size=(resamples, runs))
+    # make the drawn indices unique per resample to count them all at once
+    idx += np.arange(resamples)[:, np.newaxis] * runs
+    return np.bincount(idx.ravel(), minlength=resamples * runs) \
+        .reshape(resamples, runs)
+
+
+def percentile_interval(samples, confidence=DEFAULT_CONFIDENCE):
+    """
+    Returns the lower and upper bound of the central `confidence` interval of
+    `samples` along the first axis, ignoring NaNs
+    """
+    alpha = (1 - confidence) / 2
+    with warnings.catch_warnings():
+        # resamples without any data for a column are NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        low, high = np.nanpercentile(samples, [alpha * 100,
+                                               (1 - alpha) * 100], axis=0)
+    return low, high
+
+
+def ratio_ci(numerators, denominators, confidence=DEFAULT_CONFIDENCE,
+             resamples=DEFAULT_RESAMPLES, seed=DEFAULT_SEED):
+    """
+    Returns the bootstrap confidence interval of
+    `sum(numerators) / sum(denominators)` over the runs.
+
+    `numerators` has one row per run and one column per statistic,
+    `denominators` either the same shape or one value per run. With the
+    per-run sums and counts of a value this is the CI of its mean, with the
+    per-run cumulative TTC counts and sent interests the CI of the CDF.
+    """
+    numerators = np.asarray(numerators, dtype=float)
+    denominators = np.asarray(denominators, dtype=float)
+    weights = resample_weights(numerators.shape[0], resamples, seed)
+    totals = weights @ denominators
+    if totals.ndim < numerators.ndim:
+        totals = totals[:, np.newaxis]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        samples = (weights @ numerators) / totals
+    return percentile_interval(samples, confidence)
+
+
+def quantiles_ci(cum_counts, edges, qs, confidence=DEFAULT_CONFIDENCE,
+                 resamples=DEFAULT_RESAMPLES, seed=DEFAULT_SEED):
+    """
+    Returns the lower and upper bounds of the bootstrap confidence intervals
+    of the `qs` quantiles.
+
+    `cum_counts` holds per run (row) the number of values <= each of
+    `edges`.
+    """
+    cum_counts = np.asarray(cum_counts, dtype=float)
+    edges = np.asarray(edges, dtype=float)
+    weights = resample_weights(cum_counts.shape[0], resamples, seed)
+    cum = weights @ cum_counts
+    totals = cum[:, -1:]
+    samples = np.full((resamples, len(qs)), np.nan)
+    for i, q in enumerate(qs):
+        reached = cum >= q * totals
+        # resamples without any values have no quantiles
+        valid = totals[:, 0] > 0
+        samples[valid, i] = edges[reached[valid].argmax(axis=1)]
+    return percentile_interval(samples, confidence)
+
+
+def confidence_type(value):
+    value = float(value)
+    if not 0 < value < 1:
+        raise argparse.ArgumentTypeError("LEVEL must be between 0 and 1")
+    return value
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020 Freie Universität Berlin
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Generates synthetic logs of experiment runs as written by the serial
+aggregator, e.g. to benchmark parse_results.py without testbed runs.
+
+The runs follow the application in ../../app: the consumer requests `count`
+chunks for each of its two names with a random interval between 3/4 and 1
+times `delay` per name, lost interests are retransmitted, and the nodes
+print their stats at the end of a run.
+"""
+
+import argparse
+import heapq
+import math
+import os
+import random
+
+__author__ = "Martine S. Lenders"
+__copyright__ = "Copyright 2020 Freie Universität Berlin"
+__license__ = "LGPL v2.1"
+__email__ = "m.lenders@fu-berlin.de"
+
+DEFAULT_RUNS = 1
+DEFAULT_NODES = 8
+DEFAULT_COUNT = 300
+DEFAULT_DELAY = 1000
+DEFAULT_DATA_LEN = 10
+DEFAULT_MODE = "sfr-win1ifg100arq150r4dg0-vrep"
+DEFAULT_LOSS = 0.05
+DEFAULT_STAT_DUMPS = 1
+DEFAULT_GARBLE = 0.001
+DEFAULT_CHANNEL = 20
+START_TIME = 1594394937
+# see dispatch_experiments.py in ../experiment_ctrl
+LOG_NAME_FORMAT = "icnlowpan_comp_cr_c{channel:02d}_m{mode}-" \
+                  "{count}x{delay}ms{data_len}B_{timestamp}.log"
+PREFIX = "/i3"
+# the consumer requests `count` chunks for each of its names, see
+# app/consumer.c
+MAX_NAMES = 2
+# the interests are retransmitted up to 3 times after 1 s, see ccn-lite
+MAX_RETRANS = 3
+RETRANS_TIMEOUT = 1.0
+# median and spread (sigma of the log-normal distribution) of the time a
+# fragment takes per hop
+HOP_LATENCY = 0.008
+HOP_LATENCY_SIGMA = 0.6
+# link-layer payload available for a fragment and size of an interest
+FRAG_SIZE = 80
+INTEREST_LEN = 40
+CONTENT_HEADER_LEN = 30
+# seconds between the runs
+RUN_GAP = 60
+PKTBUF_SIZE = 6144
+CS_SIZE = 10
+
+
+def l2addr(rand):
+    return ":".join("{:02X}".format(rand.randrange(256)) for _ in range(8))
+
+
+def _frags(length):
+    return max(1, math.ceil(length / FRAG_SIZE))
+
+
+class _Run:
+    """
+    Writes the lines of one run to `logfile` in the order of their timestamps
+    """
+    def __init__(self, logfile, rand, start, nodes, garble):
+        self.logfile = logfile
+        self.rand = rand
+        self.garble = garble
+        self.pending = []
+        self.lines = 0
+        self.now = start
+        self._seq = 0
+        # microseconds since each node booted, see xtimer_now_usec()
+        self.boot = {node: start - rand.uniform(5, 30) for node in nodes}
+
+    def xtimer(self, node, timestamp):
+        return int((timestamp - self.boot[node]) * 1000000) & 0xffffffff
+
+    def add(self, timestamp, node, msg):
+        # sequence number keeps the order of lines with the same timestamp
+        self._seq += 1
+        heapq.heappush(self.pending, (timestamp, self._seq, node, msg))
+
+    def out(self, node, msg):
+        self.now += self.rand.uniform(0.0001, 0.002)
+        self.add(self.now, node, msg)
+
+    def flush(self, until=None):
+        while self.pending and (until is None or self.pending[0][0] <= until):
+            timestamp, _, node, msg = heapq.heappop(self.pending)
+            if self.rand.random() < self.garble:
+                # characters get lost on the serial line, the timestamp and
+                # node are added by the aggregator
+                seps = [i + 1 for i, c in enumerate(msg) if c == ";"]
+                if seps and self.rand.random() < .5:
+                    # cut off after a separator, e.g. `pr;` with empty times
+                    msg = msg[:self.rand.choice(seps)]
+                else:
+                    msg = msg[:self.rand.randrange(len(msg))]
+            self.logfile.write("{:.6f};{};{}\n".format(timestamp, node, msg))
+            self.lines += 1
+
+
+def _counters():
+    res = {stat: 0 for stat in [
+        "fbuf_full", "rbuf_full", "vrb_full", "frags_complete",
+        "dgs_complete", "dgs_retrans", "frags_orig", "frags_abort",
+        "frags_fwd", "frags_re_nack", "frags_re_tout", "acks_full",
+        "acks_part", "acks_abort", "acks_fwd",
+    ]}
+    # names of the chunks in the content store
+    res["cs"] = []
+    return res
+
+
+def _stat_dump(run, node, counters, mode):
+    run.out(node, "pktbuf")
+    run.out(node, "packet buffer: first byte: 0x20000d10, last byte: "
+                  "0x{:08x} (size: {})".format(0x20000d10 + PKTBUF_SIZE,
+                                               PKTBUF_SIZE))
+    run.out(node, "  position of last byte used: {}".format(
+        min(PKTBUF_SIZE, 256 * (1 + counters["frags_fwd"] // 50 +
+                                run.rand.randrange(4)))
+    ))
+    run.out(node, "6lo_frag")
+    run.out(node, "frag full: {}".format(counters["fbuf_full"]))
+    run.out(node, "rbuf full: {}".format(counters["rbuf_full"]))
+    if mode.startswith("sfr"):
+        run.out(node, "VRB full: {}".format(counters["vrb_full"]))
+    run.out(node, "frags complete: {}".format(counters["frags_complete"]))
+    run.out(node, "dgs complete: {}".format(counters["dgs_complete"]))
+    if mode.startswith("sfr"):
+        run.out(node, "DG resends: {}".format(counters["dgs_retrans"]))
+        run.out(node, "frags sent: usual: {}, aborts: {}, forwarded: {}"
+                      .format(counters["frags_orig"], counters["frags_abort"],
+                              counters["frags_fwd"]))
+        run.out(node, "frag resends: NACK: {}, timeout: {}"
+                      .format(counters["frags_re_nack"],
+                              counters["frags_re_tout"]))
+        run.out(node, "ACKs: full: {}, partly: {}, aborts: {}, forwarded: {}"
+                      .format(counters["acks_full"], counters["acks_part"],
+                              counters["acks_abort"], counters["acks_fwd"]))
+    run.out(node, "ccnl_cs")
+    for name in counters["cs"][-CS_SIZE:]:
+        run.out(node, "{}/{:05d}".format(PREFIX, name))
+
+
+def generate_run(logfile, rand, start, nodes=DEFAULT_NODES,
+                 count=DEFAULT_COUNT, delay=DEFAULT_DELAY,
+                 data_len=DEFAULT_DATA_LEN, mode=DEFAULT_MODE,
+                 loss=DEFAULT_LOSS, stat_dumps=DEFAULT_STAT_DUMPS,
+                 garble=DEFAULT_GARBLE):
+    """
+    Writes the log of one run starting at `start` to the opened `logfile`.
+    `nodes` are the consumer, at least one forwarder, and the two producers.
+    Each transmission of a fragment is lost with probability `loss`.
+
+    Returns the number of lines and the end time of the run.
+    """
+    if nodes < 4:
+        raise ValueError("A run requires at least 4 nodes")
+    names = ["m3-{}".format(n) for n in rand.sample(range(1, 380), nodes)]
+    consumer, forwarders, producers = names[0], names[1:-2], names[-2:]
+    addrs = {node: l2addr(rand) for node in names}
+    run = _Run(logfile, rand, start, names, garble)
+    counters = {node: _counters() for node in names}
+    for node in names:
+        run.out(node, "version")
+        run.out(node, "shell: command not found: version")
+        run.out(node, "ifconfig")
+        run.out(node, "Iface  {}  HWaddr: {}  Channel: {}  Page: 0  "
+                      "NID: 0x23".format(6, addrs[node][-5:],
+                                         DEFAULT_CHANNEL))
+        run.out(node, "        Long HWaddr: {} ".format(addrs[node]))
+    prefixes = []
+    for producer in producers:
+        prefix = "{}/{}".format(PREFIX, addrs[producer][:5])
+        prefixes.append(prefix)
+        run.out(producer, "produce {} {}".format(prefix, data_len))
+        for i, comp in enumerate(prefix.strip("/").split("/")):
+            run.out(producer, "prefix comp [i={}]={}".format(i, comp))
+        run.out(producer, "Started producer")
+    run.out(consumer, "route {} {}".format(PREFIX, addrs[forwarders[0]]))
+    for i, forwarder in enumerate(forwarders[:-1]):
+        run.out(forwarder, "route {} {}".format(PREFIX,
+                                                addrs[forwarders[i + 1]]))
+    for producer, prefix in zip(producers, prefixes):
+        run.out(forwarders[-1], "route {} {}".format(prefix,
+                                                     addrs[producer]))
+    run.out(consumer, "consume {} {} {}".format(delay, count,
+                                                " ".join(prefixes)))
+    run.flush()
+    path = [consumer] + forwarders
+    int_frags = _frags(INTEREST_LEN)
+    cont_frags = _frags(data_len + CONTENT_HEADER_LEN)
+    # next send time per name, see EVENT_TIME() in app/consumer.c
+    timers = [run.now + rand.uniform(.75, 1) * delay / 1000
+              for _ in range(MAX_NAMES)]
+    dumps = {int(count * MAX_NAMES * (i + 1) / stat_dumps) - 1
+             for i in range(stat_dumps)}
+    for i in range(count * MAX_NAMES):
+        name = min(range(MAX_NAMES), key=timers.__getitem__)
+        sent = timers[name]
+        timers[name] = sent + rand.uniform(.75, 1) * delay / 1000
+        run.flush(sent)
+        # the names are requested in turn, independent of the timer
+        producer = producers[i % MAX_NAMES]
+        run.add(sent, consumer, "qt;{};{:05d}".format(
+            run.xtimer(consumer, sent), i
+        ))
+        attempt_start = sent
+        for attempt in range(MAX_RETRANS + 1):
+            if attempt:
+                run.add(attempt_start, consumer, "rt")
+            time = attempt_start
+            hops = path + [producer]
+            lost = False
+            # interest towards the producer, content back to the consumer
+            legs = [(src, dst, int_frags, False)
+                    for src, dst in zip(hops, hops[1:])] + \
+                [(src, dst, cont_frags, True)
+                 for src, dst in zip(hops[::-1], hops[-2::-1])]
+            for src, dst, frags, content in legs:
+                for _ in range(frags):
+                    if rand.random() < loss:
+                        lost = True
+                        counters[src]["frags_re_tout"] += 1
+                        if rand.random() < .1:
+                            counters[dst]["rbuf_full"] += 1
+                        break
+                    counters[src]["frags_orig" if src in (consumer, producer)
+                                  else "frags_fwd"] += 1
+                    counters[dst]["frags_complete"] += 1
+                    time += rand.lognormvariate(math.log(HOP_LATENCY),
+                                                HOP_LATENCY_SIGMA)
+                if lost:
+                    break
+                counters[dst]["dgs_complete"] += 1
+                counters[dst]["acks_full"] += 1
+                if src == producer:
+                    run.add(time, producer, "pt;{};{:05d}".format(
+                        run.xtimer(producer, time), i
+                    ))
+                elif content and dst != consumer:
+                    counters[dst]["cs"].append(i)
+            if not lost:
+                run.add(time, consumer, "pr;{};{:05d}".format(
+                    run.xtimer(consumer, time), i
+                ))
+                break
+            if attempt:
+                counters[consumer]["dgs_retrans"] += 1
+            attempt_start += RETRANS_TIMEOUT
+        if i in dumps:
+            if i == (count * MAX_NAMES - 1):
+                # the final stats are queried after the last response
+                run.now = max([run.now] + [line[0] for line in run.pending])
+            run.now = max(run.now, sent)
+            for node in names:
+                _stat_dump(run, node, counters[node], mode)
+    run.flush()
+    return run.lines, run.now
+
+
+def generate_logs(data_path, runs=DEFAULT_RUNS, seed=1, **kwargs):
+    """
+    Writes `runs` logs to `data_path` named like the logs of real runs and
+    returns their names and number of lines. The other arguments are the
+    ones of `generate_run()`.
+    """
+    rand = random.Random(seed)
+    os.makedirs(data_path, exist_ok=True)
+    res = []
+    start = START_TIME
+    for _ in range(runs):
+        logname = os.path.join(data_path, LOG_NAME_FORMAT.format(
+            channel=DEFAULT_CHANNEL, mode=kwargs.get("mode", DEFAULT_MODE),
+            count=kwargs.get("count", DEFAULT_COUNT),
+            delay=kwargs.get("delay", DEFAULT_DELAY),
+            data_len=kwargs.get("data_len", DEFAULT_DATA_LEN),
+            timestamp=int(start),
+        ))
+        with open(logname, "w") as logfile:
+            lines, end = generate_run(logfile, rand, start, **kwargs)
+        res.append((logname, lines))
+        start = end + RUN_GAP
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generates synthetic logs of experiment runs as written "
+                    "by the serial aggregator"
+    )
+    parser.add_argument("-r", "--runs", default=DEFAULT_RUNS, type=int,
+                        help="Number of runs (default: {})"
+                             .format(DEFAULT_RUNS))
+    parser.add_argument("-N", "--nodes", default=DEFAULT_NODES, type=int,
+                        help="Number of nodes (consumer, forwarders, and 2 "
+                             "producers, default: {})".format(DEFAULT_NODES))
+    parser.add_argument("-c", "--count", default=DEFAULT_COUNT, type=int,
+                        help="Number of chunks requested per name "
+                             "(default: {})".format(DEFAULT_COUNT))
+    parser.add_argument("-d", "--delay", default=DEFAULT_DELAY, type=int,
+                        help="Delay between the requests per name in ms "
+                             "(default: {})".format(DEFAULT_DELAY))
+    parser.add_argument("-l", "--data-len", default=DEFAULT_DATA_LEN,
+                        type=int,
+                        help="Length of the content in bytes (default: {})"
+                             .format(DEFAULT_DATA_LEN))
+    parser.add_argument("-m", "--mode", default=DEFAULT_MODE,
+                        help="Mode in the log name (default: {})"
+                             .format(DEFAULT_MODE))
+    parser.add_argument("-L", "--loss", default=DEFAULT_LOSS, type=float,
+                        help="Probability a fragment is lost on a hop "
+                             "(default: {})".format(DEFAULT_LOSS))
+    parser.add_argument("-S", "--stat-dumps", default=DEFAULT_STAT_DUMPS,
+                        type=int,
+                        help="Number of times the nodes print their stats "
+                             "during a run (default: {})"
+                             .format(DEFAULT_STAT_DUMPS))
+    parser.add_argument("-g", "--garble", default=DEFAULT_GARBLE, type=float,
+                        help="Probability a line is cut off (default: {})"
+                             .format(DEFAULT_GARBLE))
+    parser.add_argument("-s", "--seed", default=1, type=int,
+                        help="Seed of the random number generator "
+                             "(default: 1)")
+    parser.add_argument("data_path", help="Directory to write the logs to")
+    args = parser.parse_args()
+    kwargs = vars(args)
+    for logname, lines in generate_logs(kwargs.pop("data_path"), **kwargs):
+        print("{}: {} lines".format(logname, lines))
+
+
+if __name__ == "__main__":
+    main()
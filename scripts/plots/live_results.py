@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020 Freie Universität Berlin
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Follows the log of a running experiment run and publishes the rolling
+delivery ratio and time-to-completion (TTC) quantiles.
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+
+from parse_results import LOG_NAME_PATTERN, STATS_LISTINGS, \
+                          STATS_LISTINGS_BYTES
+from gen_logs import MAX_NAMES
+from plot_cdf import US_PER_SEC
+from ttc_quantiles import QUANTILES
+from ttc_sketch import KLLSketch
+
+__author__ = "Martine S. Lenders"
+__copyright__ = "Copyright 2020 Freie Universität Berlin"
+__license__ = "LGPL v2.1"
+__email__ = "m.lenders@fu-berlin.de"
+
+DEFAULT_INTERVAL = 5
+POLL_INTERVAL = .5
+READ_SIZE = 1 << 16
+
+
+def follow(logname, poll_interval=POLL_INTERVAL, idle_timeout=None):
+    """
+    Yields the lines appended to `logname` (waiting for it to be created) as
+    lists of bytes. Only complete lines are yielded. While no new lines are
+    written, an empty list is yielded every `poll_interval` seconds.
+
+    Stops when `logname` did not grow for `idle_timeout` seconds.
+    """
+    idle_since = time.monotonic()
+    while not os.path.exists(logname):
+        if idle_timeout is not None and \
+           (time.monotonic() - idle_since) >= idle_timeout:
+            return
+        yield []
+        time.sleep(poll_interval)
+    with open(logname, "rb") as logfile:
+        rest = b""
+        idle_since = time.monotonic()
+        while True:
+            chunk = logfile.read(READ_SIZE)
+            if chunk:
+                block = rest + chunk
+                end = block.rfind(b"\n") + 1
+                rest = block[end:]
+                idle_since = time.monotonic()
+                if end:
+                    yield block[:end].splitlines()
+                continue
+            if idle_timeout is not None and \
+               (time.monotonic() - idle_since) >= idle_timeout:
+                break
+            yield []
+            time.sleep(poll_interval)
+        if rest:
+            yield rest.splitlines()
+
+
+class LiveResults:
+    """
+    Incrementally matches the `qt` and `pr` lines of a log by their name and
+    counts the listed stats (see STATS_LISTINGS). The TTCs of the matched
+    names are collected in a KLL sketch, so its size stays bounded.
+    """
+    def __init__(self, expected=None):
+        self.expected = expected
+        self.lines = 0
+        self.nodes = set()
+        # send and receive time by name
+        self.times = {}
+        self.sent = 0
+        self.ttcs = KLLSketch()
+        self.stats = {stat: 0 for stat in STATS_LISTINGS.values()}
+
+    @property
+    def delivered(self):
+        return len(self.ttcs)
+
+    def update(self, lines):
+        for line in lines:
+            self.lines += 1
+            fields = line.split(b";")
+            if len(fields) < 3:
+                continue
+            self.nodes.add(fields[1])
+            msg = fields[2]
+            if msg in STATS_LISTINGS_BYTES:
+                self.stats[STATS_LISTINGS_BYTES[msg]] += 1
+            elif (msg == b"qt" or msg == b"pr") and len(fields) > 4:
+                self._add_time(0 if msg == b"qt" else 1, fields[4], fields[3])
+
+    def _add_time(self, idx, name, xtimer):
+        try:
+            xtimer = int(xtimer)
+        except ValueError:
+            # line got garbled on the serial line
+            return
+        times = self.times.setdefault(name, [None, None])
+        if times[idx] is not None:
+            # only count first occurrence
+            return
+        times[idx] = xtimer
+        if idx == 0:
+            self.sent += 1
+        if times[0] is not None and times[1] is not None:
+            self.ttcs.update(times[1] - times[0])
+
+    def status(self):
+        res = {
+            "lines": self.lines,
+            "nodes": len(self.nodes),
+            "expected": self.expected,
+            "sent": self.sent,
+            "delivered": self.delivered,
+            "delivery_ratio": (self.delivered / self.sent)
+            if self.sent else None,
+        }
+        for q, value in zip(QUANTILES, self.ttcs.quantiles(QUANTILES)):
+            res["p{:g}".format(q * 100)] = (value / US_PER_SEC) \
+                if self.delivered else None
+        res.update(self.stats)
+        return res
+
+
+def format_status(status):
+    res = "{:.0f}s: sent {}".format(status["elapsed"], status["sent"])
+    if status["expected"] is not None:
+        res += "/{}".format(status["expected"])
+    res += ", delivered {}".format(status["delivered"])
+    if status["delivery_ratio"] is not None:
+        res += " ({:.1%})".format(status["delivery_ratio"])
+    if status["delivered"]:
+        res += ", TTC " + ", ".join(
+            "p{:g} {:.3f}s".format(q * 100,
+                                   status["p{:g}".format(q * 100)])
+            for q in QUANTILES
+        )
+    return res
+
+
+def write_status(status, filename):
+    # replace atomically, so readers never see a partially written file
+    with open(filename + ".tmp", "w") as status_file:
+        json.dump(status, status_file, indent=2)
+    os.replace(filename + ".tmp", filename)
+
+
+def status_filename(logname):
+    return re.sub(r"\.log$", "", logname) + ".status.json"
+
+
+def run(logname, interval=DEFAULT_INTERVAL, status_file=None,
+        idle_timeout=None, quiet=False):
+    """
+    Follows `logname` and publishes the status every `interval` seconds to
+    stdout (unless `quiet`) and `status_file`. Returns the last status.
+    """
+    match = re.search(LOG_NAME_PATTERN, os.path.basename(logname))
+    results = LiveResults(int(match.group("count")) * MAX_NAMES
+                          if match else None)
+    start = time.monotonic()
+    last_publish = start
+
+    def publish(finished=False):
+        status = results.status()
+        status["elapsed"] = time.monotonic() - start
+        status["finished"] = finished
+        if not quiet:
+            print(format_status(status), flush=True)
+        if status_file is not None:
+            write_status(status, status_file)
+        return status
+
+    try:
+        for lines in follow(logname, idle_timeout=idle_timeout):
+            results.update(lines)
+            if (time.monotonic() - last_publish) >= interval:
+                publish()
+                last_publish = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    return publish(finished=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Follows the log of a running experiment run and "
+                    "publishes the rolling delivery ratio and "
+                    "time-to-completion quantiles"
+    )
+    parser.add_argument("-i", "--interval", default=DEFAULT_INTERVAL,
+                        type=float,
+                        help="Seconds between status updates (default: {})"
+                             .format(DEFAULT_INTERVAL))
+    parser.add_argument("-s", "--status-file", default=None,
+                        help="JSON file to write the status to "
+                             "(default: the log name with extension "
+                             ".status.json)")
+    parser.add_argument("-t", "--idle-timeout", default=None, type=float,
+                        help="Stop following after the log did not grow for "
+                             "IDLE_TIMEOUT seconds (default: follow until "
+                             "interrupted)")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="Only write the status file")
+    parser.add_argument("log", help="Log of the run as written by the serial "
+                                    "aggregator")
+    args = parser.parse_args()
+    if args.status_file is None:
+        args.status_file = status_filename(args.log)
+    run(args.log, args.interval, args.status_file, args.idle_timeout,
+        args.quiet)
+
+
+if __name__ == "__main__":
+    main()
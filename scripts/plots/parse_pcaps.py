@@ -0,0 +1,745 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020 Freie Universität Berlin
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Analyzes the IEEE 802.15.4 traffic sniffed during the experiment runs (see
+`sniffer` in ../experiment_ctrl/README.md).
+
+The captures are read record by record, so they are never loaded as a whole.
+The 6LoWPAN fragmentation headers (FRAG1/FRAGN, RFRAG and RFRAG-ACK) of each
+frame are decoded to find retransmitted fragments and to measure how long a
+node takes to forward a fragment it received.
+"""
+
+import argparse
+import array
+import bisect
+import collections
+import csv
+import glob
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+
+from parse_results import DATA_PATH, NAME_PATTERN, jobs_type, \
+                          match_to_dict, open_compressed, strip_compression
+
+__author__ = "Martine S. Lenders"
+__copyright__ = "Copyright 2020 Freie Universität Berlin"
+__license__ = "LGPL v2.1"
+__email__ = "m.lenders@fu-berlin.de"
+
+PCAP_NAME_PATTERN = r"{}\.pcap(\.(gz|xz|zst))?$".format(NAME_PATTERN.format(
+    mode=r"(?P<mode>(reass|sfr-.*))",
+    count=r"(?P<count>\d+)",
+    delay=r"(?P<delay>\d+)",
+    data_len=r"(?P<data_len>\d+)",
+))
+L2ADDRS_PATTERN = "l2addrs_*.csv"
+
+PCAP_MAGIC = {
+    # magic number: byte order, ticks per second
+    b"\xd4\xc3\xb2\xa1": ("<", 1000000),
+    b"\xa1\xb2\xc3\xd4": (">", 1000000),
+    b"\x4d\x3c\xb2\xa1": ("<", 1000000000),
+    b"\xa1\xb2\x3c\x4d": (">", 1000000000),
+}
+PCAP_HEADER_LEN = 24
+PCAP_RECORD_HEADER_LEN = 16
+# the sidecar index of a PCAP is stored as <pcap>.idx
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = b"PCAPIDX1"
+INDEX_HEADER = struct.Struct("<8sQQI")
+# number of records per index entry
+INDEX_STRIDE = 256
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_IEEE802_15_4_WITHFCS = 195
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_IEEE802_15_4_NOFCS = 230
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+IPPROTO_UDP = 17
+# the sniffer_aggregator encapsulates the frames in ZEP over UDP
+ZEP_PORT = 17754
+ZEP_PREAMBLE = b"EX"
+ZEP_TYPE_DATA = 1
+FCS_LEN = 2
+
+FRAME_TYPE_DATA = 1
+FRAME_TYPE_ACK = 2
+# length of the address by addressing mode
+ADDR_LENS = {0: 0, 2: 2, 3: 8}
+BROADCAST = "FF:FF"
+
+# 250 kbit/s O-QPSK PHY: 32 us per byte plus 5 bytes synchronization header
+# and 1 byte PHY header in front of each frame
+US_PER_BYTE = 32
+PHY_HEADER_LEN = 6
+
+# microseconds in which the same frame captured by another sniffer is
+# considered the same transmission
+DUPLICATE_WINDOW = 10000
+# microseconds after which a fragment sent again is no retransmission anymore
+RETRANS_WINDOW = 5000000
+# maximum microseconds a node takes to forward a fragment
+HOP_WINDOW = 2000000
+
+PCAP_FIELDS = ["exp_time", "nodes", "mode", "count", "delay", "data_len",
+               "node", "frames", "acks", "frags", "rfrag_acks", "airtime",
+               "tx_util", "channel_util", "mac_retrans", "frag_retrans",
+               "retrans_bursts", "max_burst", "hop_latency_count",
+               "hop_latency_mean", "hop_latency_median", "hop_latency_max"]
+
+
+class PcapError(Exception):
+    pass
+
+
+def _read_exactly(pcap, size):
+    data = pcap.read(size)
+    if len(data) < size:
+        # capture was cut off, e.g. when the sniffer was stopped
+        return None
+    return data
+
+
+def read_pcap(pcap):
+    """
+    Yields the timestamp (in microseconds) and data of each record of the
+    opened pcap file `pcap` and its link type
+    """
+    header = _read_exactly(pcap, PCAP_HEADER_LEN)
+    if header is None or header[:4] not in PCAP_MAGIC:
+        raise PcapError("Not a pcap file")
+    byteorder, ticks = PCAP_MAGIC[header[:4]]
+    linktype = struct.unpack(byteorder + "I", header[20:24])[0]
+    record_header = struct.Struct(byteorder + "IIII")
+    while True:
+        rec = _read_exactly(pcap, PCAP_RECORD_HEADER_LEN)
+        if rec is None:
+            return
+        secs, frac, incl_len, _ = record_header.unpack(rec)
+        data = _read_exactly(pcap, incl_len)
+        if data is None:
+            return
+        yield secs * 1000000 + frac * 1000000 // ticks, linktype, data
+
+
+class MmapPcap:
+    """
+    Memory-mapped (uncompressed) pcap file. The records are returned as
+    memoryviews into the mapping, so they are not copied. They are only valid
+    until the file is closed.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            self._file.close()
+            raise PcapError("Not a pcap file")
+        self._view = memoryview(self._mmap)
+        header = self._view[:PCAP_HEADER_LEN].tobytes()
+        if len(header) < PCAP_HEADER_LEN or header[:4] not in PCAP_MAGIC:
+            self.close()
+            raise PcapError("Not a pcap file")
+        byteorder, self._ticks = PCAP_MAGIC[header[:4]]
+        self.header = header
+        self.linktype = struct.unpack(byteorder + "I", header[20:24])[0]
+        self._record_header = struct.Struct(byteorder + "IIII")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._view)
+
+    def close(self):
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # records are still referenced, the mapping is removed with them
+            pass
+        self._file.close()
+
+    def timestamp(self, offset):
+        secs, frac = self._record_header.unpack_from(self._view, offset)[:2]
+        return secs * 1000000 + frac * 1000000 // self._ticks
+
+    def raw_record(self, offset, data):
+        """
+        Returns the record at `offset` with `data` including its header
+        """
+        return self._view[offset:offset + PCAP_RECORD_HEADER_LEN + len(data)]
+
+    def records(self, offset=PCAP_HEADER_LEN, stop=None):
+        """
+        Yields the offset, timestamp (in microseconds), and data of each
+        record from `offset` on until `stop`
+        """
+        size = len(self._view) if stop is None else min(stop, len(self._view))
+        unpack_from = self._record_header.unpack_from
+        while (offset + PCAP_RECORD_HEADER_LEN) <= size:
+            secs, frac, incl_len, _ = unpack_from(self._view, offset)
+            start = offset + PCAP_RECORD_HEADER_LEN
+            if (start + incl_len) > len(self._view):
+                # capture was cut off, e.g. when the sniffer was stopped
+                return
+            yield offset, secs * 1000000 + frac * 1000000 // self._ticks, \
+                self._view[start:start + incl_len]
+            offset = start + incl_len
+
+
+class PcapIndex:
+    """
+    Sidecar index of a pcap file: the offset of every `stride`-th record and
+    the smallest and largest timestamp of the records up to the next entry.
+
+    As the records of several sniffers are not strictly ordered by their
+    timestamps, a window is searched from the first entry any later record
+    of which might be in the window up to the first entry all later records
+    of which are after the window.
+    """
+    def __init__(self, entries, stride=INDEX_STRIDE):
+        # flat array of offset, minimum and maximum timestamp per entry
+        self.entries = entries
+        self.stride = stride
+        self._max_before = []
+        self._min_after = []
+        for i in range(0, len(entries), 3):
+            self._max_before.append(max(entries[i + 2], self._max_before[-1])
+                                    if self._max_before else entries[i + 2])
+        for i in range(len(entries) - 3, -1, -3):
+            self._min_after.append(min(entries[i + 1], self._min_after[-1])
+                                   if self._min_after else entries[i + 1])
+        self._min_after.reverse()
+
+    def __len__(self):
+        return len(self.entries) // 3
+
+    @classmethod
+    def build(cls, pcap, stride=INDEX_STRIDE):
+        entries = array.array("q")
+        for i, (offset, timestamp, _) in enumerate(pcap.records()):
+            if (i % stride) == 0:
+                entries.extend((offset, timestamp, timestamp))
+            elif timestamp < entries[-2]:
+                entries[-2] = timestamp
+            elif timestamp > entries[-1]:
+                entries[-1] = timestamp
+        return cls(entries, stride)
+
+    @classmethod
+    def load(cls, filename, pcapname):
+        """
+        Returns the index stored in `filename` or `None` if it does not exist
+        or is outdated
+        """
+        stat = os.stat(pcapname)
+        try:
+            with open(filename, "rb") as index_file:
+                header = index_file.read(INDEX_HEADER.size)
+                magic, size, mtime, stride = INDEX_HEADER.unpack(header)
+                if magic != INDEX_MAGIC or size != stat.st_size or \
+                   mtime != stat.st_mtime_ns:
+                    return None
+                entries = array.array("q")
+                entries.frombytes(index_file.read())
+        except (OSError, struct.error, ValueError):
+            return None
+        return cls(entries, stride)
+
+    def store(self, filename, pcapname):
+        stat = os.stat(pcapname)
+        # replace atomically, so readers never see a partially written index
+        with open(filename + ".tmp", "wb") as index_file:
+            index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size,
+                                               stat.st_mtime_ns, self.stride))
+            self.entries.tofile(index_file)
+        os.replace(filename + ".tmp", filename)
+
+    def span(self, start, end):
+        """
+        Returns the offsets between which the records with timestamps between
+        `start` and `end` are (the end offset is `None` for the end of file)
+        """
+        first = bisect.bisect_left(self._max_before, start)
+        if first >= len(self):
+            return None, None
+        for i in range(first, len(self)):
+            if self._min_after[i] > end:
+                return self.entries[first * 3], self.entries[i * 3]
+        return self.entries[first * 3], None
+
+
+def load_index(pcap, stride=INDEX_STRIDE, rebuild=False):
+    """
+    Returns the sidecar index of the opened MmapPcap `pcap`, building and
+    storing it if it does not exist or is outdated
+    """
+    filename = pcap.filename + INDEX_SUFFIX
+    index = None if rebuild else PcapIndex.load(filename, pcap.filename)
+    if index is None:
+        index = PcapIndex.build(pcap, stride)
+        try:
+            index.store(filename, pcap.filename)
+        except OSError:
+            # e.g. read-only results, use the index only this time
+            pass
+    return index
+
+
+def window(pcap, index, start, end):
+    """
+    Yields the offset, timestamp, and data of the records of the MmapPcap
+    `pcap` with timestamps between `start` and `end` (in microseconds) using
+    its `index`
+    """
+    first, stop = index.span(start, end)
+    if first is None:
+        return
+    for offset, timestamp, data in pcap.records(first, stop):
+        if start <= timestamp <= end:
+            yield offset, timestamp, data
+
+
+def _udp_payload(packet, version):
+    if version == 4:
+        if len(packet) < 20 or packet[9] != IPPROTO_UDP:
+            return None
+        packet = packet[(packet[0] & 0xf) * 4:]
+    else:
+        if len(packet) < 40 or packet[6] != IPPROTO_UDP:
+            return None
+        packet = packet[40:]
+    if len(packet) < 8 or struct.unpack("!H", packet[2:4])[0] != ZEP_PORT:
+        return None
+    return packet[8:]
+
+
+def unpack_zep(payload):
+    """
+    Returns the ID of the sniffing device and the IEEE 802.15.4 frame
+    (without FCS) of a ZEP packet
+    """
+    if len(payload) < 4 or payload[:2] != ZEP_PREAMBLE:
+        return None, None
+    version = payload[2]
+    if version == 1:
+        header_len = 16
+        device = struct.unpack("!H", payload[4:6])[0]
+    elif version == 2 and payload[3] == ZEP_TYPE_DATA:
+        header_len = 32
+        device = struct.unpack("!H", payload[5:7])[0]
+    else:
+        # ZEP ACKs only acknowledge the ZEP packets
+        return None, None
+    if len(payload) < header_len:
+        return None, None
+    length = payload[header_len - 1]
+    # the last two bytes are the FCS or LQI and RSSI
+    return device, payload[header_len:header_len + length - FCS_LEN]
+
+
+def unpack_record(linktype, data):
+    """
+    Returns the ID of the sniffing device (`None` if unknown) and the IEEE
+    802.15.4 frame (without FCS) of a record or `None` for both if the
+    record does not contain a frame
+    """
+    if linktype == LINKTYPE_IEEE802_15_4_WITHFCS:
+        return None, data[:-FCS_LEN]
+    if linktype == LINKTYPE_IEEE802_15_4_NOFCS:
+        return None, data
+    if linktype == LINKTYPE_ETHERNET:
+        if len(data) < 14:
+            return None, None
+        ethertype = struct.unpack("!H", data[12:14])[0]
+        if ethertype not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+            return None, None
+        data = data[14:]
+    elif linktype not in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        raise PcapError("Unsupported link type {}".format(linktype))
+    if not data:
+        return None, None
+    payload = _udp_payload(data, data[0] >> 4)
+    if payload is None:
+        return None, None
+    return unpack_zep(payload)
+
+
+def format_addr(addr):
+    # addresses are transmitted in little endian
+    return ":".join("{:02X}".format(b) for b in reversed(addr))
+
+
+def parse_frame(frame):
+    """
+    Returns the type, sequence number, acknowledgement request flag,
+    destination and source address, and payload of an IEEE 802.15.4 frame
+    or `None` if the frame is malformed
+    """
+    if len(frame) < 3:
+        return None
+    fcf = frame[0] | (frame[1] << 8)
+    frame_type = fcf & 0x7
+    ack_req = bool(fcf & 0x20)
+    pan_comp = bool(fcf & 0x40)
+    dst_mode = (fcf >> 10) & 0x3
+    src_mode = (fcf >> 14) & 0x3
+    if dst_mode not in ADDR_LENS or src_mode not in ADDR_LENS:
+        return None
+    pos = 3
+    dst = src = None
+    if dst_mode:
+        pos += 2
+        dst = format_addr(frame[pos:pos + ADDR_LENS[dst_mode]])
+        pos += ADDR_LENS[dst_mode]
+    if src_mode:
+        if not (pan_comp and dst_mode):
+            pos += 2
+        src = format_addr(frame[pos:pos + ADDR_LENS[src_mode]])
+        pos += ADDR_LENS[src_mode]
+    if pos > len(frame):
+        return None
+    return frame_type, frame[2], ack_req, dst, src, frame[pos:]
+
+
+def parse_frag(payload):
+    """
+    Returns the kind, datagram tag, and the key identifying the fragment
+    within its datagram (same on all hops) of a fragment or RFRAG-ACK or
+    `None` if `payload` does not start with a fragmentation header
+    """
+    if len(payload) >= 4 and (payload[0] & 0xf8) == 0xc0:
+        # FRAG1, RFC 4944
+        size = ((payload[0] & 0x7) << 8) | payload[1]
+        return "frag", payload[2:4], (size, 0)
+    if len(payload) >= 5 and (payload[0] & 0xf8) == 0xe0:
+        # FRAGN, RFC 4944
+        size = ((payload[0] & 0x7) << 8) | payload[1]
+        return "frag", payload[2:4], (size, payload[4] * 8)
+    if len(payload) >= 6 and (payload[0] & 0xfe) == 0xe8:
+        # RFRAG, RFC 8931
+        seq = (payload[2] >> 2) & 0x1f
+        # the offset of the first fragment is the datagram size
+        offset = struct.unpack("!H", payload[4:6])[0]
+        return "rfrag", payload[1:2], (seq, offset)
+    if len(payload) >= 2 and (payload[0] & 0xfe) == 0xea:
+        # RFRAG-ACK, RFC 8931
+        return "rfrag_ack", payload[1:2], payload[2:6]
+    return None
+
+
+def airtime(frame):
+    """
+    Returns the microseconds it takes to transmit `frame` (without FCS)
+    """
+    return (PHY_HEADER_LEN + len(frame) + FCS_LEN) * US_PER_BYTE
+
+
+def load_l2addrs(data_path=DATA_PATH):
+    """
+    Returns the node names by their long and short L2 address and the node
+    names of each experiment from the `l2addrs_<nodes>.csv` files written by
+    dispatch_experiments.py
+    """
+    names = {}
+    short = collections.defaultdict(set)
+    experiments = []
+    for filename in sorted(glob.glob(os.path.join(data_path,
+                                                  L2ADDRS_PATTERN))):
+        with open(filename) as l2addr_file:
+            nodes = set()
+            for row in csv.DictReader(l2addr_file):
+                l2addr = row["l2addr"].upper()
+                names[l2addr] = row["name"]
+                # the short address is the last two bytes of the long one
+                short[l2addr[-5:]].add(row["name"])
+                nodes.add(row["name"])
+            experiments.append(nodes)
+    for addr, nodes in short.items():
+        if len(nodes) == 1:
+            names[addr] = nodes.pop()
+    return names, experiments
+
+
+class _NodeStats:
+    def __init__(self):
+        self.frames = 0
+        self.acks = 0
+        self.frags = 0
+        self.rfrag_acks = 0
+        self.airtime = 0
+        self.mac_retrans = 0
+        self.frag_retrans = 0
+        self.retrans_bursts = 0
+        self.max_burst = 0
+        self.burst = 0
+        self.latencies = []
+        # last frame sent and the time fragments were sent by their key
+        self.last_frame = None
+        self.sent_frags = {}
+
+
+class PcapStats:
+    """
+    Collects the stats of one capture frame by frame (see `update()`)
+    """
+    def __init__(self, names=None):
+        self.names = names or {}
+        self.nodes = collections.defaultdict(_NodeStats)
+        self.first = None
+        self.last = None
+        self.airtime = 0
+        # frames seen recently with the devices they were captured by
+        self.recent = collections.OrderedDict()
+        # fragments received by a node but not yet forwarded
+        self.pending = collections.defaultdict(collections.deque)
+        # receivers of the frames awaiting a link-layer ACK by sequence number
+        self.acked = {}
+
+    def name(self, addr):
+        return self.names.get(addr, addr)
+
+    def _is_duplicate(self, timestamp, device, frame):
+        while self.recent:
+            oldest, (seen, _) = next(iter(self.recent.items()))
+            if (timestamp - seen) <= DUPLICATE_WINDOW:
+                break
+            del self.recent[oldest]
+        if device is None:
+            return False
+        if frame in self.recent and device not in self.recent[frame][1]:
+            self.recent[frame][1].add(device)
+            return True
+        self.recent[frame] = (timestamp, {device})
+        self.recent.move_to_end(frame)
+        return False
+
+    def update(self, timestamp, device, frame):
+        """
+        Adds a `frame` (without FCS) captured at `timestamp` (in
+        microseconds) by the sniffer `device` (`None` if unknown)
+        """
+        if self._is_duplicate(timestamp, device, frame):
+            return
+        parsed = parse_frame(frame)
+        if parsed is None:
+            return
+        frame_type, seq, ack_req, dst, src, payload = parsed
+        if self.first is None:
+            self.first = timestamp
+        self.last = timestamp
+        self.airtime += airtime(frame)
+        if frame_type == FRAME_TYPE_ACK:
+            # ACKs carry no addresses, so attribute them to the receiver of
+            # the acknowledged frame
+            if seq in self.acked:
+                stats = self.nodes[self.acked.pop(seq)]
+                stats.acks += 1
+                stats.airtime += airtime(frame)
+            return
+        if src is None:
+            return
+        src = self.name(src)
+        dst = self.name(dst) if dst is not None else None
+        stats = self.nodes[src]
+        stats.frames += 1
+        stats.airtime += airtime(frame)
+        if ack_req and dst is not None:
+            self.acked[seq] = dst
+        retrans = stats.last_frame == frame
+        if retrans:
+            stats.mac_retrans += 1
+        stats.last_frame = frame
+        frag = parse_frag(payload) if frame_type == FRAME_TYPE_DATA else None
+        if frag is not None and frag[0] == "rfrag_ack":
+            stats.rfrag_acks += 1
+        elif frag is not None:
+            retrans = self._update_frag(timestamp, src, dst, stats, frag,
+                                        retrans)
+        if retrans:
+            stats.burst += 1
+            stats.max_burst = max(stats.max_burst, stats.burst)
+        else:
+            if stats.burst:
+                stats.retrans_bursts += 1
+            stats.burst = 0
+
+    def _update_frag(self, timestamp, src, dst, stats, frag, retrans):
+        kind, tag, key = frag
+        if not retrans:
+            stats.frags += 1
+            sent_key = (dst, kind, tag, key)
+            sent = stats.sent_frags.get(sent_key)
+            if sent is not None and (timestamp - sent) <= RETRANS_WINDOW:
+                stats.frag_retrans += 1
+                retrans = True
+            stats.sent_frags[sent_key] = timestamp
+            if len(stats.sent_frags) > 1024:
+                stats.sent_frags = {
+                    k: t for k, t in stats.sent_frags.items()
+                    if (timestamp - t) <= RETRANS_WINDOW
+                }
+        if retrans:
+            return True
+        # match with the fragment `src` received for forwarding
+        pending = self.pending[src]
+        while pending and (timestamp - pending[0][1]) > HOP_WINDOW:
+            pending.popleft()
+        for i, (pending_key, received) in enumerate(pending):
+            if pending_key == (kind, key):
+                stats.latencies.append(timestamp - received)
+                del pending[i]
+                break
+        if dst is not None and dst != BROADCAST:
+            self.pending[dst].append(((kind, key), timestamp))
+        return False
+
+    def rows(self, params, nodes):
+        duration = (self.last - self.first) if self.first is not None else 0
+        for node in sorted(self.nodes):
+            stats = self.nodes[node]
+            if stats.burst:
+                stats.retrans_bursts += 1
+            latencies = sorted(stats.latencies)
+            row = {
+                "exp_time": params["timestamp"],
+                "nodes": nodes,
+                "mode": params["mode"],
+                "count": params["count"],
+                "delay": params["delay"],
+                "data_len": params["data_len"],
+                "node": node,
+                "frames": stats.frames,
+                "acks": stats.acks,
+                "frags": stats.frags,
+                "rfrag_acks": stats.rfrag_acks,
+                "airtime": stats.airtime,
+                "tx_util": (stats.airtime / duration) if duration else None,
+                "channel_util": (self.airtime / duration)
+                if duration else None,
+                "mac_retrans": stats.mac_retrans,
+                "frag_retrans": stats.frag_retrans,
+                "retrans_bursts": stats.retrans_bursts,
+                "max_burst": stats.max_burst,
+                "hop_latency_count": len(latencies),
+                "hop_latency_mean": None,
+                "hop_latency_median": None,
+                "hop_latency_max": None,
+            }
+            if latencies:
+                row["hop_latency_mean"] = sum(latencies) / len(latencies)
+                row["hop_latency_median"] = latencies[len(latencies) // 2]
+                row["hop_latency_max"] = latencies[-1]
+            yield row
+
+
+def pcap_to_stats(pcapname, names=None):
+    res = PcapStats(names)
+    with open_compressed(pcapname, "rb") as pcap:
+        for timestamp, linktype, data in read_pcap(pcap):
+            device, frame = unpack_record(linktype, data)
+            if frame is not None:
+                res.update(timestamp, device, frame)
+    return res
+
+
+def experiment_nodes(stats, experiments):
+    """
+    Returns the number of nodes of the experiment the nodes in `stats` belong
+    to (the experiment sharing the most nodes with it) to match the `nodes`
+    column of the `stats` CSVs
+    """
+    best = None
+    for exp_nodes in experiments:
+        shared = len(exp_nodes & set(stats.nodes))
+        if shared and (best is None or shared > best[0]):
+            best = (shared, len(exp_nodes))
+    if best is None:
+        return len(stats.nodes)
+    return best[1]
+
+
+def parse_pcap(pcapname, params, names, experiments):
+    stats = pcap_to_stats(pcapname, names)
+    params = dict(params, nodes=experiment_nodes(stats, experiments))
+    return params, list(stats.rows(params, params["nodes"]))
+
+
+def _parse_pcap_star(args):
+    return parse_pcap(*args)
+
+
+def pcaps_to_csvs(data_path=DATA_PATH, blacklisted=None, jobs=1):
+    if blacklisted is None:
+        blacklisted = set()
+    names, experiments = load_l2addrs(data_path)
+    comp = re.compile(PCAP_NAME_PATTERN)
+    pcapnames = os.listdir(data_path)
+    present = set(pcapnames)
+    pcaps = []
+    for pcapname in sorted(pcapnames):
+        match = comp.search(pcapname)
+        plain_pcapname = strip_compression(pcapname)
+        if plain_pcapname != pcapname and plain_pcapname in present:
+            continue
+        if match is not None and pcapname not in blacklisted and \
+           plain_pcapname not in blacklisted:
+            pcaps.append((os.path.join(data_path, pcapname),
+                          match_to_dict(match), names, experiments))
+    csvs = {}
+    try:
+        if jobs is None or jobs > 1:
+            with multiprocessing.Pool(jobs) as pool:
+                parsed = pool.map(_parse_pcap_star, pcaps)
+        else:
+            parsed = map(_parse_pcap_star, pcaps)
+        for params, rows in parsed:
+            key = tuple(params[p] for p in ["mode", "count", "delay", "nodes"])
+            if key not in csvs:
+                csv_file = open(os.path.join(
+                    data_path,
+                    "{mode}-{count}x{delay}ms{data_len}B-{nodes}-pcap.csv"
+                    .format(**params)
+                ), "w")
+                writer = csv.DictWriter(csv_file, fieldnames=PCAP_FIELDS,
+                                        delimiter=",")
+                writer.writeheader()
+                csvs[key] = {"file": csv_file, "csv": writer}
+            csvs[key]["csv"].writerows(rows)
+    finally:
+        for key in csvs:
+            csvs[key]["file"].close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generates `-pcap.csv` files with the link-layer and "
+                    "fragment stats of each node from the sniffed PCAPs"
+    )
+    parser.add_argument("-j", "--jobs", default=1, type=jobs_type,
+                        help="Number of processes to parse PCAPs with "
+                             "(0: number of CPUs, default: 1)")
+    parser.add_argument("blacklisted", nargs="*",
+                        help="Names of PCAPs (without preceding path) to "
+                             "ignore")
+    args = parser.parse_args()
+    pcaps_to_csvs(blacklisted=args.blacklisted, jobs=args.jobs)
@@ -6,10 +6,31 @@
 # General Public License v2.1. See the file LICENSE in the top level
 # directory for more details.
 
+import argparse
 import csv
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import mmap
+import multiprocessing
 import re
 import os
-import sys
+
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from ttc_sketch import ttc_sketch
 
 __author__ = "Martine S. Lenders"
 __copyright__ = "Copyright 2020 Freie Universität Berlin"
@@ -21,7 +42,7 @@ DATA_PATH = os.environ.get("DATA_PATH",
                            os.path.join(SCRIPT_PATH, "..", "..", "results"))
 NAME_PATTERN = r"icnlowpan_comp_cr_c\d+_" \
                r"m{mode}-{count}x{delay}ms{data_len}B_(?P<timestamp>\d+)"
-LOG_NAME_PATTERN = r"{}\.log$".format(NAME_PATTERN.format(
+LOG_NAME_PATTERN = r"{}\.log(\.(gz|xz|zst))?$".format(NAME_PATTERN.format(
     mode=r"(?P<mode>(reass|sfr-.*))",
     count=r"(?P<count>\d+)",
     delay=r"(?P<delay>\d+)",
@@ -79,8 +100,61 @@ STATS_CASTS = {
     "acks_abort": int,
     "acks_fwd": int,
 }
+# (Arrow) types of the RESULT_FIELDS for columnar output formats
+RESULT_TYPES = {
+    "exp_time": "int64",
+    "nodes": "uint16",
+    "mode": "category",
+    "count": "uint32",
+    "delay": "uint32",
+    "data_len": "uint32",
+    "name": "string",
+    "send_time": "uint32",
+    "recv_time": "uint32",
+    "node": "string",
+    "role": "string",
+    # counters and buffer sizes of the nodes
+    "cs_hits": "uint32",
+    "cnt_trans": "uint32",
+    "int_retrans": "uint32",
+    "pktbuf_size": "uint32",
+    "pktbuf_used": "uint32",
+    "fbuf_full": "uint32",
+    "rbuf_full": "uint32",
+    "vrb_full": "uint32",
+    "frags_complete": "uint32",
+    "dgs_complete": "uint32",
+    "dgs_retrans": "uint32",
+    "frags_orig": "uint32",
+    "frags_abort": "uint32",
+    "frags_fwd": "uint32",
+    "frags_re_nack": "uint32",
+    "frags_re_tout": "uint32",
+    "acks_full": "uint32",
+    "acks_part": "uint32",
+    "acks_abort": "uint32",
+    "acks_fwd": "uint32",
+}
+RESULT_FORMATS = ["csv", "parquet", "feather"]
+# file name extensions of the supported compressions
+COMPRESSIONS = ["gz", "xz", "zst"]
+# codecs of the columnar formats for each compression
+COLUMNAR_COMPRESSIONS = {
+    "parquet": {"gz": "gzip", "zst": "zstd"},
+    "feather": {"zst": "zstd"},
+}
+BACKENDS = ["csv", "mmap"]
+DEFAULT_BACKEND = "mmap"
+MMAP_BLOCK_SIZE = 1 << 18
+STATS_GROUPS = {
+    stat: list(comp.groupindex) for stat, comp in STATS_COMPILES.items()
+}
 LOG_BLACKLIST = {
 }
+CACHE_DIR = ".parse_results"
+MANIFEST_NAME = "manifest.json"
+# increment when the parsing changes to invalidate all cached results
+MANIFEST_VERSION = 2
 
 LOG_FIELDS = [
     "timestamp", "node", "msg", "xtimer", "name"
@@ -99,6 +173,92 @@ RESULT_FIELDS = {
 }
 
 
+def compression(filename):
+    """
+    Returns the compression of `filename` by its extension or `None`
+    """
+    ext = os.path.splitext(filename)[1][1:]
+    if ext in COMPRESSIONS:
+        return ext
+    return None
+
+
+def strip_compression(filename):
+    if compression(filename) is None:
+        return filename
+    return os.path.splitext(filename)[0]
+
+
+def open_compressed(filename, mode="rt"):
+    """
+    Opens `filename`, (de)compressing it on the fly according to its
+    extension (see COMPRESSIONS)
+    """
+    comp = compression(filename)
+    if comp == "gz":
+        return gzip.open(filename, mode)
+    if comp == "xz":
+        return lzma.open(filename, mode)
+    if comp == "zst":
+        if zstandard is None:
+            raise ValueError("{} requires zstandard".format(filename))
+        return zstandard.open(filename, mode)
+    return open(filename, mode)
+
+
+def _build_msg_dispatch():
+    """
+    Indexes ROLES_COMPILES and STATS_COMPILES by the first token of the
+    messages they match. All patterns sharing a first token are joined into
+    one alternation, so every message is matched against at most one regular
+    expression in `dispatch_msg()`.
+    """
+    patterns = {}
+    for kind, compiles in (("role", ROLES_COMPILES),
+                           ("stat", STATS_COMPILES)):
+        for name, comp in compiles.items():
+            token = comp.pattern.split(None, 1)[0]
+            # first token must be a literal to be usable as an index
+            assert re.escape(token) == token, token
+            patterns.setdefault(token, []).append((kind, name, comp.pattern))
+    res = {}
+    for token, alternatives in patterns.items():
+        names = {}
+        pattern = []
+        for kind, name, alternative in alternatives:
+            group = "_{}_{}".format(kind, name)
+            names[group] = kind, name
+            pattern.append("(?P<{}>{})".format(group, alternative))
+        res[token] = re.compile("|".join(pattern)), names
+    return res
+
+
+MSG_DISPATCH = _build_msg_dispatch()
+# for the mmap backend, which only decodes messages that can match
+MSG_DISPATCH_BYTES = {token.encode() for token in MSG_DISPATCH}
+STATS_LISTINGS_BYTES = {msg.encode(): stat
+                        for msg, stat in STATS_LISTINGS.items()}
+
+
+def dispatch_msg(msg):
+    """
+    Matches `msg` against ROLES_COMPILES and STATS_COMPILES.
+
+    Returns a tuple of the kind of the match (`"role"` or `"stat"`), the name
+    of the matching role or stat, and the match object. If `msg` does not
+    match, a tuple of `None`s is returned.
+    """
+    tokens = msg.split(None, 1) if msg else None
+    if tokens and tokens[0] in MSG_DISPATCH:
+        comp, names = MSG_DISPATCH[tokens[0]]
+        match = comp.match(msg)
+        if match:
+            # the outermost group of the matching alternative closes last
+            kind, name = names[match.lastgroup]
+            return kind, name, match
+    return None, None, None
+
+
 def update_stats(res, timestamp, nodes, mode, count, delay, data_len, node,
                  stats, node_roles, casts=None):
     if casts:
@@ -139,17 +299,134 @@ def inc_stat(stats, timestamp, nodes, mode, count, delay, data_len, node,
         }
 
 
-def log_to_csvs(logname, nodes, mode, count, delay, data_len, timestamp, csvs,
-                data_path=DATA_PATH):
+def log_to_results(logname, mode, count, delay, data_len, timestamp,
+                   backend=DEFAULT_BACKEND, digest=None):
+    """
+    Parses a log in a single pass. As the number of nodes is only known after
+    the whole log was read, all rows are buffered and their `nodes` column is
+    set at the end.
+
+    `backend` selects how the log is read (see BACKENDS). The `mmap` backend
+    falls back to `csv` for logs containing quotes, as the csv module would
+    treat them as quoted fields. Compressed logs (see COMPRESSIONS) are
+    decompressed while reading. If a ContentDigest `digest` is given, it is
+    updated with the content of the log while reading.
+
+    Returns the number of nodes and the `times` and `stats` rows of the log.
+    """
+    args = logname, mode, count, delay, data_len, timestamp
+    if backend == "mmap":
+        try:
+            node_set, times, stats = _read_log_mmap(*args, digest=digest)
+        except QuotedLogError:
+            node_set, times, stats = _read_log_csv(*args, digest=digest)
+    else:
+        node_set, times, stats = _read_log_csv(*args, digest=digest)
+    nodes = len(node_set)
+    times = list(times.values())
+    stats = list(stats.values())
+    for row in times:
+        row["nodes"] = nodes
+    for row in stats:
+        row["nodes"] = nodes
+    return nodes, times, stats
+
+
+def _add_time(times, key, name, msg_timestamp, mode, count, delay, data_len,
+              timestamp):
+    if name in times:
+        # only log first occurrence
+        if key not in times[name]:
+            times[name][key] = msg_timestamp
+    else:
+        times[name] = {
+            "exp_time": timestamp,
+            "nodes": None,
+            "mode": mode,
+            "count": count,
+            "delay": delay,
+            "data_len": data_len,
+            "name": name,
+            key: msg_timestamp
+        }
+
+
+class ContentDigest:
+    """
+    SHA-1 of the (decompressed) content of a log, updated by the backends
+    while they read the log. Content that was already hashed is skipped, so
+    a backend falling back to another one can read the log again.
+    """
+    def __init__(self):
+        self._sha1 = hashlib.sha1()
+        self.size = 0
+
+    def update(self, data, offset):
+        """
+        Hashes `data` found at `offset` in the content of the log
+        """
+        end = offset + len(data)
+        if offset <= self.size < end:
+            self._sha1.update(data[self.size - offset:])
+            self.size = end
+
+    def hexdigest(self):
+        return self._sha1.hexdigest()
+
+
+class _DigestReader(io.RawIOBase):
+    """
+    Passes the binary file `fileobj` through, updating `digest` with
+    everything read from it
+    """
+    def __init__(self, fileobj, digest):
+        self.fileobj = fileobj
+        self.digest = digest
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        data = self.fileobj.read(len(buf))
+        buf[:len(data)] = data
+        self.digest.update(data, self.offset)
+        self.offset += len(data)
+        return len(data)
+
+    def close(self):
+        self.fileobj.close()
+        super().close()
+
+
+def _open_log(logname, digest=None):
+    if digest is None:
+        return open_compressed(logname, "rt")
+    return io.TextIOWrapper(io.BufferedReader(
+        _DigestReader(open_compressed(logname, "rb"), digest)
+    ))
+
+
+def _read_log_csv(logname, mode, count, delay, data_len, timestamp,
+                  digest=None):
+    """
+    Reads a log with the csv module. Returns the set of nodes in the log and
+    the `times` and `stats` rows by name and by `(timestamp, node)`
+    respectively, with the `nodes` column still unset.
+    """
     times = {}
     stats = {}
-    with open(logname, "r") as logfile:
+    # the number of nodes is only known at the end of the log
+    nodes = None
+    node_set = set()
+    with _open_log(logname, digest) as logfile:
         logcsv = csv.DictReader(logfile, fieldnames=LOG_FIELDS, delimiter=";")
         node_roles = {}
         role_commands = set()
         for row in logcsv:
             msg = row["msg"]
             node = row["node"]
+            node_set.add(node)
             if msg in STATS_LISTINGS:
                 inc_stat(stats, timestamp, nodes, mode, count, delay, data_len,
                          node, node_roles, STATS_LISTINGS[msg])
@@ -158,45 +435,168 @@ def log_to_csvs(logname, nodes, mode, count, delay, data_len, timestamp, csvs,
                     key = "send_time"
                 else:
                     key = "recv_time"
-                name = row["name"]
-                msg_timestamp = row["xtimer"]
-                if name in times:
-                    # only log first occurrence
-                    if key not in times[name]:
-                        times[name][key] = msg_timestamp
-                else:
-                    times[name] = {
-                        "exp_time": timestamp,
-                        "nodes": nodes,
-                        "mode": mode,
-                        "count": count,
-                        "delay": delay,
-                        "data_len": data_len,
-                        "name": name,
-                        key: msg_timestamp
-                    }
+                _add_time(times, key, row["name"], row["xtimer"], mode, count,
+                          delay, data_len, timestamp)
             else:
-                match = None
-                for role in ROLES_COMPILES:
-                    match = ROLES_COMPILES[role].match(msg)
-                    if match and \
-                       match.group(0) not in role_commands:     # deduplicate
-                        node_roles[node] = role
-                        role_commands.add(match.group(0))
-                        break
-                if match:
-                    continue
-                for stat in STATS_COMPILES:
-                    match = STATS_COMPILES[stat].match(msg)
-                    if match:
-                        update_stats(stats, timestamp, nodes, mode, count,
-                                     delay, data_len, node, match.groupdict(),
-                                     node_roles, casts=STATS_CASTS)
-                        break
-                if match:
+                kind, name, match = dispatch_msg(msg)
+                if kind == "role":
+                    command = match.group(0)
+                    if command not in role_commands:    # deduplicate
+                        node_roles[node] = name
+                        role_commands.add(command)
+                elif kind == "stat":
+                    update_stats(stats, timestamp, nodes, mode, count,
+                                 delay, data_len, node,
+                                 {group: match.group(group)
+                                  for group in STATS_GROUPS[name]},
+                                 node_roles, casts=STATS_CASTS)
+    return node_set, times, stats
+
+
+class QuotedLogError(Exception):
+    """
+    Raised by the `mmap` backend for logs it can not split like the csv
+    module
+    """
+    pass
+
+
+def _split_lines(block):
+    # the csv module would treat quotes as quoting
+    if b'"' in block:
+        raise QuotedLogError()
+    if b"\r" in block:
+        return block.splitlines()
+    return block.split(b"\n")
+
+
+def _log_lines(logname, block_size=MMAP_BLOCK_SIZE, digest=None):
+    """
+    Yields the lines of a log in lists of bytes per block of about
+    `block_size` bytes. The lines are split as in universal newlines mode,
+    like the text mode file the csv module reads from.
+
+    Uncompressed logs are memory-mapped, compressed logs are decompressed
+    block by block. Each block is added to the ContentDigest `digest`, if
+    given.
+    """
+    if compression(logname) is None:
+        yield from _mmap_lines(logname, block_size, digest)
+        return
+    with open_compressed(logname, "rb") as logfile:
+        rest = b""
+        offset = 0
+        while True:
+            chunk = logfile.read(block_size)
+            if not chunk:
+                break
+            if digest is not None:
+                digest.update(chunk, offset)
+            offset += len(chunk)
+            block = rest + chunk
+            end = block.rfind(b"\n") + 1
+            rest = block[end:]
+            if end:
+                yield _split_lines(block[:end])
+        if rest:
+            yield _split_lines(rest)
+
+
+def _mmap_lines(logname, block_size=MMAP_BLOCK_SIZE, digest=None):
+    with open(logname, "rb") as logfile:
+        size = os.fstat(logfile.fileno()).st_size
+        if not size:
+            return
+        with mmap.mmap(logfile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = 0
+            while start < size:
+                end = size
+                if start + block_size < size:
+                    end = data.rfind(b"\n", start, start + block_size) + 1
+                    if end <= start:
+                        # line longer than `block_size`
+                        end = data.find(b"\n", start + block_size) + 1 or size
+                block = data[start:end]
+                if digest is not None:
+                    digest.update(block, start)
+                yield _split_lines(block)
+                start = end
+
+
+def _read_log_mmap(logname, mode, count, delay, data_len, timestamp,
+                   digest=None):
+    """
+    Same as `_read_log_csv()`, but splits the memory-mapped lines of the log
+    into fields without building a row dictionary. Only the fields needed for
+    the message type are decoded. Raises QuotedLogError if the log contains
+    quotes.
+    """
+    times = {}
+    stats = {}
+    # the number of nodes is only known at the end of the log
+    nodes = None
+    # decoded node names by their bytes; all of them form the node set
+    node_names = {None: None}
+    has_none_node = False
+    node_roles = {}
+    role_commands = set()
+    for lines in _log_lines(logname, digest=digest):
+        for line in lines:
+            if not line:
+                # the csv module skips empty lines
+                continue
+            fields = line.split(b";")
+            num_fields = len(fields)
+            if num_fields < 2:
+                has_none_node = True
+                continue
+            try:
+                node = node_names[fields[1]]
+            except KeyError:
+                node = node_names[fields[1]] = fields[1].decode()
+            if num_fields < 3:
+                continue
+            msg = fields[2]
+            if msg in STATS_LISTINGS_BYTES:
+                inc_stat(stats, timestamp, nodes, mode, count, delay, data_len,
+                         node, node_roles, STATS_LISTINGS_BYTES[msg])
+            elif msg == b"qt" or msg == b"pr":
+                _add_time(times, "send_time" if msg == b"qt" else "recv_time",
+                          fields[4].decode() if num_fields > 4 else None,
+                          fields[3].decode() if num_fields > 3 else None,
+                          mode, count, delay, data_len, timestamp)
+            else:
+                tokens = msg.split(None, 1)
+                if not tokens or tokens[0] not in MSG_DISPATCH_BYTES:
+                    # can't match any pattern, see `dispatch_msg()`
                     continue
-    csvs[mode, count, delay, nodes]["times"]["csv"].writerows(times.values())
-    csvs[mode, count, delay, nodes]["stats"]["csv"].writerows(stats.values())
+                kind, name, match = dispatch_msg(msg.decode())
+                if kind == "role":
+                    command = match.group(0)
+                    if command not in role_commands:    # deduplicate
+                        node_roles[node] = name
+                        role_commands.add(command)
+                elif kind == "stat":
+                    update_stats(stats, timestamp, nodes, mode, count,
+                                 delay, data_len, node,
+                                 {group: match.group(group)
+                                  for group in STATS_GROUPS[name]},
+                                 node_roles, casts=STATS_CASTS)
+    node_set = set(node_names.values())
+    if not has_none_node:
+        node_set.discard(None)
+    return node_set, times, stats
+
+
+def log_to_csvs(logname, mode, count, delay, data_len, timestamp, csvs,
+                data_path=DATA_PATH):
+    params = {"mode": mode, "count": count, "delay": delay,
+              "data_len": data_len, "timestamp": timestamp}
+    params["nodes"], times, stats = log_to_results(logname, **params)
+    res_csvs = open_csvs(csvs, params, data_path=data_path)
+    res_csvs["times"]["csv"].writerows(times)
+    res_csvs["stats"]["csv"].writerows(stats)
+    res_csvs["ttc"]["csv"].writerows(times)
 
 
 def match_to_dict(match):
@@ -207,54 +607,340 @@ def match_to_dict(match):
     return res
 
 
-def count_nodes(logname):
-    with open(logname, "r") as logfile:
-        nodes = set()
-        logcsv = csv.DictReader(logfile, fieldnames=LOG_FIELDS, delimiter=";")
-        for row in logcsv:
-            nodes.add(row["node"])
-        return len(nodes)
+def parse_log(logname, params, cache_path=None, backend=DEFAULT_BACKEND):
+    """
+    Parses a single log into its `times` and `stats` rows. This is run within
+    the worker processes of `logs_to_csvs()` so the arguments and return values
+    must be picklable.
+
+    If `cache_path` is given, the parsed rows are stored there and a manifest
+    entry for the log is returned in addition. The entry describes the log as
+    it was before parsing, so a log still growing is parsed again next time.
+    """
+    params = dict(params)
+    if cache_path is None:
+        params["nodes"], times, stats = log_to_results(
+            logname, backend=backend, **params
+        )
+        return params, times, stats, None
+    stat = os.stat(logname)
+    digest = ContentDigest()
+    params["nodes"], times, stats = log_to_results(
+        logname, backend=backend, digest=digest, **params
+    )
+    entry = manifest_entry(logname, digest.hexdigest(), stat)
+    with open(os.path.join(cache_path, entry["cache"]), "w") as cache_file:
+        json.dump({"params": params, "times": times, "stats": stats},
+                  cache_file)
+    return params, times, stats, entry
+
+
+def file_digest(filename):
+    """
+    Returns the SHA-1 of the (decompressed) content of `filename`, see
+    ContentDigest
+    """
+    digest = hashlib.sha1()
+    with open_compressed(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def manifest_entry(logname, digest=None, stat=None):
+    if stat is None:
+        stat = os.stat(logname)
+    if digest is None:
+        digest = file_digest(logname)
+    return {
+        "path": logname,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "sha1": digest,
+        "cache": "{}.json".format(os.path.basename(logname)),
+    }
+
+
+def load_manifest(cache_path):
+    try:
+        with open(os.path.join(cache_path, MANIFEST_NAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest["logs"]
+
+
+def store_manifest(cache_path, manifest):
+    filename = os.path.join(cache_path, MANIFEST_NAME)
+    with open(filename + ".tmp", "w") as manifest_file:
+        json.dump({"version": MANIFEST_VERSION, "logs": manifest},
+                  manifest_file, indent=2, sort_keys=True)
+    os.replace(filename + ".tmp", filename)
 
 
-def logs_to_csvs(data_path=DATA_PATH, blacklisted=None):
+def prune_manifest(cache_path, manifest):
+    """
+    Removes the entries and cached results of logs that do not exist anymore
+    """
+    for name, entry in list(manifest.items()):
+        if not os.path.exists(entry["path"]):
+            try:
+                os.remove(os.path.join(cache_path, entry["cache"]))
+            except FileNotFoundError:
+                pass
+            del manifest[name]
+
+
+def load_cached(logname, entry, cache_path):
+    """
+    Returns the cached results for `logname` if its manifest `entry` is still
+    valid or `None` if the log needs to be parsed (again).
+    """
+    if entry is None:
+        return None
+    cache_file = os.path.join(cache_path, entry["cache"])
+    if not os.path.exists(cache_file):
+        return None
+    stat = os.stat(logname)
+    if stat.st_size != entry["size"]:
+        return None
+    if stat.st_mtime_ns != entry["mtime"]:
+        # only touched? check content
+        if file_digest(logname) != entry["sha1"]:
+            return None
+        entry["mtime"] = stat.st_mtime_ns
+    with open(cache_file) as cache_file:
+        cached = json.load(cache_file)
+    return cached["params"], cached["times"], cached["stats"], entry
+
+
+def _arrow_type(type_name):
+    if type_name == "category":
+        return pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    return getattr(pyarrow, type_name)()
+
+
+def result_schema(log):
+    return pyarrow.schema([(field, _arrow_type(RESULT_TYPES[field]))
+                           for field in RESULT_FIELDS[log]])
+
+
+def _int_or_none(value):
+    # timestamps of lines truncated on the serial line may be empty or garbled
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ColumnarWriter:
+    """
+    Collects rows as `csv.DictWriter` would write them and writes them typed
+    according to RESULT_TYPES into a Parquet or Feather file on `close()`.
+    """
+    def __init__(self, filename, log, fmt, compress=None):
+        if pyarrow is None:
+            raise ValueError("Output format {} requires pyarrow".format(fmt))
+        self.filename = filename
+        self.log = log
+        self.fmt = fmt
+        self.codec = None
+        if compress is not None:
+            self.codec = COLUMNAR_COMPRESSIONS[fmt][compress]
+        self.rows = []
+
+    def writerows(self, rows):
+        self.rows.extend(rows)
+
+    def close(self):
+        schema = result_schema(self.log)
+        columns = []
+        for field in schema:
+            column = [row.get(field.name) for row in self.rows]
+            if pyarrow.types.is_integer(field.type):
+                # exp_time and the xtimer timestamps are parsed as strings
+                column = [_int_or_none(value) for value in column]
+            columns.append(pyarrow.array(column, type=field.type))
+        table = pyarrow.Table.from_arrays(columns, schema=schema)
+        if self.fmt == "parquet":
+            pyarrow.parquet.write_table(table, self.filename,
+                                        compression=self.codec or "snappy")
+        else:
+            pyarrow.feather.write_feather(
+                table, self.filename, compression=self.codec or "uncompressed"
+            )
+
+
+class TTCSketchWriter:
+    """
+    Builds a quantile sketch of the time-to-completion (TTC) for the `times`
+    rows of each run and writes them together with the number of sent
+    interests of the run into a JSON file on `close()`.
+    """
+    def __init__(self, filename, params):
+        self.filename = filename
+        self.res = {p: params[p]
+                    for p in ["mode", "count", "delay", "data_len", "nodes"]}
+        self.res["runs"] = []
+
+    def writerows(self, rows):
+        if not rows:
+            return
+        self.res["runs"].append({
+            "exp_time": rows[0]["exp_time"],
+            "sent": len(rows),
+            "ttc": ttc_sketch(rows).to_dict(),
+        })
+
+    def close(self):
+        with open(self.filename, "w") as sketch_file:
+            json.dump(self.res, sketch_file)
+
+
+def open_csvs(csvs, params, data_path=DATA_PATH, fmt="csv", compress=None):
+    key = tuple(params[p] for p in ["mode", "count", "delay", "nodes"])
+    if key not in csvs:
+        csvs[key] = {}
+        for log in ["times", "stats"]:
+            filename = os.path.join(
+                data_path,
+                "{mode}-{count}x{delay}ms{data_len}B-{nodes}-{log}.{fmt}"
+                .format(log=log, fmt=fmt, **params)
+            )
+            if fmt != "csv":
+                # the columnar formats are compressed internally
+                writer = ColumnarWriter(filename, log, fmt, compress)
+                csvs[key][log] = {"file": writer, "csv": writer}
+                continue
+            if compress is not None:
+                filename += "." + compress
+            csvs[key][log] = {
+                "file": open_compressed(filename, "wt"),
+            }
+            csvs[key][log]["csv"] = csv.DictWriter(
+                csvs[key][log]["file"],
+                fieldnames=RESULT_FIELDS[log],
+                delimiter=","
+            )
+            csvs[key][log]["csv"].writeheader()
+        writer = TTCSketchWriter(
+            os.path.join(data_path,
+                         "{mode}-{count}x{delay}ms{data_len}B-{nodes}-ttc.json"
+                         .format(**params)),
+            params
+        )
+        csvs[key]["ttc"] = {"file": writer, "csv": writer}
+    return csvs[key]
+
+
+def logs_to_csvs(data_path=DATA_PATH, blacklisted=None, jobs=1, force=False,
+                 fmt="csv", backend=DEFAULT_BACKEND, compress=None):
     if blacklisted is None:
         blacklisted = set(LOG_BLACKLIST)
     else:
         blacklisted = set(blacklisted) | set(LOG_BLACKLIST)
+    if compress is not None and fmt != "csv" and \
+       compress not in COLUMNAR_COMPRESSIONS[fmt]:
+        raise ValueError("Output format {} does not support {} compression"
+                         .format(fmt, compress))
     comp = re.compile(LOG_NAME_PATTERN)
+    lognames = sorted(os.listdir(data_path))
+    present = set(lognames)
+    logs = []
+    for logname in lognames:
+        match = comp.search(logname)
+        plain_logname = strip_compression(logname)
+        if plain_logname != logname and plain_logname in present:
+            # the log is still being compressed, use the uncompressed one
+            continue
+        if match is not None and logname not in blacklisted and \
+           plain_logname not in blacklisted:
+            logs.append((os.path.join(data_path, logname),
+                         match_to_dict(match)))
+    cache_path = os.path.join(data_path, CACHE_DIR)
+    os.makedirs(cache_path, exist_ok=True)
+    manifest = load_manifest(cache_path)
+    prune_manifest(cache_path, manifest)
+    cached = {}
+    for logname, _ in logs:
+        if force:
+            break
+        res = load_cached(logname, manifest.get(os.path.basename(logname)),
+                          cache_path)
+        if res is not None:
+            cached[logname] = res
+    to_parse = [(logname, params, cache_path, backend)
+                for logname, params in logs if logname not in cached]
     csvs = {}
+    pool = None
     try:
-        for logname in os.listdir(data_path):
-            match = comp.search(logname)
-            if match is not None and logname not in blacklisted:
-                logname = os.path.join(data_path, logname)
-                params = match_to_dict(match)
-                params["nodes"] = count_nodes(logname)
-                key = tuple(params[p] for p in ["mode", "count", "delay",
-                                                "nodes"])
-                if key not in csvs:
-                    csvs[key] = {}
-                    for log in ["times", "stats"]:
-                        csvs[key][log] = {
-                            "file": open(os.path.join(
-                                data_path,
-                                "{mode}-{count}x{delay}ms{data_len}B-"
-                                "{nodes}-{log}.csv"
-                                .format(log=log, **params)
-                            ), "w"),
-                        }
-                        csvs[key][log]["csv"] = csv.DictWriter(
-                            csvs[key][log]["file"],
-                            fieldnames=RESULT_FIELDS[log],
-                            delimiter=","
-                        )
-                        csvs[key][log]["csv"].writeheader()
-                log_to_csvs(logname, data_path=data_path, csvs=csvs, **params)
+        if to_parse and (jobs is None or jobs > 1):
+            pool = multiprocessing.Pool(jobs)
+            # imap() keeps the order of `to_parse`, so the single writer below
+            # produces the same output as a serial run
+            parsed = pool.imap(_parse_log_star, to_parse)
+        else:
+            parsed = map(_parse_log_star, to_parse)
+        for logname, _ in logs:
+            if logname in cached:
+                params, times, stats, entry = cached[logname]
+            else:
+                params, times, stats, entry = next(parsed)
+            manifest[os.path.basename(logname)] = entry
+            res_csvs = open_csvs(csvs, params, data_path=data_path, fmt=fmt,
+                                 compress=compress)
+            res_csvs["times"]["csv"].writerows(times)
+            res_csvs["stats"]["csv"].writerows(stats)
+            res_csvs["ttc"]["csv"].writerows(times)
     finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
         for key in csvs:
             for log in csvs[key]:
                 csvs[key][log]["file"].close()
+        store_manifest(cache_path, manifest)
+
+
+def _parse_log_star(args):
+    return parse_log(*args)
+
+
+def jobs_type(value):
+    value = int(value)
+    if value < 0:
+        raise argparse.ArgumentTypeError("JOBS must be >= 0")
+    # 0 means one process per CPU
+    return value or None
 
 
 if __name__ == "__main__":
-    logs_to_csvs(blacklisted=set(sys.argv))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", "--jobs", default=1, type=jobs_type,
+                        help="Number of processes to parse logs with "
+                             "(0: number of CPUs, default: 1)")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Parse all logs again, ignoring the results "
+                             "cached from previous runs")
+    parser.add_argument("-F", "--format", default="csv", dest="fmt",
+                        choices=RESULT_FORMATS,
+                        help="Output format (parquet and feather require "
+                             "pyarrow, default: csv)")
+    parser.add_argument("-z", "--compress", choices=COMPRESSIONS,
+                        help="Compress the results (CSV files get the "
+                             "extension of the compression, parquet supports "
+                             "gz and zst, feather zst; zst requires "
+                             "zstandard)")
+    parser.add_argument("-b", "--backend", default=DEFAULT_BACKEND,
+                        choices=BACKENDS,
+                        help="How to read the logs: csv module or memory "
+                             "mapped (default: {})".format(DEFAULT_BACKEND))
+    parser.add_argument("blacklisted", nargs="*",
+                        help="Names of logs (without preceding path) to "
+                             "ignore")
+    args = parser.parse_args()
+    logs_to_csvs(blacklisted=args.blacklisted, jobs=args.jobs,
+                 force=args.force, fmt=args.fmt, backend=args.backend,
+                 compress=args.compress)
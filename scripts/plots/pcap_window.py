@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020 Freie Universität Berlin
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Shows the IEEE 802.15.4 traffic sniffed between the interest for a name
+(`qt`) and the reception of its content (`pr`), e.g. for the names with the
+slowest time-to-completion.
+"""
+
+import argparse
+import csv
+import glob
+import os
+import re
+
+from parse_pcaps import PCAP_NAME_PATTERN, MmapPcap, PcapStats, \
+                        load_index, load_l2addrs, unpack_record, window
+from parse_results import COMPRESSIONS, DATA_PATH, match_to_dict, \
+                          open_compressed
+
+__author__ = "Martine S. Lenders"
+__copyright__ = "Copyright 2020 Freie Universität Berlin"
+__license__ = "LGPL v2.1"
+__email__ = "m.lenders@fu-berlin.de"
+
+DEFAULT_SLOWEST = 10
+US_PER_SEC = 1000000
+
+
+def name_key(name):
+    # names are printed with leading zeros, but e.g. pandas drops them
+    name = name.strip()
+    return int(name) if name.isdigit() else name
+
+
+def run_log(pcapname):
+    """
+    Returns the log of the run `pcapname` was sniffed in
+    """
+    base = re.sub(r"\.pcap(\.(gz|xz|zst))?$", "", pcapname)
+    for ext in [".log"] + [".log." + comp for comp in COMPRESSIONS]:
+        if os.path.exists(base + ext):
+            return base + ext
+    raise FileNotFoundError("No log found for {}".format(pcapname))
+
+
+def times_file(params, data_path=DATA_PATH):
+    """
+    Returns the `times` file of the run with `params` as generated by
+    ./parse_results.py
+    """
+    pattern = os.path.join(
+        data_path, "{mode}-{count}x{delay}ms{data_len}B-*-times.csv*"
+        .format(**params)
+    )
+    for filename in sorted(glob.glob(pattern)):
+        return filename
+    raise FileNotFoundError("No times file matches {}".format(pattern))
+
+
+def slowest_names(times_filename, exp_time, number=DEFAULT_SLOWEST):
+    """
+    Returns the `number` names of run `exp_time` with the slowest
+    time-to-completion in `times_filename` (as CSV), unanswered names first
+    """
+    ttcs = []
+    with open_compressed(times_filename, "rt") as times:
+        for row in csv.DictReader(times):
+            if row["exp_time"] != exp_time:
+                continue
+            if row["recv_time"]:
+                ttc = int(float(row["recv_time"])) - \
+                    int(float(row["send_time"]))
+            else:
+                ttc = float("inf")
+            ttcs.append((ttc, row["name"]))
+    ttcs.sort(reverse=True)
+    return [name_key(name) for _, name in ttcs[:number]]
+
+
+def name_windows(logname, names):
+    """
+    Returns the timestamps (in microseconds) the first `qt` and `pr` line for
+    each of the `names` were logged at
+    """
+    res = {}
+    names = set(names)
+    with open_compressed(logname, "rb") as logfile:
+        for line in logfile:
+            fields = line.rstrip(b"\r\n").split(b";")
+            if len(fields) < 5 or fields[2] not in (b"qt", b"pr"):
+                continue
+            name = name_key(fields[4].decode(errors="replace"))
+            if name not in names:
+                continue
+            idx = 0 if fields[2] == b"qt" else 1
+            times = res.setdefault(name, [None, None])
+            if times[idx] is None:
+                try:
+                    times[idx] = int(float(fields[0]) * US_PER_SEC)
+                except ValueError:
+                    # line got garbled on the serial line
+                    pass
+    return res
+
+
+def print_window(name, start, end, stats, answered):
+    print("{}: {:.3f}s{}, {} frames".format(
+        name, (end - start) / US_PER_SEC, "" if answered else " (no pr)",
+        sum(node.frames for node in stats.nodes.values())
+    ))
+    for node in sorted(stats.nodes):
+        node_stats = stats.nodes[node]
+        print("  {}: frames {}, frags {}, mac_retrans {}, frag_retrans {}, "
+              "airtime {}us".format(node, node_stats.frames, node_stats.frags,
+                                    node_stats.mac_retrans,
+                                    node_stats.frag_retrans,
+                                    node_stats.airtime))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Shows the sniffed traffic between the interest for a "
+                    "name and the reception of its content"
+    )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("-n", "--name", action="append", dest="names",
+                       metavar="NAME",
+                       help="Name (number of the interest) to show the "
+                            "traffic for (can be given multiple times)")
+    group.add_argument("-s", "--slowest", type=int, default=DEFAULT_SLOWEST,
+                       help="Show the traffic for the SLOWEST names with the "
+                            "slowest time-to-completion (default: {})"
+                            .format(DEFAULT_SLOWEST))
+    parser.add_argument("-t", "--times",
+                        help="CSV times file to find the slowest names in "
+                             "(default: the one of the run in DATA_PATH)")
+    parser.add_argument("-m", "--margin", type=float, default=0,
+                        help="Seconds to extend the windows by on both sides "
+                             "(default: 0)")
+    parser.add_argument("-T", "--timeout", type=float, default=10,
+                        help="Seconds to show for names without content "
+                             "(default: 10)")
+    parser.add_argument("-w", "--write", metavar="OUTPUT",
+                        help="PCAP file to write the frames in the windows to")
+    parser.add_argument("--rebuild-index", action="store_true",
+                        help="Rebuild the index of the PCAP, even if it is "
+                             "up to date")
+    parser.add_argument("pcap", help="Uncompressed PCAP of the run")
+    args = parser.parse_args()
+    match = re.search(PCAP_NAME_PATTERN, os.path.basename(args.pcap))
+    if args.names:
+        names = [name_key(name) for name in args.names]
+    elif match is None:
+        parser.error("Can not find the slowest names for {} "
+                     "(unknown naming scheme)".format(args.pcap))
+    else:
+        params = match_to_dict(match)
+        names = slowest_names(args.times or times_file(params),
+                              params["timestamp"], args.slowest)
+    windows = name_windows(run_log(args.pcap), names)
+    l2addr_names, _ = load_l2addrs(os.path.dirname(args.pcap) or ".")
+    margin = int(args.margin * US_PER_SEC)
+    output = open(args.write, "wb") if args.write else None
+    try:
+        with MmapPcap(args.pcap) as pcap:
+            index = load_index(pcap, rebuild=args.rebuild_index)
+            if output is not None:
+                output.write(pcap.header)
+            for name in names:
+                if name not in windows or windows[name][0] is None:
+                    print("{}: no qt".format(name))
+                    continue
+                start, end = windows[name]
+                answered = end is not None
+                if not answered:
+                    end = start + int(args.timeout * US_PER_SEC)
+                stats = PcapStats(l2addr_names)
+                for offset, timestamp, data in window(pcap, index,
+                                                      start - margin,
+                                                      end + margin):
+                    device, frame = unpack_record(pcap.linktype, data)
+                    if frame is not None:
+                        stats.update(timestamp, device, bytes(frame))
+                    if output is not None:
+                        output.write(pcap.raw_record(offset, data))
+                print_window(name, start, end, stats, answered)
+    finally:
+        if output is not None:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
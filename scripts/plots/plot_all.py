@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020 Freie Universität Berlin
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+import argparse
+import glob
+import multiprocessing
+import os
+
+import yaml
+
+import matplotlib.pyplot as plt                                 # noqa: E402
+
+import bootstrap                                                # noqa: E402
+import plot_cdf                                                 # noqa: E402
+import plot_scatter                                             # noqa: E402
+import plot_stats                                               # noqa: E402
+
+from parse_results import DATA_PATH, jobs_type                  # noqa: E402
+
+FIGURE_TYPES = ["cdf", "stats", "scatter"]
+DEFAULT_MANIFEST = os.path.join(os.path.dirname(__file__), "figures.yaml")
+
+# data shared with the worker processes, see `_init_worker()`
+_data = {}
+
+
+def expand_files(patterns, data_path=DATA_PATH):
+    """
+    Returns the files matching the glob `patterns`. Relative patterns are
+    relative to `data_path`.
+    """
+    res = []
+    for pattern in patterns:
+        pattern = os.path.join(data_path, pattern)
+        res.extend(f for f in sorted(glob.glob(pattern)) if f not in res)
+    return res
+
+
+def load_manifest(filename):
+    with open(filename) as manifest_file:
+        manifest = yaml.load(manifest_file, Loader=yaml.FullLoader)
+    for figure in manifest.get("figures", []):
+        if figure.get("type") not in FIGURE_TYPES:
+            raise ValueError("Unknown figure type {} in {}"
+                             .format(figure.get("type"), filename))
+        if figure["type"] == "scatter" and \
+           not all(k in figure for k in ["nodes", "stat1", "stat2"]):
+            raise ValueError("scatter figures require nodes, stat1, and stat2")
+    return manifest
+
+
+def manifest_stats(manifest):
+    """
+    Returns the stats of all figures of type `stats` in the manifest
+    """
+    res = []
+    for figure in manifest.get("figures", []):
+        if figure["type"] != "stats":
+            continue
+        stats = figure.get("stats", list(plot_stats.STAT_PLOTS))
+        if isinstance(stats, str):
+            stats = plot_stats.csl_stat(stats)
+        for stat in stats:
+            if stat not in plot_stats.STAT_PLOTS:
+                raise ValueError("Unknown stat {}".format(stat))
+            if stat not in res:
+                res.append(stat)
+    return res
+
+
+def render(job):
+    if job["type"] == "cdf":
+        plot_cdf.plot(None, hists=_data["ttcs"], ci=_data["ci"])
+    else:
+        nodes = job["nodes"]
+        if isinstance(nodes, str):
+            nodes = plot_scatter.csl(nodes)
+        plot_scatter.plot(nodes, job["stat1"], job["stat2"], None,
+                          job.get("mark_nodes", False), dfs=_data["dfs"])
+    # figures are saved by the plot functions, so free them for the next job
+    plt.close("all")
+    return job
+
+
+def _init_worker(data):
+    _data.update(data)
+
+
+def plot_all(manifest, jobs=1, use_cache=True, force=False, ci=None):
+    stats = manifest_stats(manifest)
+    figures = [figure for figure in manifest.get("figures", [])
+               if figure["type"] != "stats"]
+    data = {"ci": ci}
+    if any(figure["type"] == "cdf" for figure in figures):
+        data["ttcs"] = plot_cdf.collect_ttcs(
+            expand_files(manifest.get("times", [])), use_cache,
+            per_run=ci is not None
+        )
+    if stats or any(figure["type"] == "scatter" for figure in figures):
+        data["dfs"] = plot_cdf.collect_dataframes(
+            expand_files(manifest.get("stats", [])), use_cache
+        )
+    if stats:
+        # plot_stats.py renders its figures in its own processes and skips
+        # the ones that are up to date
+        plot_stats.plot(None, stats, dfs=data["dfs"], jobs=jobs, force=force,
+                        ci=ci)
+    if jobs == 1:
+        _init_worker(data)
+        for figure in figures:
+            print(render(figure))
+    else:
+        with multiprocessing.Pool(jobs, initializer=_init_worker,
+                                  initargs=(data,)) as pool:
+            for figure in pool.imap_unordered(render, figures):
+                print(figure)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Renders all figures listed in a manifest, reading the "
+                    "results files only once"
+    )
+    parser.add_argument("-j", "--jobs", default=1, type=jobs_type,
+                        help="Number of processes to render figures with "
+                             "(0: number of CPUs, default: 1)")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Render all bar plots, even those whose data "
+                             "did not change since they were last rendered")
+    parser.add_argument("--ci", type=bootstrap.confidence_type,
+                        metavar="LEVEL",
+                        help="Show bootstrap confidence intervals over the "
+                             "runs at LEVEL (e.g. {}) in the CDF and bar "
+                             "plots".format(bootstrap.DEFAULT_CONFIDENCE))
+    parser.add_argument("--no-cache", action="store_false", dest="use_cache",
+                        help="Do not use or update the cache of the data "
+                             "read from the results files")
+    parser.add_argument("manifest", nargs="?", default=DEFAULT_MANIFEST,
+                        help="YAML manifest of the figures to render "
+                             "(default: figures.yaml, see "
+                             "figures.example.yaml)")
+    args = parser.parse_args()
+    plot_all(load_manifest(args.manifest), args.jobs, args.use_cache,
+             args.force, args.ci)
@@ -0,0 +1,110 @@
+#
+# Copyright (C) 2020 Freie Universität Berlin
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Persistent cache for the data collected from the results files by the plot
+scripts.
+
+Entries are addressed by the kind of data and the list of input files with
+their size and modification time, so they are invalidated as soon as one of
+the input files changes. The least recently used entries are removed when the
+cache exceeds CACHE_SIZE bytes.
+"""
+
+import hashlib
+import os
+import pickle
+
+from parse_results import DATA_PATH
+
+CACHE_PATH = os.environ.get("PLOT_CACHE_PATH",
+                            os.path.join(DATA_PATH, ".plot_cache"))
+CACHE_SIZE = int(os.environ.get("PLOT_CACHE_SIZE", 512 * (1 << 20)))
+# increment when the format of the cached data changes
+CACHE_VERSION = 2
+
+
+def cache_key(kind, filenames):
+    digest = hashlib.sha1()
+    digest.update("{}:{}\n".format(CACHE_VERSION, kind).encode())
+    # order matters as the data frames are concatenated in that order
+    for filename in filenames:
+        stat = os.stat(filename)
+        digest.update("{}:{}:{}\n".format(os.path.realpath(filename),
+                                          stat.st_size, stat.st_mtime_ns)
+                      .encode())
+    return digest.hexdigest()
+
+
+def _cache_file(kind, filenames, cache_path):
+    return os.path.join(cache_path, "{}-{}.pickle".format(
+        kind, cache_key(kind, filenames)
+    ))
+
+
+def load(kind, filenames, cache_path=CACHE_PATH):
+    """
+    Returns the data of `kind` cached for `filenames` or `None` if there is
+    none
+    """
+    try:
+        cache_file = _cache_file(kind, filenames, cache_path)
+        with open(cache_file, "rb") as f:
+            res = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    except (AttributeError, ImportError):
+        # stored by another script, e.g. with the classes of a script run
+        # as __main__
+        return None
+    # mark as recently used
+    os.utime(cache_file)
+    return res
+
+
+def store(kind, filenames, data, cache_path=CACHE_PATH,
+          max_size=CACHE_SIZE):
+    os.makedirs(cache_path, exist_ok=True)
+    cache_file = _cache_file(kind, filenames, cache_path)
+    with open(cache_file + ".tmp", "wb") as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(cache_file + ".tmp", cache_file)
+    evict(cache_path, max_size)
+
+
+def evict(cache_path=CACHE_PATH, max_size=CACHE_SIZE):
+    """
+    Removes the least recently used entries until the cache is not larger
+    than `max_size` bytes
+    """
+    entries = []
+    for name in os.listdir(cache_path):
+        if not name.endswith(".pickle"):
+            continue
+        stat = os.stat(os.path.join(cache_path, name))
+        entries.append((stat.st_mtime_ns, stat.st_size, name))
+    entries.sort()
+    size = sum(entry[1] for entry in entries)
+    for _, entry_size, name in entries:
+        if size <= max_size:
+            break
+        os.remove(os.path.join(cache_path, name))
+        size -= entry_size
+
+
+def cached(kind, func, filenames, use_cache=True):
+    """
+    Returns `func(filenames)`, using the cached result for `filenames` if
+    there is one and `use_cache` is true
+    """
+    if not use_cache:
+        return func(filenames)
+    res = load(kind, filenames)
+    if res is None:
+        res = func(filenames)
+        store(kind, filenames, res)
+    return res
@@ -6,9 +6,11 @@
 # General Public License v2.1. See the file LICENSE in the top level
 # directory for more details.
 
+import argparse
+import functools
+import json
 import re
 import os
-import sys
 
 import pandas as pd
 import numpy as np
@@ -18,12 +20,23 @@ import matplotlib.pyplot as plt                     # noqa: E402
 
 from matplotlib.patches import Polygon              # noqa: E402
 
+try:
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import bootstrap                                    # noqa: E402
+import plot_cache                                   # noqa: E402
+
 from parse_results import DATA_PATH                 # noqa: E402
+from ttc_sketch import KLLSketch                    # noqa: E402
 
 
 MODE_PATTERN = r"(?P<mode>(sfr|reass))" \
                r"(-win(?P<win>\d+)ifg(?P<ifg>\d+)arq(?P<arq>\d+)" \
                r"r(?P<frag_rt>\d+)dg(?P<dg_rt>\d+))?(?P<vrep>-vrep)?$"
+MODE_COMP = re.compile(MODE_PATTERN)
 HUMAN_READABLE_MODE = {
     "reass": "HWR",
     "sfr": "SFR",
@@ -41,6 +54,12 @@ SUBPLOT_HEIGHT = 0.6
 
 US_PER_SEC = 1000000
 
+# resolution and range of the TTC histograms in microseconds
+TTC_BIN_WIDTH = 1000
+TTC_MAX = 60 * US_PER_SEC
+CDF_BINS = 100
+CHUNKSIZE = 100000
+
 
 def add_subplot_axes(ax, rect, axisbg='w'):
     # https://stackoverflow.com/a/17479417
@@ -65,38 +84,326 @@ def add_subplot_axes(ax, rect, axisbg='w'):
     return subax
 
 
-def _plot(ax, bins, cdf, mode):
+def _plot(ax, bins, cdf, mode, band=None):
     label = "{}{}".format(
         HUMAN_READABLE_MODE[mode["mode"]],
         "" if mode["mode"] == "reass" else
         " w/ VREP" if mode["vrep"] else " w/o VREP"
     )
+    if band is not None:
+        ax.fill_between(bins[1:] / US_PER_SEC, band[0], band[1],
+                        color="lightgray", alpha=.6, linewidth=0)
     ax.plot(bins[1:] / US_PER_SEC, cdf, STYLE[mode["mode"]][mode["vrep"]],
             color="k", label=label)
 
 
-def collect_dataframes(filenames):
+def read_dataframe(filename):
+    """
+    Reads a results file as generated by ./parse_results.py in any of its
+    output formats, based on the file extension.
+    """
+    if filename.endswith(".parquet"):
+        return pd.read_parquet(filename)
+    if filename.endswith(".feather"):
+        return pd.read_feather(filename)
+    return pd.read_csv(filename)
+
+
+def iter_dataframe_chunks(filename, chunksize=CHUNKSIZE):
+    """
+    Reads a results file as generated by ./parse_results.py in chunks of at
+    most `chunksize` rows.
+    """
+    if filename.endswith(".parquet"):
+        parquet_file = pyarrow.parquet.ParquetFile(filename)
+        for batch in parquet_file.iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    elif filename.endswith(".feather"):
+        with pyarrow.ipc.open_file(filename) as reader:
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i).to_pandas()
+    else:
+        yield from pd.read_csv(filename, chunksize=chunksize)
+
+
+def dataframe_key(df):
+    """
+    Returns the key a data frame is grouped by and the parsed mode of the data
+    frame or `None` if the mode of the data frame is unknown.
+    """
+    mode = df["mode"].values
+    delay = df["delay"].values
+    count = df["count"].values
+    nodes = df["nodes"].values
+    # mode, delay, count, and columns are all the same
+    assert(all(mode[0] == m for m in mode))
+    assert(all(delay[0] == d for d in delay))
+    assert(all(count[0] == c for c in count))
+    assert(all(nodes[0] == n for n in nodes))
+    match = MODE_COMP.match(mode[0])
+    if match is None:
+        return None
+    mode = match.groupdict()
+    key = mode["mode"], bool(mode["vrep"]), nodes[0], delay[0], count[0]
+    return key, mode
+
+
+class TTCHistogram:
+    """
+    Histogram of the time-to-completion (TTC) of the interests with a fixed
+    number of bins, so its size does not depend on the number of TTCs added.
+    TTCs outside of [0, max_ttc) are not binned but counted separately in
+    `underflow` and `overflow`: the CDF includes the `underflow` from its
+    start and is exact up to `max_ttc`, but does not extend beyond it.
+
+    With `per_run`, a histogram is also kept per run (`exp_time`), limited to
+    the bins the TTCs of that run fall in, for the confidence band of the CDF.
+    """
+    def __init__(self, bin_width=TTC_BIN_WIDTH, max_ttc=TTC_MAX,
+                 per_run=False):
+        self.bin_width = bin_width
+        self.counts = np.zeros(int(np.ceil(max_ttc / bin_width)),
+                               dtype=np.int64)
+        self.sent = 0
+        self.delivered = 0
+        self.underflow = 0
+        self.overflow = 0
+        self.runs = {} if per_run else None
+
+    def add(self, send_times, recv_times, exp_times=None):
+        ttcs = (np.asarray(recv_times, dtype="float") -
+                np.asarray(send_times, dtype="float"))
+        self.sent += ttcs.shape[0]
+        delivered = np.isfinite(ttcs)
+        ttcs = ttcs[delivered]
+        self.delivered += ttcs.shape[0]
+        idx = ttcs // self.bin_width
+        self.underflow += np.count_nonzero(idx < 0)
+        self.overflow += np.count_nonzero(idx >= self.counts.shape[0])
+        self.counts += np.bincount(self._in_range(idx),
+                                   minlength=self.counts.shape[0])
+        if self.runs is not None:
+            self._add_runs(np.asarray(exp_times), delivered, idx)
+
+    def _in_range(self, idx):
+        return idx[(idx >= 0) & (idx < self.counts.shape[0])].astype(int)
+
+    def _add_runs(self, exp_times, delivered, idx):
+        delivered_exp_times = exp_times[delivered]
+        for exp_time in np.unique(exp_times):
+            run_idx = idx[delivered_exp_times == exp_time]
+            sent, underflow, first, counts = self.runs.get(
+                exp_time, (0, 0, 0, None)
+            )
+            sent += np.count_nonzero(exp_times == exp_time)
+            underflow += np.count_nonzero(run_idx < 0)
+            run_idx = self._in_range(run_idx)
+            if run_idx.shape[0]:
+                lo, hi = run_idx.min(), run_idx.max() + 1
+                if counts is None:
+                    first, counts = lo, np.zeros(hi - lo, dtype=np.int64)
+                elif lo < first or hi > first + counts.shape[0]:
+                    new_first = min(first, lo)
+                    new_counts = np.zeros(
+                        max(first + counts.shape[0], hi) - new_first,
+                        dtype=np.int64
+                    )
+                    new_counts[first - new_first:
+                               first - new_first + counts.shape[0]] = counts
+                    first, counts = new_first, new_counts
+                counts += np.bincount(run_idx - first,
+                                      minlength=counts.shape[0])
+            self.runs[exp_time] = sent, underflow, first, counts
+
+    def cdf(self, bins=CDF_BINS):
+        """
+        Returns the `bins + 1` bin edges between the smallest and the largest
+        TTC and the CDF at the upper edge of each bin. As with the TTCs, the
+        CDF is scaled to the delivery ratio.
+        """
+        if not self.delivered:
+            return np.linspace(0, self.bin_width, bins + 1), \
+                np.full(bins, np.nan)
+        nonzero = np.nonzero(self.counts)[0]
+        if nonzero.shape[0]:
+            first, last = nonzero[0], nonzero[-1] + 1
+        else:
+            # all TTCs are out of range
+            first, last = 0, 1
+        edges = np.arange(first, last + 1) * self.bin_width
+        cum = self.underflow + \
+            np.concatenate([[0], np.cumsum(self.counts[first:last])])
+        res_edges = np.linspace(edges[0], edges[-1], bins + 1)
+        cdf = np.interp(res_edges, edges, cum)[1:] / self.sent
+        return res_edges, cdf
+
+    def cdf_ci(self, edges, confidence=bootstrap.DEFAULT_CONFIDENCE):
+        """
+        Returns the lower and upper bound of the bootstrap confidence band of
+        the CDF at `edges[1:]`. Requires `per_run`.
+        """
+        cum_counts = []
+        sent = []
+        for exp_time in sorted(self.runs):
+            run_sent, underflow, first, counts = self.runs[exp_time]
+            sent.append(run_sent)
+            if counts is None:
+                cum_counts.append(np.full(len(edges) - 1, underflow))
+                continue
+            run_edges = np.arange(first, first + counts.shape[0] + 1) * \
+                self.bin_width
+            cum = underflow + np.concatenate([[0], np.cumsum(counts)])
+            cum_counts.append(np.interp(edges[1:], run_edges, cum))
+        return bootstrap.ratio_ci(cum_counts, sent, confidence)
+
+
+class TTCSketch:
+    """
+    Merged TTC sketches of multiple runs (see `parse_results.py`) providing
+    the same `cdf()` and `cdf_ci()` as TTCHistogram.
+    """
+    def __init__(self, per_run=False):
+        self.sketch = KLLSketch()
+        self.sent = 0
+        self.runs = [] if per_run else None
+
+    def add(self, run):
+        sketch = KLLSketch.from_dict(run["ttc"])
+        if self.runs is not None:
+            self.runs.append((run["sent"], sketch))
+        self.sketch.merge(sketch)
+        self.sent += run["sent"]
+
+    def cdf(self, bins=CDF_BINS):
+        if not len(self.sketch):
+            return np.linspace(0, TTC_BIN_WIDTH, bins + 1), \
+                np.full(bins, np.nan)
+        edges = np.linspace(self.sketch.min, self.sketch.max, bins + 1)
+        cdf = np.array(self.sketch.cdf(edges[1:])) * len(self.sketch)
+        return edges, cdf / self.sent
+
+    def cdf_ci(self, edges, confidence=bootstrap.DEFAULT_CONFIDENCE):
+        cum_counts = [np.array(sketch.cdf(edges[1:])) * len(sketch)
+                      if len(sketch) else np.zeros(len(edges) - 1)
+                      for _, sketch in self.runs]
+        sent = [run_sent for run_sent, _ in self.runs]
+        return bootstrap.ratio_ci(cum_counts, sent, confidence)
+
+
+def sketch_key(sketches):
+    """
+    Returns the key (see `collect_dataframes()`) and the parsed mode of the
+    TTC sketches of a `-ttc.json` file or `None` if the mode is unknown
+    """
+    match = MODE_COMP.match(sketches["mode"])
+    if match is None:
+        return None
+    mode = match.groupdict()
+    key = mode["mode"], bool(mode["vrep"]), sketches["nodes"], \
+        sketches["delay"], sketches["count"]
+    return key, mode
+
+
+def collect_ttc_sketches(filenames, per_run=False):
+    """
+    Merges the TTC sketches of all runs in the `-ttc.json` files in
+    `filenames` into one TTCSketch per key (see `collect_dataframes()`).
+    """
+    res = {}
+    # sort to make the merged sketches independent of the argument order
+    for filename in sorted(filenames):
+        print(filename)
+        with open(filename) as sketch_file:
+            sketches = json.load(sketch_file)
+        key_mode = sketch_key(sketches)
+        if key_mode is None:
+            continue
+        key, mode = key_mode
+        if key not in res:
+            res[key] = {
+                "hist": TTCSketch(per_run),
+                "mode": mode,
+            }
+        for run in sketches["runs"]:
+            res[key]["hist"].add(run)
+    return res
+
+
+def collect_ttcs(filenames, use_cache=True, per_run=False):
+    """
+    Collects the TTC distributions per key from `times` results files and
+    `-ttc.json` sketch files. With `per_run`, the distributions also keep
+    the TTCs per run for their confidence bands.
+    """
+    return plot_cache.cached("ttcs-runs" if per_run else "ttcs",
+                             functools.partial(_collect_ttcs,
+                                               per_run=per_run),
+                             filenames, use_cache)
+
+
+def _collect_ttcs(filenames, per_run=False):
+    sketch_files = [f for f in filenames if f.endswith(".json")]
+    res = collect_ttc_histograms([f for f in filenames
+                                  if f not in sketch_files], per_run=per_run)
+    sketches = collect_ttc_sketches(sketch_files, per_run)
+    # the TTCs of a key are either in a histogram or in a sketch, which can't
+    # be merged
+    collisions = set(res) & set(sketches)
+    if collisions:
+        raise ValueError("TTCs of {} are given both as results and as "
+                         "sketches".format(", ".join(
+                             str(key) for key in sorted(collisions)
+                         )))
+    res.update(sketches)
+    return res
+
+
+def collect_ttc_histograms(filenames, chunksize=CHUNKSIZE, per_run=False):
+    """
+    Streams the `times` results in `filenames` into one TTCHistogram per key
+    (see `collect_dataframes()`).
+    """
+    res = {}
+    for filename in filenames:
+        print(filename)
+        for df in iter_dataframe_chunks(filename, chunksize):
+            if df.size == 0:
+                continue
+            key_mode = dataframe_key(df)
+            if key_mode is None:
+                break
+            key, mode = key_mode
+            if key not in res:
+                res[key] = {
+                    "hist": TTCHistogram(per_run=per_run),
+                    "mode": mode,
+                }
+            res[key]["hist"].add(df["send_time"].values,
+                                 df["recv_time"].values,
+                                 df["exp_time"].values)
+    return res
+
+
+def collect_dataframes(filenames, use_cache=True):
+    """
+    Reads the results files in `filenames` and concatenates the data frames
+    per `(mode, vrep, nodes, delay, count)`.
+    """
+    return plot_cache.cached("dataframes", _collect_dataframes, filenames,
+                             use_cache)
+
+
+def _collect_dataframes(filenames):
     res = {}
-    c = re.compile(MODE_PATTERN)
     for filename in filenames:
         print(filename)
-        df = pd.read_csv(filename)
+        df = read_dataframe(filename)
         if df.size == 0:
             continue
-        mode = df["mode"]
-        delay = df["delay"]
-        count = df["count"]
-        nodes = df["nodes"]
-        # mode, delay, count, and columns are all the same
-        assert(all(mode[0] == m for m in mode))
-        assert(all(delay[0] == d for d in delay))
-        assert(all(count[0] == c for c in count))
-        assert(all(nodes[0] == n for n in nodes))
-        match = c.match(mode[0])
-        if match is None:
+        key_mode = dataframe_key(df)
+        if key_mode is None:
             continue
-        mode = match.groupdict()
-        key = mode["mode"], bool(mode["vrep"]), nodes[0], delay[0], count[0]
+        key, mode = key_mode
         if key in res:
             res[key]["df"] = pd.concat([res[key]["df"], df])
         else:
@@ -107,7 +414,15 @@ def collect_dataframes(filenames):
     return res
 
 
-def plot(filenames):
+def plot(filenames, use_cache=True, hists=None, ci=None):
+    """
+    Plots the TTC CDFs from `filenames`. The TTCs can also be provided
+    pre-collected by `collect_ttcs()` as `hists`, in which case `filenames`
+    is ignored.
+
+    With `ci`, the bootstrap confidence band of that level is drawn around
+    each CDF. This requires the TTCs to be collected `per_run`.
+    """
     plt.rcParams.update({
         "lines.linewidth": .8,
         "font.family": "serif",  # use serif/main font for text elements
@@ -119,12 +434,13 @@ def plot(filenames):
              r"\setmainfont{DejaVu Serif}",  # serif font via preamble
          ])
     })
-    dfs = collect_dataframes(filenames)
+    if hists is None:
+        hists = collect_ttcs(filenames, use_cache, per_run=ci is not None)
     figs = {}
     x_max = 0
-    for key in dfs:
-        df = dfs[key]["df"]
-        mode = dfs[key]["mode"]
+    for key in hists:
+        hist = hists[key]["hist"]
+        mode = hists[key]["mode"]
         nodes = key[2]
         delay = key[3]
         count = key[4]
@@ -144,13 +460,8 @@ def plot(filenames):
             figs[fig_key]["ax1"]["max"] = 0
         else:
             figs[fig_key]["mode"].append(mode)
-        ttcs = (df["recv_time"].astype('float') -
-                df["send_time"].astype('float')).values
-        ttcs = ttcs[np.isfinite(ttcs)]
-        maxrel = ttcs.shape[0] / df["send_time"].values.shape[0]
-        hist, bins = np.histogram(ttcs, bins=100, density=1)
-        dx = bins[1] - bins[0]
-        cdf = np.cumsum(hist) * dx * maxrel
+        bins, cdf = hist.cdf()
+        band = None if ci is None else hist.cdf_ci(bins, ci)
         if not all(np.isnan(cdf)) and (max(cdf) < SUBPLOT_Y_THRESH):
             if figs[fig_key]["ax1"]["ax"] is None:
                 figs[fig_key]["ax1"]["ax"] = add_subplot_axes(
@@ -179,8 +490,8 @@ def plot(filenames):
             if figs[fig_key]["ax1"]["min"] > min(bins):
                 figs[fig_key]["ax1"]["min"] = \
                     (min(bins) // scale) * scale
-            _plot(figs[fig_key]["ax1"]["ax"], bins, cdf, mode)
-        _plot(figs[fig_key]["ax"], bins, cdf, mode)
+            _plot(figs[fig_key]["ax1"]["ax"], bins, cdf, mode, band)
+        _plot(figs[fig_key]["ax"], bins, cdf, mode, band)
         xlim = figs[fig_key]["ax"].get_xlim()
         if xlim[1] > x_max:
             x_max = xlim[1]
@@ -238,4 +549,17 @@ def plot(filenames):
 
 
 if __name__ == "__main__":
-    plot(sys.argv[1:])
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ci", type=bootstrap.confidence_type,
+                        metavar="LEVEL",
+                        help="Draw the bootstrap confidence band of the CDFs "
+                             "over the runs at LEVEL (e.g. {})"
+                             .format(bootstrap.DEFAULT_CONFIDENCE))
+    parser.add_argument("--no-cache", action="store_false", dest="use_cache",
+                        help="Do not use or update the cache of the data "
+                             "read from the results files")
+    parser.add_argument("filenames", nargs="+",
+                        help="-times or -ttc.json files as generated by "
+                             "./parse_results.py to take the TTCs from")
+    args = parser.parse_args()
+    plot(**vars(args))
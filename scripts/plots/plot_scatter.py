@@ -74,7 +74,13 @@ def mark_cluster(axes, node_role, stats1, stats2):
                   arrowprops=prop, color=annotation_color)
 
 
-def plot(node_names, stat1, stat2, filenames, mark_nodes=False):
+def plot(node_names, stat1, stat2, filenames, mark_nodes=False,
+         use_cache=True, dfs=None):
+    """
+    Plots `stat1` against `stat2` for `node_names` from `filenames`. The data
+    frames can also be provided pre-collected by `collect_dataframes()` as
+    `dfs`, in which case `filenames` is ignored.
+    """
     assert stat1 in STAT_PLOTS
     assert stat2 in STAT_PLOTS
     plt.rcParams.update({
@@ -89,7 +95,8 @@ def plot(node_names, stat1, stat2, filenames, mark_nodes=False):
              r"\setmainfont{DejaVu Serif}",  # serif font via preamble
          ])
     })
-    dfs = collect_dataframes(filenames)
+    if dfs is None:
+        dfs = collect_dataframes(filenames, use_cache)
     figs = {}
     sfr_only = STAT_PLOTS[stat1].get("sfr_only") or \
         STAT_PLOTS[stat2].get("sfr_only")
@@ -114,8 +121,8 @@ def plot(node_names, stat1, stat2, filenames, mark_nodes=False):
             figs[fig_key]["ax"] = figs[fig_key]["fig"].add_subplot(111)
         else:
             figs[fig_key]["mode"].append(mode)
-        stats1 = STAT_PLOTS[stat1]["column"](df, count, nodes)
-        stats2 = STAT_PLOTS[stat2]["column"](df, count, nodes)
+        stats1 = STAT_PLOTS[stat1]["metric"](df, count, nodes)
+        stats2 = STAT_PLOTS[stat2]["metric"](df, count, nodes)
         roles_index = []
         for idx in stats1.index:
             # NODE_ROLES for `nodes` contains `nodes` entries
@@ -189,10 +196,14 @@ if __name__ == "__main__":
     parser.add_argument("--mark-nodes", "-m", action="store_true",
                         help="Mark node clusters in plot for daisy chain and "
                              "1000ms delay and SFR w/o VREP")
+    parser.add_argument("--no-cache", action="store_false", dest="use_cache",
+                        help="Do not use or update the cache of the data "
+                             "read from the results files")
     parser.add_argument("nodes", type=csl,
                         help="Nodes to plot scatter plot for")
     parser.add_argument("stat1", help="Stat for x-axis")
     parser.add_argument("stat2", help="Stat for y-axis")
     parser.add_argument("filenames", help="Filenames", nargs="+")
     args = parser.parse_args()
-    plot(args.nodes, args.stat1, args.stat2, args.filenames, args.mark_nodes)
+    plot(args.nodes, args.stat1, args.stat2, args.filenames, args.mark_nodes,
+         args.use_cache)
@@ -7,18 +7,29 @@
 # directory for more details.
 
 import argparse
+import concurrent.futures
 import functools
+import hashlib
+import json
 import os
 import sys
 
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt                                 # noqa: E402
 
-from parse_results import DATA_PATH                             # noqa: E402
+import bootstrap                                                # noqa: E402
+
+from parse_results import DATA_PATH, jobs_type                  # noqa: E402
 
 from plot_cdf import HUMAN_READABLE_MODE, collect_dataframes    # noqa: E402
 
 FIGSIZE_DEFAULT = (2.4587625, 1.73851894)
+FORMATS = ["pdf", "pgf"]
+# fields of the keys of the data frames (see `collect_dataframes()`)
+KEY_FIELDS = ["mode", "vrep", "nodes", "delay", "count"]
+# digests of the data and code each figure was last rendered from
+STAMPS_FILE = os.path.join(DATA_PATH, ".plot_stats.json")
 NODE_ROLES = {
     5: {
         "m3-273": "C",
@@ -79,33 +90,33 @@ MODE_OFFSET = {
 }
 
 
-def cnt_trans_series(df, count, nodes):
-    df["cnt_trans"] = df["cnt_trans"] / count
-    return df.groupby("node")["cnt_trans"]
+def producers(nodes):
+    return len([producer for producer in NODES_ORDER[nodes]
+                if producer[0] == "P"])
+
+
+def column_metric(column, df, count, nodes):
+    return df[column]
 
 
-def frag_retrans_series(df, count, nodes):
-    df["frag_retrans"] = (df["frags_re_nack"] + df["frags_re_tout"]) / count
-    return df.groupby("node")["frag_retrans"]
+def cnt_trans_metric(df, count, nodes):
+    return df["cnt_trans"] / count
 
 
-def int_retrans_series(df, count, nodes):
-    df["int_retrans"] = df["int_retrans"] / \
-        (count * len([producer for producer in NODES_ORDER[nodes]
-                      if producer[0] == "P"]))
-    return df.groupby("node")["int_retrans"]
+def frag_retrans_metric(df, count, nodes):
+    return (df["frags_re_nack"] + df["frags_re_tout"]) / count
 
 
-def pktbuf_series(df, count, nodes):
-    df["pktbuf_usage"] = (df["pktbuf_used"] * 100) / df["pktbuf_size"]
-    return df.groupby("node")["pktbuf_usage"]
+def int_retrans_metric(df, count, nodes):
+    return df["int_retrans"] / (count * producers(nodes))
 
 
-def frags_fwd_series(df, count, nodes):
-    df["frags_fwd"] = df["frags_fwd"] / \
-        (count * len([producer for producer in NODES_ORDER[nodes]
-                      if producer[0] == "P"]))
-    return df.groupby("node")["frags_fwd"]
+def pktbuf_metric(df, count, nodes):
+    return (df["pktbuf_used"] * 100) / df["pktbuf_size"]
+
+
+def frags_fwd_metric(df, count, nodes):
+    return df["frags_fwd"] / (count * producers(nodes))
 
 
 def hide_consumers(key, nodes):
@@ -166,7 +177,7 @@ def only_forwarders(key, nodes):
 
 STAT_PLOTS = {
     "cnt_trans": {
-        "series": cnt_trans_series,
+        "metric": cnt_trans_metric,
         "ylabel": r"Content trans. [avg. \# / content]",
         "xlim": functools.partial(hide_consumers, "xlim"),
         "xticks": functools.partial(hide_consumers, "xticks"),
@@ -176,8 +187,7 @@ STAT_PLOTS = {
         "legend": {"loc": "upper left"},
     },
     "cs_hits": {
-        "series": lambda df, *args: df.groupby("node")["cs_hits"],
-        "column": lambda df, *args: df["cs_hits"],
+        "metric": functools.partial(column_metric, "cs_hits"),
         "ylabel": r"CS hit events [\#]",
         "xlim": functools.partial(hide_consumers, "xlim"),
         "xticks": functools.partial(hide_consumers, "xticks"),
@@ -189,7 +199,7 @@ STAT_PLOTS = {
         "legend": {"loc": "upper left", "fontsize": 8},
     },
     "fbuf_full": {
-        "series": lambda df, *args: df.groupby("node")["fbuf_full"],
+        "metric": functools.partial(column_metric, "fbuf_full"),
         "ylabel": r"Fragment buffer events [\#]",
         "xlim": functools.partial(all_nodes, "xlim"),
         "xticks": functools.partial(all_nodes, "xticks"),
@@ -198,7 +208,7 @@ STAT_PLOTS = {
         "legend": {"loc": "upper left"},
     },
     "frag_fwd": {
-        "series": frags_fwd_series,
+        "metric": frags_fwd_metric,
         "ylabel": r"Fragments fwd. [avg. \# / content]",
         "xlim": functools.partial(only_forwarders, "xlim"),
         "xticks": functools.partial(only_forwarders, "xticks"),
@@ -208,7 +218,7 @@ STAT_PLOTS = {
                    "bbox_to_anchor": (0.5, 1.2)},
     },
     "frag_retrans": {
-        "series": frag_retrans_series,
+        "metric": frag_retrans_metric,
         "ylabel": r"Fragment retrans. [avg. \# / content]",
         "xlim": functools.partial(hide_consumers, "xlim"),
         "xticks": functools.partial(hide_consumers, "xticks"),
@@ -219,7 +229,7 @@ STAT_PLOTS = {
         "legend": {"loc": "upper left"},
     },
     "int_retrans": {
-        "series": int_retrans_series,
+        "metric": int_retrans_metric,
         "ylabel": "Interest retrans.\n[avg. \\# / content]",
         "xlim": functools.partial(hide_producers, "xlim"),
         "xticks": functools.partial(hide_producers, "xticks"),
@@ -228,7 +238,7 @@ STAT_PLOTS = {
         "ysteps": 1,
     },
     "pktbuf": {
-        "series": pktbuf_series,
+        "metric": pktbuf_metric,
         "ylabel": r"Packet buffer usage [\%]",
         "xlim": functools.partial(all_nodes, "xlim"),
         "xticks": functools.partial(all_nodes, "xticks"),
@@ -239,8 +249,7 @@ STAT_PLOTS = {
         "figsize": (4.917525, 1.3021813),
     },
     "vrb_full": {
-        "series": lambda df, *args: df.groupby("node")["vrb_full"],
-        "column": lambda df, *args: df["vrb_full"],
+        "metric": functools.partial(column_metric, "vrb_full"),
         "ylabel": r"VRB full events [\#]",
         "xlim": functools.partial(only_forwarders, "xlim"),
         "xticks": functools.partial(only_forwarders, "xticks"),
@@ -251,7 +260,7 @@ STAT_PLOTS = {
         "legend": {"loc": "upper left"},
     },
     "rbuf_full": {
-        "series": lambda df, *args: df.groupby("node")["rbuf_full"],
+        "metric": functools.partial(column_metric, "rbuf_full"),
         "ylabel": r"RB full events [\#]",
         "xlim": functools.partial(hide_producers, "xlim"),
         "xticks": functools.partial(hide_producers, "xticks"),
@@ -291,7 +300,7 @@ def set_axes(axes, nodes, stat):
     axes.set_ylabel(STAT_PLOTS[stat]["ylabel"])
 
 
-def plot(filenames, stats_to_plot=None):
+def setup_rc():
     plt.rcParams.update({
         "figure.max_open_warning": 40,
         "lines.linewidth": .8,
@@ -304,87 +313,234 @@ def plot(filenames, stats_to_plot=None):
              r"\setmainfont{DejaVu Serif}",  # serif font via preamble
          ])
     })
+
+
+def stats_table(dfs, stats_to_plot=None, ci=None):
+    """
+    Aggregates the metrics of `stats_to_plot` (default: all) per node of each
+    data frame in `dfs` (see `collect_dataframes()`) in a single pass.
+
+    Returns a table with one row per key, node, and stat and the columns
+    KEY_FIELDS, `node`, `role`, `stat`, `mean`, `std`, and `n`. With `ci`,
+    the bounds of the bootstrap confidence interval of that level of the
+    mean over the runs are added as `ci_low` and `ci_high`. The data frames
+    in `dfs` are not modified.
+    """
     if stats_to_plot is None:
         stats_to_plot = STAT_PLOTS.keys()
-    dfs = collect_dataframes(filenames)
-    figs = {}
-    for key in dfs:
+    tables = []
+    for key in sorted(dfs):
         df = dfs[key]["df"]
         mode = dfs[key]["mode"]
         nodes = key[2]
+        count = key[4]
+        stats = [stat for stat in stats_to_plot
+                 if mode["mode"] == "sfr" or
+                 not STAT_PLOTS[stat].get("sfr_only", False)]
+        if not stats:
+            continue
+        metrics = pd.DataFrame({
+            stat: STAT_PLOTS[stat]["metric"](df, count, nodes).values
+            for stat in stats
+        })
+        metrics["node"] = df["node"].values
+        agg = metrics.groupby("node").agg(["mean", "std", "count"])
+        if ci is not None:
+            metrics["exp_time"] = df["exp_time"].values
+            agg = agg.join(mean_ci(metrics, stats, ci))
+        for stat in stats:
+            table = agg[stat].rename(columns={"count": "n"}).reset_index()
+            table["role"] = table["node"].map(NODE_ROLES[nodes])
+            table["stat"] = stat
+            for field, value in zip(KEY_FIELDS, key):
+                table[field] = value
+            tables.append(table)
+    columns = KEY_FIELDS + ["node", "role", "stat", "mean", "std", "n"]
+    if ci is not None:
+        columns += ["ci_low", "ci_high"]
+    if not tables:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(tables, ignore_index=True)[columns]
+
+
+def mean_ci(metrics, stats, ci):
+    """
+    Returns the bounds of the bootstrap confidence interval of the mean of
+    each of `stats` per node in `metrics`, resampling the runs. The columns
+    are `(stat, "ci_low")` and `(stat, "ci_high")` as in the aggregation in
+    `stats_table()`.
+    """
+    runs = metrics.groupby(["exp_time", "node"])[stats]
+    # one row per run, one column per stat and node
+    sums = runs.sum().unstack("node", fill_value=0)
+    counts = runs.count().unstack("node", fill_value=0)
+    low, high = bootstrap.ratio_ci(sums.values, counts[sums.columns].values,
+                                   ci)
+    res = pd.DataFrame({"ci_low": low, "ci_high": high},
+                       index=sums.columns).unstack(0)
+    return res.swaplevel(axis=1)
+
+
+def figure_jobs(dfs, stats_to_plot, formats=FORMATS, ci=None):
+    """
+    Returns one picklable job per figure to be rendered by `render_figure()`,
+    ordered by `(nodes, delay, count, stat)`.
+    """
+    figs = {}
+    table = stats_table(dfs, stats_to_plot, ci)
+    # sort, so the bars are added in the same order regardless of the order
+    # of the files
+    for (*key, stat), rows in table.groupby(KEY_FIELDS + ["stat"],
+                                            sort=True):
+        mode = dfs[tuple(key)]["mode"]
+        nodes = key[2]
         delay = key[3]
         count = key[4]
-        for stat in stats_to_plot:
-            sfr_only = STAT_PLOTS[stat].get("sfr_only", False)
-            if sfr_only and mode["mode"] != "sfr":
-                continue
-            fig_key = (nodes, delay, count, stat)
-            if fig_key not in figs:
-                figs[fig_key] = {}
-                figs[fig_key]["mode"] = [mode]
-                figs[fig_key]["fig"] = plt.figure(
-                    figsize=STAT_PLOTS[stat].get("figsize", FIGSIZE_DEFAULT)
-                )
-                figs[fig_key]["ax"] = figs[fig_key]["fig"].add_subplot(111)
-            else:
-                figs[fig_key]["mode"].append(mode)
-            stats = STAT_PLOTS[stat]["series"](df, count, nodes)
-            mean = stats.mean()
-            std = stats.std()
-            roles_index = []
-            for idx in mean.index:
-                # NODE_ROLES for `nodes` contains `nodes` entries
-                assert(nodes == len(NODE_ROLES[nodes]))
-                roles_index.append(NODE_ROLES[nodes][idx])
-            mean.index = roles_index
-            std.index = roles_index
-            # NODES_ORDER for `nodes` contains `nodes` entries
-            assert(nodes == len(NODES_ORDER[nodes]))
-            nodes_order = [n for n in NODES_ORDER[nodes] if n in mean.index]
-            x = np.array([i for i, n in enumerate(NODES_ORDER[nodes])
-                          if n in mean.index])
-            label = "{}{}".format(
-                HUMAN_READABLE_MODE[mode["mode"]],
-                "" if mode["mode"] == "reass" else
-                " w/ VREP" if mode["vrep"] else " w/o VREP"
-            )
-            figs[fig_key]["ax"].bar(
-                x + MODE_OFFSET[sfr_only][mode["mode"]][mode["vrep"]],
-                mean[:][nodes_order],
-                BAR_WIDTH[sfr_only],
-                color=STYLE[mode["mode"]][mode["vrep"]],
-                linewidth=.5,
-                edgecolor="k",
-                yerr=std[:][nodes_order],
-                label=label
-            )
-            if "legend" in STAT_PLOTS[stat]:
-                if "fontsize" not in STAT_PLOTS[stat]["legend"]:
-                    STAT_PLOTS[stat]["legend"]["fontsize"] = 9
-                figs[fig_key]["ax"].legend(
-                    **STAT_PLOTS[stat]["legend"]
-                )
-            plt.gcf()
-    for fig_key in figs:
-        nodes = fig_key[0]
-        delay = fig_key[1]
-        count = fig_key[2]
-        stat = fig_key[3]
-        set_axes(figs[fig_key]["ax"], nodes, stat)
-        plot_name = os.path.join(
-            DATA_PATH,
-            "{stat}-{nodes}-{count}x{delay}ms"
-            .format(stat=stat.replace("_", "-"),
-                    nodes=nodes, count=count, delay=delay)
-        )
-        figs[fig_key]["fig"].savefig(
-            "{}.pdf".format(plot_name),
-            bbox_inches="tight"
+        rows = rows.set_index("role")
+        fig_key = (nodes, delay, count, stat)
+        if fig_key not in figs:
+            figs[fig_key] = {
+                "fig_key": fig_key,
+                "plot_name": os.path.join(
+                    DATA_PATH,
+                    "{stat}-{nodes}-{count}x{delay}ms"
+                    .format(stat=stat.replace("_", "-"),
+                            nodes=nodes, count=count, delay=delay)
+                ),
+                "formats": formats,
+                "bars": [],
+            }
+        if ci is None:
+            err = rows["std"]
+        else:
+            # distances of the lower and upper bound from the mean
+            err = pd.DataFrame({"low": rows["mean"] - rows["ci_low"],
+                                "high": rows["ci_high"] - rows["mean"]})
+        figs[fig_key]["bars"].append((mode, rows["mean"], err))
+    return [figs[fig_key] for fig_key in sorted(figs)]
+
+
+def render_figure(job):
+    """
+    Renders and saves the figure of a job generated by `figure_jobs()`
+    """
+    setup_rc()
+    nodes, _, _, stat = job["fig_key"]
+    sfr_only = STAT_PLOTS[stat].get("sfr_only", False)
+    fig = plt.figure(figsize=STAT_PLOTS[stat].get("figsize", FIGSIZE_DEFAULT))
+    ax = fig.add_subplot(111)
+    for mode, mean, err in job["bars"]:
+        # NODES_ORDER for `nodes` contains `nodes` entries
+        assert(nodes == len(NODES_ORDER[nodes]))
+        nodes_order = [n for n in NODES_ORDER[nodes] if n in mean.index]
+        x = np.array([i for i, n in enumerate(NODES_ORDER[nodes])
+                      if n in mean.index])
+        label = "{}{}".format(
+            HUMAN_READABLE_MODE[mode["mode"]],
+            "" if mode["mode"] == "reass" else
+            " w/ VREP" if mode["vrep"] else " w/o VREP"
         )
-        figs[fig_key]["fig"].savefig(
-            "{}.pgf".format(plot_name),
-            bbox_inches="tight"
+        ax.bar(
+            x + MODE_OFFSET[sfr_only][mode["mode"]][mode["vrep"]],
+            mean[:][nodes_order],
+            BAR_WIDTH[sfr_only],
+            color=STYLE[mode["mode"]][mode["vrep"]],
+            linewidth=.5,
+            edgecolor="k",
+            yerr=err.loc[nodes_order].values.T,
+            label=label
         )
+    if "legend" in STAT_PLOTS[stat]:
+        if "fontsize" not in STAT_PLOTS[stat]["legend"]:
+            STAT_PLOTS[stat]["legend"]["fontsize"] = 9
+        ax.legend(**STAT_PLOTS[stat]["legend"])
+    set_axes(ax, nodes, stat)
+    for fmt in job["formats"]:
+        fig.savefig("{}.{}".format(job["plot_name"], fmt),
+                    bbox_inches="tight")
+    plt.close(fig)
+    return job["plot_name"]
+
+
+def job_digest(job):
+    """
+    Returns a digest of the data and the code a figure is rendered from
+    """
+    digest = hashlib.sha1()
+    with open(__file__, "rb") as script:
+        digest.update(script.read())
+    digest.update(json.dumps(
+        [job["fig_key"],
+         [(mode, mean.to_dict(), err.to_dict())
+          for mode, mean, err in job["bars"]]],
+        sort_keys=True, default=str
+    ).encode())
+    return digest.hexdigest()
+
+
+def load_stamps(stamps_file=STAMPS_FILE):
+    try:
+        with open(stamps_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def store_stamps(stamps, stamps_file=STAMPS_FILE):
+    with open(stamps_file + ".tmp", "w") as f:
+        json.dump(stamps, f, indent=2, sort_keys=True)
+    os.replace(stamps_file + ".tmp", stamps_file)
+
+
+def is_up_to_date(job, digest, stamps):
+    return stamps.get(job["plot_name"]) == digest and \
+        all(os.path.exists("{}.{}".format(job["plot_name"], fmt))
+            for fmt in job["formats"])
+
+
+def plot(filenames, stats_to_plot=None, use_cache=True, dfs=None,
+         formats=FORMATS, jobs=1, force=False, ci=None):
+    """
+    Plots the stats from `filenames`. The data frames can also be provided
+    pre-collected by `collect_dataframes()` as `dfs`, in which case
+    `filenames` is ignored.
+
+    The error bars show the standard deviation or, with `ci`, the bootstrap
+    confidence interval of that level of the mean over the runs.
+
+    The figures are rendered by `jobs` processes (`None`: number of CPUs).
+    Figures which were already rendered from the same data are skipped
+    unless `force` is true.
+    """
+    if stats_to_plot is None:
+        stats_to_plot = STAT_PLOTS.keys()
+    if dfs is None:
+        dfs = collect_dataframes(filenames, use_cache)
+    stamps = load_stamps()
+    to_render = []
+    for job in figure_jobs(dfs, stats_to_plot, formats, ci):
+        digest = job_digest(job)
+        if not force and is_up_to_date(job, digest, stamps):
+            print("{} is up to date".format(job["plot_name"]))
+            continue
+        to_render.append((job, digest))
+    executor = None
+    try:
+        if jobs == 1:
+            results = map(render_figure, (job for job, _ in to_render))
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(jobs)
+            # map() yields the results in the order of the jobs
+            results = executor.map(render_figure,
+                                   (job for job, _ in to_render))
+        for (job, digest), plot_name in zip(to_render, results):
+            print(plot_name)
+            stamps[job["plot_name"]] = digest
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        # keep the stamps of the figures rendered so far
+        store_stamps(stamps)
 
 
 def csl_stat(values):
@@ -397,6 +553,16 @@ def csl_stat(values):
     return res
 
 
+def csl_format(values):
+    res = []
+    for value in values.split(","):
+        value = value.strip()
+        if value not in FORMATS:
+            raise ValueError("Unknown format {}".format(value))
+        res.append(value)
+    return res
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-s", "--stat", nargs="?", default=STAT_PLOTS.keys(),
@@ -404,6 +570,25 @@ if __name__ == "__main__":
                         help="Comma separated list of stat to plot. "
                              "Possible values: {}. Default: all"
                              .format(", ".join(STAT_PLOTS.keys())))
+    parser.add_argument("--ci", type=bootstrap.confidence_type,
+                        metavar="LEVEL",
+                        help="Show the bootstrap confidence interval of the "
+                             "means over the runs at LEVEL (e.g. {}) instead "
+                             "of the standard deviation"
+                             .format(bootstrap.DEFAULT_CONFIDENCE))
+    parser.add_argument("--formats", default=FORMATS, type=csl_format,
+                        help="Comma separated list of formats to save the "
+                             "figures in. Possible values: {}. Default: all"
+                             .format(", ".join(FORMATS)))
+    parser.add_argument("-j", "--jobs", default=1, type=jobs_type,
+                        help="Number of processes to render figures with "
+                             "(0: number of CPUs, default: 1)")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Render all figures, even those whose data did "
+                             "not change since they were last rendered")
+    parser.add_argument("--no-cache", action="store_false", dest="use_cache",
+                        help="Do not use or update the cache of the data "
+                             "read from the results files")
     parser.add_argument("filenames", nargs="+",
                         help="CSV files as generated by ./parse_results.py to "
                              "takes stats from")
@@ -0,0 +1,327 @@
+# Copyright (C) 2020 Freie Universität Berlin
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests parse_pcaps.py on small hand-built captures. Run with
+
+    python3 -m pytest test_parse_pcaps.py
+"""
+
+import os
+import random
+import struct
+
+import parse_pcaps
+
+from parse_pcaps import FRAME_TYPE_ACK, FRAME_TYPE_DATA, \
+                        LINKTYPE_IEEE802_15_4_NOFCS, LINKTYPE_IPV6, \
+                        MmapPcap, PcapIndex, ZEP_PORT
+
+# short addresses of the nodes, transmitted in little endian
+CONSUMER = "00:01"
+FORWARDER = "00:02"
+PRODUCER = "00:03"
+NAMES = {CONSUMER: "m3-1", FORWARDER: "m3-2", PRODUCER: "m3-3"}
+
+
+def short_addr(addr):
+    return bytes(reversed(bytes.fromhex(addr.replace(":", ""))))
+
+
+def data_frame(seq, dst, src, payload, ack_req=True):
+    """
+    Returns an IEEE 802.15.4 data frame (without FCS) with short addresses
+    and PAN ID compression
+    """
+    fcf = FRAME_TYPE_DATA | (0x20 if ack_req else 0) | 0x40 | \
+        (2 << 10) | (2 << 14)
+    return struct.pack("<HB", fcf, seq) + b"\x23\x00" + short_addr(dst) + \
+        short_addr(src) + payload
+
+
+def ack_frame(seq):
+    return struct.pack("<HB", FRAME_TYPE_ACK, seq)
+
+
+def frag1(size, tag, payload=b"\x00" * 8):
+    return struct.pack("!HH", 0xc000 | size, tag) + payload
+
+
+def fragn(size, tag, offset, payload=b"\x00" * 8):
+    return struct.pack("!HHB", 0xe000 | size, tag, offset // 8) + payload
+
+
+def zep(device, frame, version=2, zep_type=1):
+    # the frame is followed by two bytes of FCS or LQI and RSSI
+    frame = frame + b"\xff\xff"
+    if version == 1:
+        return b"EX" + struct.pack("!BBHBB7xB", 1, 26, device, 0, 0xff,
+                                   len(frame)) + frame
+    return b"EX" + struct.pack("!BBBHBBQI10xB", 2, zep_type, 26, device, 0,
+                               0xff, 0, 0, len(frame)) + frame
+
+
+def ipv6_udp(payload, port=ZEP_PORT):
+    udp = struct.pack("!HHHH", port, port, 8 + len(payload), 0) + payload
+    return struct.pack("!IHBB", 0x60000000, len(udp), 17, 64) + \
+        b"\x00" * 32 + udp
+
+
+def write_pcap(filename, records, linktype=LINKTYPE_IPV6):
+    """
+    Writes the `(timestamp, data)` records (timestamps in microseconds) to
+    a pcap file
+    """
+    with open(filename, "wb") as pcap:
+        pcap.write(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535,
+                               linktype))
+        for timestamp, data in records:
+            pcap.write(struct.pack("<IIII", timestamp // 1000000,
+                                   timestamp % 1000000, len(data),
+                                   len(data)))
+            pcap.write(data)
+
+
+def sniffed(records):
+    """
+    Returns the records of `(timestamp, device, frame)` as captured through
+    the sniffer aggregator
+    """
+    return [(timestamp, ipv6_udp(zep(device, frame)))
+            for timestamp, device, frame in records]
+
+
+def test_parse_frame():
+    frame = data_frame(42, FORWARDER, CONSUMER, b"payload")
+    assert parse_pcaps.parse_frame(frame) == \
+        (FRAME_TYPE_DATA, 42, True, FORWARDER, CONSUMER, b"payload")
+    assert parse_pcaps.parse_frame(ack_frame(42)) == \
+        (FRAME_TYPE_ACK, 42, False, None, None, b"")
+
+
+def test_parse_frame_long_src():
+    # without PAN ID compression, the source PAN ID precedes the address
+    fcf = FRAME_TYPE_DATA | (2 << 10) | (3 << 14)
+    frame = struct.pack("<HB", fcf, 1) + b"\x23\x00" + short_addr("FF:FF") + \
+        b"\x23\x00" + bytes(range(8)) + b"\x60"
+    assert parse_pcaps.parse_frame(frame) == \
+        (FRAME_TYPE_DATA, 1, False, "FF:FF", "07:06:05:04:03:02:01:00",
+         b"\x60")
+
+
+def test_parse_frame_malformed():
+    assert parse_pcaps.parse_frame(b"\x41") is None
+    # addressing mode 1 is reserved
+    assert parse_pcaps.parse_frame(struct.pack("<HB", 1 | (1 << 10), 1)) \
+        is None
+    # frame ends within the source address
+    assert parse_pcaps.parse_frame(
+        data_frame(1, FORWARDER, CONSUMER, b"")[:-1]
+    ) is None
+
+
+def test_parse_frag():
+    assert parse_pcaps.parse_frag(frag1(120, 0x1234)) == \
+        ("frag", b"\x12\x34", (120, 0))
+    assert parse_pcaps.parse_frag(fragn(120, 0x1234, 64)) == \
+        ("frag", b"\x12\x34", (120, 64))
+    # RFRAG with sequence number 3 and the datagram size as offset
+    rfrag = bytes([0xe8, 7, 3 << 2, 80]) + struct.pack("!H", 120)
+    assert parse_pcaps.parse_frag(rfrag) == ("rfrag", b"\x07", (3, 120))
+    assert parse_pcaps.parse_frag(bytes([0xea, 7, 0xff, 0, 0, 0])) == \
+        ("rfrag_ack", b"\x07", b"\xff\x00\x00\x00")
+    # IPHC header, not fragmented
+    assert parse_pcaps.parse_frag(b"\x7a\x33\x3a") is None
+    # cut-off FRAGN header
+    assert parse_pcaps.parse_frag(fragn(120, 0x1234, 64)[:4]) is None
+
+
+def test_unpack_zep():
+    frame = data_frame(1, FORWARDER, CONSUMER, b"payload")
+    assert parse_pcaps.unpack_zep(zep(7, frame)) == (7, frame)
+    assert parse_pcaps.unpack_zep(zep(7, frame, version=1)) == (7, frame)
+    # ZEP ACK
+    assert parse_pcaps.unpack_zep(zep(7, frame, zep_type=2)) == (None, None)
+    assert parse_pcaps.unpack_zep(b"XX" + zep(7, frame)[2:]) == (None, None)
+    assert parse_pcaps.unpack_zep(zep(7, frame)[:20]) == (None, None)
+
+
+def test_unpack_record():
+    frame = data_frame(1, FORWARDER, CONSUMER, b"payload")
+    assert parse_pcaps.unpack_record(LINKTYPE_IPV6,
+                                     ipv6_udp(zep(7, frame))) == (7, frame)
+    # not ZEP
+    assert parse_pcaps.unpack_record(LINKTYPE_IPV6,
+                                     ipv6_udp(zep(7, frame), port=5683)) == \
+        (None, None)
+    assert parse_pcaps.unpack_record(
+        parse_pcaps.LINKTYPE_IEEE802_15_4_WITHFCS, frame + b"\xff\xff"
+    ) == (None, frame)
+
+
+def test_duplicates(tmp_path):
+    frame = data_frame(1, FORWARDER, CONSUMER, frag1(120, 1))
+    window = parse_pcaps.DUPLICATE_WINDOW
+    filename = str(tmp_path / "dup.pcap")
+    write_pcap(filename, sniffed([
+        # the same transmission captured by three sniffers
+        (1000000, 1, frame),
+        (1000100, 2, frame),
+        (1000200, 3, frame),
+        # captured again by the first sniffer: a retransmission
+        (1002000, 1, frame),
+        # captured by the second sniffer long after: a new transmission
+        (1002000 + window + 1, 2, frame),
+    ]))
+    stats = parse_pcaps.pcap_to_stats(filename, NAMES)
+    consumer = stats.nodes["m3-1"]
+    assert consumer.frames == 3
+    assert consumer.mac_retrans == 2
+    assert consumer.frags == 1
+    assert stats.first == 1000000
+    assert stats.last == 1002000 + window + 1
+
+
+def test_unknown_device_is_no_duplicate():
+    stats = parse_pcaps.PcapStats(NAMES)
+    frame = data_frame(1, FORWARDER, CONSUMER, b"\x7a")
+    stats.update(1000, None, frame)
+    stats.update(1100, None, frame)
+    assert stats.nodes["m3-1"].frames == 2
+
+
+def test_hop_latency(tmp_path):
+    filename = str(tmp_path / "hops.pcap")
+    # both fragments of a datagram are forwarded by the forwarder with a
+    # new tag, the first one is acknowledged on each hop
+    write_pcap(filename, sniffed([
+        (1000000, 1, data_frame(1, FORWARDER, CONSUMER, frag1(120, 1))),
+        (1000500, 1, ack_frame(1)),
+        (1001000, 1, data_frame(2, FORWARDER, CONSUMER, fragn(120, 1, 64))),
+        (1004000, 1, data_frame(7, PRODUCER, FORWARDER, frag1(120, 9))),
+        (1004500, 1, ack_frame(7)),
+        (1007000, 1, data_frame(8, PRODUCER, FORWARDER, fragn(120, 9, 64))),
+        # the consumer sends the first fragment again
+        (1500000, 1, data_frame(3, FORWARDER, CONSUMER, frag1(120, 1))),
+    ]))
+    stats = parse_pcaps.pcap_to_stats(filename, NAMES)
+    forwarder = stats.nodes["m3-2"]
+    consumer = stats.nodes["m3-1"]
+    assert sorted(forwarder.latencies) == [4000, 6000]
+    assert forwarder.acks == 1
+    assert stats.nodes["m3-3"].acks == 1
+    assert consumer.frag_retrans == 1
+    assert not consumer.latencies
+    rows = {row["node"]: row
+            for row in stats.rows({"timestamp": 1, "mode": "reass",
+                                   "count": 1, "delay": 1, "data_len": 1},
+                                  3)}
+    assert rows["m3-2"]["hop_latency_count"] == 2
+    assert rows["m3-2"]["hop_latency_mean"] == 5000
+    assert rows["m3-2"]["hop_latency_max"] == 6000
+    assert rows["m3-1"]["frags"] == 3
+    assert rows["m3-1"]["retrans_bursts"] == 1
+
+
+def merged_captures(sniffers=3, records=200, seed=1):
+    """
+    Returns the records of several sniffers as merged by the sniffer
+    aggregator: the records of each sniffer are in order, but they arrive
+    with a jitter of up to 5 ms, so the timestamps are out of order
+    """
+    rand = random.Random(seed)
+    res = []
+    for sniffer in range(sniffers):
+        for i in range(records):
+            timestamp = 1000000 + i * 1000 + rand.randrange(1000)
+            res.append((timestamp + rand.randrange(5000), timestamp,
+                        bytes([sniffer, i % 256])))
+    return [(timestamp, data) for _, timestamp, data in sorted(res)]
+
+
+def window_offsets(pcap, index, start, end):
+    return [offset for offset, _, _ in
+            parse_pcaps.window(pcap, index, start, end)]
+
+
+def expected_offsets(pcap, start, end):
+    return [offset for offset, timestamp, _ in pcap.records()
+            if start <= timestamp <= end]
+
+
+def test_window_out_of_order(tmp_path):
+    filename = str(tmp_path / "merged.pcap")
+    records = merged_captures()
+    assert [t for t, _ in records] != sorted(t for t, _ in records)
+    write_pcap(filename, records, LINKTYPE_IEEE802_15_4_NOFCS)
+    rand = random.Random(2)
+    with MmapPcap(filename) as pcap:
+        index = PcapIndex.build(pcap, stride=4)
+        assert len(index) == (len(records) + 3) // 4
+        first, last = records[0][0], max(t for t, _ in records)
+        windows = [(first, last), (0, first), (last, last + 1),
+                   (0, first - 1), (last + 1, last + 1000)]
+        for _ in range(100):
+            start = rand.randrange(first - 1000, last + 1000)
+            windows.append((start, start + rand.randrange(10000)))
+        for start, end in windows:
+            expected = expected_offsets(pcap, start, end)
+            assert window_offsets(pcap, index, start, end) == expected
+            span_start, span_end = index.span(start, end)
+            if expected:
+                assert span_start <= expected[0]
+                assert span_end is None or span_end > expected[-1]
+
+
+def test_window_cut_off(tmp_path):
+    filename = str(tmp_path / "cut.pcap")
+    records = merged_captures(records=20)
+    write_pcap(filename, records, LINKTYPE_IEEE802_15_4_NOFCS)
+    size = os.path.getsize(filename)
+    # the sniffer was stopped within the data and within the header of the
+    # last record
+    for cut in (1, len(records[-1][1]) + 2):
+        os.truncate(filename, size - cut)
+        with MmapPcap(filename) as pcap:
+            index = PcapIndex.build(pcap, stride=4)
+            offsets = [offset for offset, _, _ in pcap.records()]
+            assert len(offsets) == len(records) - 1
+            assert window_offsets(pcap, index, 0, 2 ** 62) == offsets
+            last = max(t for t, _ in records[:-1])
+            assert window_offsets(pcap, index, last, 2 ** 62) == \
+                expected_offsets(pcap, last, 2 ** 62)
+
+
+def test_load_index(tmp_path):
+    filename = str(tmp_path / "run.pcap")
+    records = merged_captures(records=20)
+    write_pcap(filename, records[:-10], LINKTYPE_IEEE802_15_4_NOFCS)
+    index_name = filename + parse_pcaps.INDEX_SUFFIX
+    with MmapPcap(filename) as pcap:
+        index = parse_pcaps.load_index(pcap, stride=4)
+    assert os.path.exists(index_name)
+    loaded = PcapIndex.load(index_name, filename)
+    assert loaded.entries == index.entries
+    assert loaded.stride == 4
+    # the capture grew after the index was stored
+    write_pcap(filename, records, LINKTYPE_IEEE802_15_4_NOFCS)
+    assert PcapIndex.load(index_name, filename) is None
+    with MmapPcap(filename) as pcap:
+        index = parse_pcaps.load_index(pcap, stride=4)
+        assert window_offsets(pcap, index, 0, 2 ** 62) == \
+            [offset for offset, _, _ in pcap.records()]
+    assert PcapIndex.load(index_name, filename).entries == index.entries
+    # same size, but modified
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert PcapIndex.load(index_name, filename) is None
+    # garbled index
+    with open(index_name, "wb") as index_file:
+        index_file.write(b"PCAPIDX")
+    assert PcapIndex.load(index_name, filename) is None
+    with MmapPcap(filename) as pcap:
+        assert parse_pcaps.load_index(pcap, stride=4).entries == \
+            index.entries
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020 Freie Universität Berlin
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Merges the time-to-completion (TTC) sketches of the runs in `-ttc.json` files
+as generated by parse_results.py per group of experiment parameters and prints
+quantiles of the TTC of each group as CSV, optionally with bootstrapped
+confidence intervals.
+"""
+
+import argparse
+import csv
+import json
+import re
+import sys
+
+import numpy as np
+
+import bootstrap
+
+from plot_cdf import MODE_PATTERN, US_PER_SEC
+from ttc_sketch import KLLSketch
+
+__author__ = "Martine S. Lenders"
+__copyright__ = "Copyright 2020 Freie Universität Berlin"
+__license__ = "LGPL v2.1"
+__email__ = "m.lenders@fu-berlin.de"
+
+GROUP_FIELDS = ["mode", "vrep", "nodes", "delay", "count"]
+QUANTILES = [0.5, 0.95, 0.99]
+# number of points between the smallest and largest TTC the bootstrapped
+# quantiles are resolved to
+CI_RESOLUTION = 1000
+
+
+def collect_sketches(filenames, group_by=None):
+    """
+    Merges the TTC sketches of all runs in the `-ttc.json` files in
+    `filenames` per group of `group_by` fields (default: all GROUP_FIELDS).
+    """
+    if group_by is None:
+        group_by = GROUP_FIELDS
+    comp = re.compile(MODE_PATTERN)
+    res = {}
+    # sort to make the merged sketches independent of the argument order
+    for filename in sorted(filenames):
+        with open(filename) as sketch_file:
+            sketches = json.load(sketch_file)
+        match = comp.match(sketches["mode"])
+        if match is None:
+            continue
+        fields = dict(sketches)
+        fields["mode"] = match.group("mode")
+        fields["vrep"] = bool(match.group("vrep"))
+        key = tuple(fields[f] for f in group_by)
+        if key not in res:
+            res[key] = {"sketch": KLLSketch(), "runs": [], "sent": 0}
+        for run in sketches["runs"]:
+            sketch = KLLSketch.from_dict(run["ttc"])
+            res[key]["sketch"].merge(sketch)
+            res[key]["runs"].append(sketch)
+            res[key]["sent"] += run["sent"]
+    return res
+
+
+def quantiles_ci(sketch, runs, quantiles, ci):
+    """
+    Returns the bounds of the bootstrap confidence intervals of `quantiles`
+    of the merged `sketch` by resampling the sketches of its `runs`
+    """
+    if not len(sketch):
+        return [float("nan")] * len(quantiles), \
+            [float("nan")] * len(quantiles)
+    edges = np.linspace(sketch.min, sketch.max, CI_RESOLUTION + 1)
+    cum_counts = [np.array(run.cdf(edges)) * len(run)
+                  if len(run) else np.zeros(len(edges))
+                  for run in runs]
+    return bootstrap.quantiles_ci(cum_counts, edges, quantiles, ci)
+
+
+def quantile_rows(sketches, group_by=None, quantiles=None, ci=None):
+    if group_by is None:
+        group_by = GROUP_FIELDS
+    if quantiles is None:
+        quantiles = QUANTILES
+    for key in sorted(sketches, key=str):
+        sketch = sketches[key]["sketch"]
+        row = dict(zip(group_by, key))
+        row["runs"] = len(sketches[key]["runs"])
+        row["sent"] = sketches[key]["sent"]
+        row["delivered"] = len(sketch)
+        row["delivery_ratio"] = len(sketch) / sketches[key]["sent"]
+        for q, value in zip(quantiles, sketch.quantiles(quantiles)):
+            row["p{:g}".format(q * 100)] = value / US_PER_SEC
+        if ci is not None:
+            lows, highs = quantiles_ci(sketch, sketches[key]["runs"],
+                                       quantiles, ci)
+            for q, low, high in zip(quantiles, lows, highs):
+                row["p{:g}_low".format(q * 100)] = low / US_PER_SEC
+                row["p{:g}_high".format(q * 100)] = high / US_PER_SEC
+        yield row
+
+
+def csl_group(values):
+    res = []
+    for value in values.split(","):
+        value = value.strip()
+        if value not in GROUP_FIELDS:
+            raise ValueError("Unknown field {}".format(value))
+        res.append(value)
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Prints the time-to-completion quantiles (in seconds) "
+                    "from the TTC sketches generated by ./parse_results.py"
+    )
+    parser.add_argument("-g", "--group-by", default=GROUP_FIELDS,
+                        type=csl_group,
+                        help="Comma separated list of fields to merge the "
+                             "sketches by. Possible values: {}. "
+                             "Default: all".format(", ".join(GROUP_FIELDS)))
+    parser.add_argument("--ci", type=bootstrap.confidence_type,
+                        metavar="LEVEL",
+                        help="Add the bounds of the bootstrap confidence "
+                             "intervals over the runs of the quantiles at "
+                             "LEVEL (e.g. {})"
+                             .format(bootstrap.DEFAULT_CONFIDENCE))
+    parser.add_argument("filenames", nargs="+",
+                        help="-ttc.json files as generated by "
+                             "./parse_results.py")
+    args = parser.parse_args()
+    sketches = collect_sketches(args.filenames, args.group_by)
+    fieldnames = args.group_by + \
+        ["runs", "sent", "delivered", "delivery_ratio"] + \
+        ["p{:g}".format(q * 100) for q in QUANTILES]
+    if args.ci is not None:
+        fieldnames += ["p{:g}_{}".format(q * 100, bound)
+                       for q in QUANTILES for bound in ["low", "high"]]
+    writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
+    writer.writeheader()
+    writer.writerows(quantile_rows(sketches, args.group_by, ci=args.ci))
+
+
+if __name__ == "__main__":
+    main()
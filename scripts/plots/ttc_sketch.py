@@ -0,0 +1,209 @@
+# Copyright (C) 2020 Freie Universität Berlin
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Mergeable quantile sketch (KLL) for time-to-completion (TTC) distributions.
+
+See Karnin, Lang, Liberty: "Optimal Quantile Approximation in Streams",
+FOCS 2016
+"""
+
+import bisect
+import math
+import random
+
+__author__ = "Martine S. Lenders"
+__copyright__ = "Copyright 2020 Freie Universität Berlin"
+__license__ = "LGPL v2.1"
+__email__ = "m.lenders@fu-berlin.de"
+
+DEFAULT_K = 200
+# capacity decay between compactor levels
+C = 2 / 3
+
+
+class KLLSketch:
+    """
+    KLL quantile sketch. Every compactor at level `h` holds items of weight
+    `2**h`. When the sketch grows too large, compactors are halved, promoting
+    every other item of a sorted compactor to the next level.
+
+    The randomness used in the compaction is seeded, so sketches built (and
+    merged) from the same values in the same order are identical.
+    """
+    def __init__(self, k=DEFAULT_K, seed=0):
+        self.k = k
+        self.n = 0
+        self.min = None
+        self.max = None
+        self.compactors = []
+        self._size = 0
+        self._rand = random.Random(seed)
+        self._grow()
+
+    def __len__(self):
+        return self.n
+
+    def _grow(self):
+        self.compactors.append([])
+        self._max_size = sum(self._capacity(h)
+                             for h in range(len(self.compactors)))
+
+    def _capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return int(math.ceil((C ** depth) * self.k)) + 1
+
+    def _compact(self, level):
+        compactor = self.compactors[level]
+        compactor.sort()
+        # keep the largest item at this level if the number of items is odd
+        odd = len(compactor) % 2
+        rest = compactor[-1:] if odd else []
+        items = compactor[:-1] if odd else compactor
+        offset = self._rand.randint(0, 1)
+        if level + 1 >= len(self.compactors):
+            self._grow()
+        promoted = items[offset::2]
+        self.compactors[level + 1].extend(promoted)
+        self.compactors[level] = rest
+        self._size -= len(items) - len(promoted)
+
+    def _compress(self):
+        while self._size >= self._max_size:
+            for level in range(len(self.compactors)):
+                if len(self.compactors[level]) >= self._capacity(level):
+                    self._compact(level)
+                    break
+            else:
+                break
+
+    def update(self, value):
+        self.compactors[0].append(value)
+        self.n += 1
+        self._size += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self._size >= self._max_size:
+            self._compress()
+
+    def extend(self, values):
+        for value in values:
+            self.update(value)
+
+    def merge(self, other):
+        """
+        Merges `other` into this sketch and returns this sketch. Both need
+        to have the same `k`.
+        """
+        if other.k != self.k:
+            raise ValueError("Cannot merge sketch with k={} into sketch with "
+                             "k={}".format(other.k, self.k))
+        if not other.n:
+            return self
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for level, compactor in enumerate(other.compactors):
+            self.compactors[level].extend(compactor)
+        self._size += other._size
+        self.n += other.n
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        self._compress()
+        return self
+
+    def _weighted_items(self):
+        items = sorted(
+            (item, 2 ** level)
+            for level, compactor in enumerate(self.compactors)
+            for item in compactor
+        )
+        values = []
+        cum_weights = []
+        total = 0
+        for value, weight in items:
+            total += weight
+            values.append(value)
+            cum_weights.append(total)
+        return values, cum_weights, total
+
+    def cdf(self, values):
+        """
+        Returns the estimated fraction of items <= value for each of `values`
+        """
+        items, cum_weights, total = self._weighted_items()
+        res = []
+        for value in values:
+            idx = bisect.bisect_right(items, value)
+            if not total:
+                res.append(float("nan"))
+            elif idx == 0:
+                res.append(0.0)
+            else:
+                res.append(cum_weights[idx - 1] / total)
+        return res
+
+    def quantiles(self, qs):
+        """
+        Returns the estimated `q`-quantile for each `q` in `qs`
+        """
+        items, cum_weights, total = self._weighted_items()
+        res = []
+        for q in qs:
+            if not total:
+                res.append(float("nan"))
+                continue
+            idx = bisect.bisect_left(cum_weights, q * total)
+            res.append(items[min(idx, len(items) - 1)])
+        return res
+
+    def quantile(self, q):
+        return self.quantiles([q])[0]
+
+    def to_dict(self):
+        return {
+            "k": self.k,
+            "n": self.n,
+            "min": self.min,
+            "max": self.max,
+            "compactors": [list(compactor) for compactor in self.compactors],
+        }
+
+    @classmethod
+    def from_dict(cls, obj, seed=0):
+        sketch = cls(k=obj["k"], seed=seed)
+        sketch.n = obj["n"]
+        sketch.min = obj["min"]
+        sketch.max = obj["max"]
+        sketch.compactors = [list(compactor)
+                             for compactor in obj["compactors"]]
+        sketch._size = sum(len(compactor)
+                           for compactor in sketch.compactors)
+        sketch._max_size = sum(sketch._capacity(h)
+                               for h in range(len(sketch.compactors)))
+        return sketch
+
+
+def ttcs(times):
+    """
+    Returns the TTCs (in microseconds) of the `times` rows as generated by
+    parse_results.py with both a send and a receive time. Empty or garbled
+    times are skipped, like pandas reads them as NaN.
+    """
+    for row in times:
+        try:
+            yield float(row["recv_time"]) - float(row["send_time"])
+        except (KeyError, TypeError, ValueError):
+            continue
+
+
+def ttc_sketch(times, k=DEFAULT_K):
+    sketch = KLLSketch(k=k)
+    sketch.extend(ttcs(times))
+    return sketch